@@ -0,0 +1 @@
+"""Benchmarks for iact_observation_planner."""
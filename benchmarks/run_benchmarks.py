@@ -0,0 +1,294 @@
+"""
+Benchmarks of the stages of the planning pipeline.
+
+All targets are synthetic rd/ coordinates or names resolved by a local
+stand-in resolver, and the automatic IERS download of astropy is disabled, so no
+network access is needed.
+Each benchmark scales one dimension (nights, targets or samples per night) and
+reports the best wall time of several repetitions and the peak memory of one
+additional run traced with tracemalloc. The benchmarks run with the default
+site configuration, without IOP_SITE_CONFIG, so that the caches of a deployed
+configuration (results, twilight tables, seasons and target names) are
+neither read nor written. The results are written to a JSON file
+that can be compared with the results of another commit:
+
+    python -m benchmarks.run_benchmarks --output new.json
+    python -m benchmarks.run_benchmarks --output new.json --compare old.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+
+from datetime import datetime, timedelta
+
+import numpy as np
+from astropy.utils import iers
+
+from iact_observation_planner import iact_observation_planner
+from iact_observation_planner import nights as iop_nights
+from iact_observation_planner import targets as iop_targets
+
+DATE = datetime(2021, 3, 9)
+SITE = "HESS"
+DARKNESS = "dark"
+# simulated latency of a name lookup in seconds
+RESOLVE_LATENCY = 0.05
+
+FULL_SCALES = {
+    "nights": [1, 30, 365],
+    "targets": [1, 10, 100, 1000],
+    "samples": [50, 200, 1000],
+}
+QUICK_SCALES = {
+    "nights": [1, 3],
+    "targets": [1, 10],
+    "samples": [50, 200],
+}
+
+
+def synthetic_targets(n_targets, seed=0):
+    """target strings of random positions visible from the southern hemisphere"""
+    rng = np.random.RandomState(seed)
+    ra = rng.uniform(0, 360, n_targets)
+    dec = rng.uniform(-80, 20, n_targets)
+    return [
+        f"rd/{ra[i]:.4f}d,{dec[i]:.4f}d/bench{i};30;2" for i in range(n_targets)
+    ]
+
+
+def site_and_darkness():
+    site = iact_observation_planner.parse_site(SITE)["site"]
+    darkness = iact_observation_planner.parse_darkness(DARKNESS)["darkness"]
+    return site, darkness
+
+
+def bench_resolve_target_list(n_targets, **_):
+    names = synthetic_targets(n_targets)
+    return lambda: iop_targets.resolve_target_list(names)
+
+
+def bench_resolve_target_names(n_targets, **_):
+    """resolves names concurrently through a local resolver with a latency"""
+    names = [f"bench{i}" for i in range(n_targets)]
+
+    def run():
+        cache = iop_targets.TargetCache(
+            resolver=iop_targets.LocalResolver(latency=RESOLVE_LATENCY)
+        )
+        asyncio.run(iop_targets.resolve_target_list_async(names, cache))
+
+    return run
+
+
+def bench_find_sun_rise_and_set(n_nights, **_):
+    site, darkness = site_and_darkness()
+    dates = [DATE + timedelta(days=i) for i in range(n_nights)]
+
+    def run():
+        for date in dates:
+            iop_nights.find_sun_rise_and_set(date, site, darkness)
+
+    return run
+
+
+def bench_calculate_moon_positions(n_samples, **_):
+    site, darkness = site_and_darkness()
+    night = iop_nights.Night(DATE, site, darkness, n_samples=n_samples)
+    time_range = night.time_range
+    return lambda: night.calculate_moon_positions(time_range)
+
+
+def bench_plan_target(n_targets, n_samples, engine, **_):
+    site, darkness = site_and_darkness()
+    targets = iop_targets.resolve_target_list(synthetic_targets(n_targets))
+
+    def run():
+        night = iop_nights.Night(
+            DATE, site, darkness, n_samples=n_samples, engine=engine
+        )
+        night.plan_targets(targets)
+
+    return run
+
+
+def bench_plan_targets(n_nights, n_targets, engine, **_):
+    names = synthetic_targets(n_targets)
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            iact_observation_planner.plan_targets(
+                names, SITE, DARKNESS, f"{DATE:%Y-%m-%d}", n_nights, engine=engine
+            )
+
+    return run
+
+
+def benchmark_cases(scales):
+    """(stage, benchmark, params) of all benchmark runs"""
+    cases = []
+    for n_targets in scales["targets"]:
+        cases.append(("resolve_target_list", bench_resolve_target_list, {"n_targets": n_targets}))
+    for n_targets in scales["targets"]:
+        cases.append(("resolve_target_names", bench_resolve_target_names, {"n_targets": n_targets}))
+    for n_nights in scales["nights"]:
+        cases.append(("find_sun_rise_and_set", bench_find_sun_rise_and_set, {"n_nights": n_nights}))
+    for n_samples in scales["samples"]:
+        cases.append(("calculate_moon_positions", bench_calculate_moon_positions, {"n_samples": n_samples}))
+    for n_targets in scales["targets"]:
+        cases.append(("plan_target", bench_plan_target, {"n_targets": n_targets, "n_samples": 200}))
+    for n_samples in scales["samples"]:
+        cases.append(("plan_target", bench_plan_target, {"n_targets": 10, "n_samples": n_samples}))
+    for n_nights in scales["nights"]:
+        cases.append(("plan_targets", bench_plan_targets, {"n_nights": n_nights, "n_targets": 10}))
+    for n_targets in scales["targets"]:
+        cases.append(("plan_targets", bench_plan_targets, {"n_nights": 1, "n_targets": n_targets}))
+
+    # the sweeps share their central point, run it only once
+    unique_cases = []
+    for case in cases:
+        if case not in unique_cases:
+            unique_cases.append(case)
+    return unique_cases
+
+
+def measure(run, repeat):
+    """best wall time of `repeat` runs and the peak memory of a traced run"""
+    run()  # warm up caches and imports
+
+    wall_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        wall_times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        run()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return min(wall_times), peak_memory
+
+
+@contextlib.contextmanager
+def default_site_config():
+    """unsets IOP_SITE_CONFIG, so that no caches next to a deployed site
+    configuration are used"""
+    site_config = os.environ.pop("IOP_SITE_CONFIG", None)
+    try:
+        yield
+    finally:
+        if site_config is not None:
+            os.environ["IOP_SITE_CONFIG"] = site_config
+
+
+def run_benchmarks(scales, repeat=3, engine="astropy", stages=None):
+    """runs all benchmark cases and returns the results as a dict"""
+    results = []
+    for stage, benchmark, params in benchmark_cases(scales):
+        if stages and stage not in stages:
+            continue
+        with iers.conf.set_temp("auto_download", False), default_site_config():
+            wall_time, peak_memory = measure(
+                benchmark(engine=engine, **params), repeat
+            )
+        results.append(
+            {
+                "stage": stage,
+                "params": params,
+                "wall_time": wall_time,
+                "peak_memory": peak_memory,
+            }
+        )
+        print(format_result(results[-1]))
+
+    return {"metadata": metadata(engine, repeat), "results": results}
+
+
+def metadata(engine, repeat):
+    import astropy
+
+    commit = None
+    with contextlib.suppress(OSError, subprocess.CalledProcessError):
+        commit = (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+
+    return {
+        "commit": commit,
+        "date": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "astropy": astropy.__version__,
+        "numpy": np.__version__,
+        "engine": engine,
+        "repeat": repeat,
+    }
+
+
+def result_key(result):
+    params = ", ".join(f"{key}={value}" for key, value in sorted(result["params"].items()))
+    return f"{result['stage']}({params})"
+
+
+def format_result(result):
+    return "{:60} {:10.4f} s {:10.1f} MiB".format(
+        result_key(result), result["wall_time"], result["peak_memory"] / 2 ** 20
+    )
+
+
+def compare(baseline, current):
+    """prints the ratio of wall time and peak memory for all common results"""
+    baseline_results = {result_key(result): result for result in baseline["results"]}
+    out = "{:60} {:>10} {:>10}\n".format("benchmark", "time", "memory")
+    for result in current["results"]:
+        key = result_key(result)
+        if key not in baseline_results:
+            continue
+        base = baseline_results[key]
+        out += "{:60} {:9.2f}x {:9.2f}x\n".format(
+            key,
+            result["wall_time"] / base["wall_time"],
+            result["peak_memory"] / max(base["peak_memory"], 1),
+        )
+    print(out)
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark the planning pipeline")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", default=None, help="results file to compare to")
+    parser.add_argument("--quick", action="store_true", help="only run small scales")
+    parser.add_argument("--repeat", default=3, type=int)
+    parser.add_argument("--engine", default="astropy", choices=["astropy", "fast"])
+    parser.add_argument("--stages", nargs="+", default=None, help="stages to run")
+    args = parser.parse_args(argv)
+
+    scales = QUICK_SCALES if args.quick else FULL_SCALES
+    results = run_benchmarks(scales, args.repeat, args.engine, args.stages)
+
+    with open(args.output, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            compare(json.load(baseline_file), results)
+
+    return 0
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""allocation.py
+
+allocation of observation runs to the planned targets.
+
+The planned nights are split into consecutive run slots of `run_duration`
+starting at sun set. A slot is eligible for a target if the target is visible
+during the whole slot, which is looked up in the `VisibilityIndex` of the
+nights. The runs are then assigned greedily: the target with the
+fewest free eligible slots per missing run is served first and takes the free
+slot that the fewest other unfinished targets could use, so that targets with
+short windows are not crowded out by targets that are visible all night.
+"""
+
+import heapq
+
+import numpy as np
+import astropy.units as u
+from astropy.units import Quantity
+from matplotlib.dates import date2num, num2date
+
+from iact_observation_planner import profiling
+from iact_observation_planner.targets import TargetCatalogue
+from iact_observation_planner.visibility import VisibilityIndex
+
+# slack when comparing slot edges with visibility edges (1 s, in days)
+EDGE_TOLERANCE = 1.0 / 86400
+
+
+class Allocation:
+    """observation runs assigned to the targets
+
+    Attributes:
+        runs (dict): list of (name, start, end) runs per night-date, sorted by time
+        requested_hours (dict): requested observation hours per target
+        allocated_hours (dict): allocated observation hours per target
+        run_hours (float): duration of one run in hours, None if unknown
+    """
+
+    def __init__(self, runs, requested_hours, allocated_hours, run_hours=None):
+        self.runs = runs
+        self.requested_hours = requested_hours
+        self.allocated_hours = allocated_hours
+        self.run_hours = run_hours
+
+    def __repr__(self):
+        n_runs = sum(len(runs) for runs in self.runs.values())
+        return f"Allocation of {n_runs} runs in {len(self.runs)} nights"
+
+    def runs_of(self, name):
+        """all (start, end) runs allocated to a target"""
+        return [
+            (start, end)
+            for runs in self.runs.values()
+            for run_name, start, end in runs
+            if run_name == name
+        ]
+
+    def is_fulfilled(self, name):
+        """whether a target got all runs that fit into its requested hours, a
+        request below one run is never fulfilled"""
+        if self.is_below_one_run(name):
+            return False
+        hours = self.requested_hours[name]
+        if self.run_hours:
+            hours = requested_runs(hours, self.run_hours) * self.run_hours
+        return self.allocated_hours[name] >= hours - 1e-9
+
+    def is_below_one_run(self, name):
+        """whether a target requested observation time, but less than one run"""
+        hours = self.requested_hours[name]
+        return bool(self.run_hours) and hours > 0 and not requested_runs(
+            hours, self.run_hours
+        )
+
+    def unfulfilled(self):
+        """targets that did not get all runs that fit into their requested hours"""
+        return [name for name in self.requested_hours if not self.is_fulfilled(name)]
+
+
+def requested_runs(hours, run_hours):
+    """number of whole runs that fit into the requested hours, the allocated
+    time never exceeds the request"""
+    return int(np.floor(hours / run_hours + 1e-9))
+
+
+def run_slots(nights, run_duration):
+    """splits the nights into consecutive run slots starting at sun set
+
+    Args:
+        nights (array): planned nights
+        run_duration (Quantity): duration of one run
+
+    Returns:
+        slot_nights, slot_starts, slot_ends (ndarray): index of the night, start and
+            end (matplotlib date numbers) of all slots
+    """
+    duration = Quantity(run_duration).to_value(u.day)
+
+    slot_nights, slot_starts = [], []
+    for i, night in enumerate(nights):
+        sun_set, sun_rise = date2num([night.sun_set, night.sun_rise])
+        n_slots = int(np.floor((sun_rise - sun_set) / duration + 1e-9))
+        slot_nights.append(np.full(n_slots, i, dtype=int))
+        slot_starts.append(sun_set + duration * np.arange(n_slots))
+
+    slot_nights = np.concatenate(slot_nights) if nights else np.zeros(0, dtype=int)
+    slot_starts = np.concatenate(slot_starts) if nights else np.zeros(0)
+    return slot_nights, slot_starts, slot_starts + duration
+
+
+def eligibility(index, names, slot_starts, slot_ends):
+    """boolean matrix of the slots during which each target is visible
+
+    Args:
+        index (VisibilityIndex): index over the visibility of the planned nights
+        names (array): names of the targets
+        slot_starts, slot_ends (ndarray): run slots, see `run_slots`
+
+    Returns:
+        eligible (ndarray): shape (n_targets, n_slots)
+    """
+    rows = {name: row for row, name in reversed(list(enumerate(names)))}
+    index_rows = np.array([rows.get(name, -1) for name in index.names], dtype=int)
+    eligible = np.zeros((len(names), len(slot_starts)), dtype=bool)
+
+    for slot, (start, end) in enumerate(zip(slot_starts, slot_ends)):
+        intervals = index.containing(start + EDGE_TOLERANCE, end - EDGE_TOLERANCE)
+        slot_rows = index_rows[index.targets[intervals]]
+        eligible[slot_rows[slot_rows >= 0], slot] = True
+
+    return eligible
+
+
+@profiling.stage("allocate")
+def allocate(nights, targets, run_duration, index=None):
+    """allocates runs of `run_duration` to the targets in the planned nights,
+    up to the requested hours of each target and without overlapping runs. Only
+    whole runs are allocated, e.g. 4 runs of 28 min (1.87 h) for 2 h.
+
+    Args:
+        nights (array): planned nights with filled schedules
+        targets (array or TargetCatalogue): planned targets
+        run_duration (str or Quantity): duration of one run, e.g. "28 min"
+        index (VisibilityIndex): index over the nights, built if not given
+
+    Returns:
+        allocation (Allocation): the allocated runs
+    """
+    catalogue = TargetCatalogue.from_targets(targets) if len(targets) else None
+    names = [] if catalogue is None else [str(name) for name in catalogue.names]
+    duration_hours = Quantity(run_duration).to_value(u.hour)
+
+    # the first entry of a name counts, as in the schedules of the nights
+    requested = {}
+    for name, hours in zip(names, [] if catalogue is None else catalogue.hours):
+        requested.setdefault(name, float(hours))
+    names = list(requested)
+
+    slot_nights, slot_starts, slot_ends = run_slots(nights, run_duration)
+    if index is None:
+        index = VisibilityIndex.from_nights(nights)
+    eligible = eligibility(index, names, slot_starts, slot_ends)
+
+    missing = np.array(
+        [requested_runs(requested[name], duration_hours) for name in names],
+        dtype=int,
+    )
+    free = np.ones(len(slot_starts), dtype=bool)
+    assigned = np.full(len(slot_starts), -1, dtype=int)
+
+    # number of unfinished targets that could use each slot
+    demand = eligible[missing > 0].sum(axis=0)
+
+    def priority(row):
+        # free eligible slots per missing run, ties go to the target with fewer
+        # free eligible slots
+        n_free = np.count_nonzero(eligible[row] & free)
+        return (n_free / missing[row], n_free)
+
+    queue = [(priority(row), row) for row in range(len(names)) if missing[row] > 0]
+    heapq.heapify(queue)
+    while queue:
+        _, row = heapq.heappop(queue)
+        current = priority(row)
+        if current[1] == 0:
+            demand -= eligible[row]
+            continue
+        if queue and current > queue[0][0]:
+            # the priority is outdated, the free slots have been taken by others
+            heapq.heappush(queue, (current, row))
+            continue
+
+        candidates = np.flatnonzero(eligible[row] & free)
+        slot = candidates[np.argmin(demand[candidates])]
+        free[slot] = False
+        assigned[slot] = row
+        missing[row] -= 1
+
+        if missing[row] > 0:
+            heapq.heappush(queue, (priority(row), row))
+        else:
+            demand -= eligible[row]
+
+    runs = {night.date: [] for night in nights}
+    allocated = {name: 0.0 for name in names}
+    for slot in np.flatnonzero(assigned >= 0):
+        name = names[assigned[slot]]
+        start, end = num2date([slot_starts[slot], slot_ends[slot]])
+        runs[nights[slot_nights[slot]].date].append((name, start, end))
+        allocated[name] += duration_hours
+
+    return Allocation(runs, requested, allocated, duration_hours)
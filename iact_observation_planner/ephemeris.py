@@ -0,0 +1,374 @@
+"""ephemeris.py
+
+vectorized low precision ephemerides of the sun and the moon.
+
+The moon follows the truncated ELP-2000/82 series from J. Meeus,
+"Astronomical Algorithms" (2nd ed., chapter 47), the sun the low precision
+solution of chapter 25. Positions are corrected for nutation and the
+topocentric parallax of the observer and refracted for standard conditions,
+like the ephem positions they replace. Compared to ephem, the moon altitude
+and azimuth agree to better than ~0.03 deg above an altitude of -0.5 deg and the
+illuminated fraction to better than 0.1 %. Further below the horizon ephem uses
+a different refraction model and the altitudes differ by up to ~0.8 deg.
+"""
+
+import numpy as np
+import astropy.units as u
+
+# D, M, M', F, coefficient of sin for the longitude [1e-6 deg],
+# coefficient of cos for the distance [1e-3 km] (Meeus table 47.A)
+_MOON_LR_TERMS = np.array(
+    [
+        [0, 0, 1, 0, 6288774, -20905355],
+        [2, 0, -1, 0, 1274027, -3699111],
+        [2, 0, 0, 0, 658314, -2955968],
+        [0, 0, 2, 0, 213618, -569925],
+        [0, 1, 0, 0, -185116, 48888],
+        [0, 0, 0, 2, -114332, -3149],
+        [2, 0, -2, 0, 58793, 246158],
+        [2, -1, -1, 0, 57066, -152138],
+        [2, 0, 1, 0, 53322, -170733],
+        [2, -1, 0, 0, 45758, -204586],
+        [0, 1, -1, 0, -40923, -129620],
+        [1, 0, 0, 0, -34720, 108743],
+        [0, 1, 1, 0, -30383, 104755],
+        [2, 0, 0, -2, 15327, 10321],
+        [0, 0, 1, 2, -12528, 0],
+        [0, 0, 1, -2, 10980, 79661],
+        [4, 0, -1, 0, 10675, -34782],
+        [0, 0, 3, 0, 10034, -23210],
+        [4, 0, -2, 0, 8548, -21636],
+        [2, 1, -1, 0, -7888, 24208],
+        [2, 1, 0, 0, -6766, 30824],
+        [1, 0, -1, 0, -5163, -8379],
+        [1, 1, 0, 0, 4987, -16675],
+        [2, -1, 1, 0, 4036, -12831],
+        [2, 0, 2, 0, 3994, -10445],
+        [4, 0, 0, 0, 3861, -11650],
+        [2, 0, -3, 0, 3665, 14403],
+        [0, 1, -2, 0, -2689, -7003],
+        [2, 0, -1, 2, -2602, 0],
+        [2, -1, -2, 0, 2390, 10056],
+        [1, 0, 1, 0, -2348, 6322],
+        [2, -2, 0, 0, 2236, -9884],
+        [0, 1, 2, 0, -2120, 5751],
+        [0, 2, 0, 0, -2069, 0],
+        [2, -2, -1, 0, 2048, -4950],
+        [2, 0, 1, -2, -1773, 4130],
+        [2, 0, 0, 2, -1595, 0],
+        [4, -1, -1, 0, 1215, -3958],
+        [0, 0, 2, 2, -1110, 0],
+        [3, 0, -1, 0, -892, 3258],
+        [2, 1, 1, 0, -810, 2616],
+        [4, -1, -2, 0, 759, -1897],
+        [0, 2, -1, 0, -713, -2117],
+        [2, 2, -1, 0, -700, 2354],
+        [2, 1, -2, 0, 691, 0],
+        [2, -1, 0, -2, 596, 0],
+        [4, 0, 1, 0, 549, -1423],
+        [0, 0, 4, 0, 537, -1117],
+        [4, -1, 0, 0, 520, -1571],
+        [1, 0, -2, 0, -487, -1739],
+        [2, 1, 0, -2, -399, 0],
+        [0, 0, 2, -2, -381, -4421],
+        [1, 1, 1, 0, 351, 0],
+        [3, 0, -2, 0, -340, 0],
+        [4, 0, -3, 0, 330, 0],
+        [2, -1, 2, 0, 327, 0],
+        [0, 2, 1, 0, -323, 1165],
+        [1, 1, -1, 0, 299, 0],
+        [2, 0, 3, 0, 294, 0],
+        [2, 0, -1, -2, 0, 8752],
+    ],
+    dtype=float,
+)
+
+# D, M, M', F, coefficient of sin for the latitude [1e-6 deg] (Meeus table 47.B)
+_MOON_B_TERMS = np.array(
+    [
+        [0, 0, 0, 1, 5128122],
+        [0, 0, 1, 1, 280602],
+        [0, 0, 1, -1, 277693],
+        [2, 0, 0, -1, 173237],
+        [2, 0, -1, 1, 55413],
+        [2, 0, -1, -1, 46271],
+        [2, 0, 0, 1, 32573],
+        [0, 0, 2, 1, 17198],
+        [2, 0, 1, -1, 9266],
+        [0, 0, 2, -1, 8822],
+        [2, -1, 0, -1, 8216],
+        [2, 0, -2, -1, 4324],
+        [2, 0, 1, 1, 4200],
+        [2, 1, 0, -1, -3359],
+        [2, -1, -1, 1, 2463],
+        [2, -1, 0, 1, 2211],
+        [2, -1, -1, -1, 2065],
+        [0, 1, -1, -1, -1870],
+        [4, 0, -1, -1, 1828],
+        [0, 1, 0, 1, -1794],
+        [0, 0, 0, 3, -1749],
+        [0, 1, -1, 1, -1565],
+        [1, 0, 0, 1, -1491],
+        [0, 1, 1, 1, -1475],
+        [0, 1, 1, -1, -1410],
+        [0, 1, 0, -1, -1344],
+        [1, 0, 0, -1, -1335],
+        [0, 0, 3, 1, 1107],
+        [4, 0, 0, -1, 1021],
+        [4, 0, -1, 1, 833],
+        [0, 0, 1, -3, 777],
+        [4, 0, -2, 1, 671],
+        [2, 0, 0, -3, 607],
+        [2, 0, 2, -1, 596],
+        [2, -1, 1, -1, 491],
+        [2, 0, -2, 1, -451],
+        [0, 0, 3, -1, 439],
+        [2, 0, 2, 1, 422],
+        [2, 0, -3, -1, 421],
+        [2, 1, -1, 1, -366],
+        [2, 1, 0, 1, -351],
+        [4, 0, 0, 1, 331],
+        [2, -1, 1, 1, 315],
+        [2, -2, 0, -1, 302],
+        [0, 0, 1, 3, -283],
+        [2, 1, 1, -1, -229],
+        [1, 1, 0, -1, 223],
+        [1, 1, 0, 1, 223],
+        [0, 1, -2, -1, -220],
+        [2, 1, -1, -1, -220],
+        [1, 0, 1, 1, -185],
+        [2, -1, -2, -1, 181],
+        [0, 1, 2, 1, -177],
+        [4, 0, -2, -1, 176],
+        [4, -1, -1, -1, 166],
+        [1, 0, 1, -1, -164],
+        [4, 0, 1, -1, 132],
+        [1, 0, -1, -1, -119],
+        [4, -1, 0, -1, 115],
+        [2, -2, 0, 1, 107],
+    ],
+    dtype=float,
+)
+
+_AU_KM = 149597870.7
+
+
+def moon_positions(times, site):
+    """calculates the position and phase of the moon for an array of times
+
+    Args:
+        times (Time): times to calculate the moon conditions for
+        site (EarthLocation): site definition
+
+    Returns:
+        moon_conditions (dict): altitudes and azimuths in degrees and the
+            illuminated fraction of the moon in percent ("phases"), like ephem
+    """
+    jd_tt = np.atleast_1d(times.tt.jd)
+    jd_ut = np.atleast_1d(times.utc.jd)
+    t_cen = (jd_tt - 2451545.0) / 36525.0
+
+    moon_lon, moon_lat, moon_dist = _moon_ecliptic(t_cen)
+    sun_lon, sun_dist = _sun_ecliptic(t_cen)
+    nutation_lon, obliquity = nutation_and_obliquity(t_cen)
+
+    # illuminated fraction from the geocentric elongation (Meeus 48.2, 48.3)
+    elongation = np.arccos(np.cos(moon_lat) * np.cos(moon_lon - sun_lon))
+    phase_angle = np.arctan2(
+        sun_dist * np.sin(elongation), moon_dist - sun_dist * np.cos(elongation)
+    )
+    phases = 50.0 * (1.0 + np.cos(phase_angle))
+
+    # geocentric equatorial position of date
+    moon_lon = moon_lon + nutation_lon
+    ra = np.arctan2(
+        np.sin(moon_lon) * np.cos(obliquity) - np.tan(moon_lat) * np.sin(obliquity),
+        np.cos(moon_lon),
+    )
+    dec = np.arcsin(
+        np.sin(moon_lat) * np.cos(obliquity)
+        + np.cos(moon_lat) * np.sin(obliquity) * np.sin(moon_lon)
+    )
+
+    sidereal = apparent_sidereal_time(jd_ut, t_cen, nutation_lon, obliquity)
+    alt, az = _topocentric_alt_az(ra, dec, moon_dist, sidereal, site)
+    alt = alt + refraction(alt)
+
+    moon_conditions = {
+        "altitudes": np.degrees(alt),
+        "azimuths": np.degrees(az),
+        "phases": phases,
+    }
+    return moon_conditions
+
+
+def sun_positions(times, site):
+    """calculates the position of the sun for an array of times
+
+    Args:
+        times (Time): times to calculate the sun position for
+        site (EarthLocation): site definition
+
+    Returns:
+        sun_positions (dict): altitudes and azimuths of the center of the sun in
+            degrees. The altitudes are not refracted, like the ones ephem solves
+            the twilight times for with horizons below -1 deg.
+    """
+    jd_tt = np.atleast_1d(times.tt.jd)
+    jd_ut = np.atleast_1d(times.utc.jd)
+    t_cen = (jd_tt - 2451545.0) / 36525.0
+
+    sun_lon, sun_dist = _sun_ecliptic(t_cen)
+    nutation_lon, obliquity = nutation_and_obliquity(t_cen)
+
+    # apparent longitude, corrected for nutation and aberration (Meeus 25.8)
+    sun_lon = sun_lon + nutation_lon - np.radians(20.4898 / 3600.0) * _AU_KM / sun_dist
+    ra = np.arctan2(np.cos(obliquity) * np.sin(sun_lon), np.cos(sun_lon))
+    dec = np.arcsin(np.sin(obliquity) * np.sin(sun_lon))
+
+    sidereal = apparent_sidereal_time(jd_ut, t_cen, nutation_lon, obliquity)
+    alt, az = _topocentric_alt_az(ra, dec, sun_dist, sidereal, site)
+
+    return {"altitudes": np.degrees(alt), "azimuths": np.degrees(az)}
+
+
+def apparent_sidereal_time(jd_ut, t_cen, nutation_lon, obliquity):
+    """greenwich apparent sidereal time in radians (Meeus 12.4 plus the
+    equation of the equinoxes)"""
+    days = jd_ut - 2451545.0
+    gmst = (
+        280.46061837
+        + 360.98564736629 * days
+        + 0.000387933 * t_cen ** 2
+        - t_cen ** 3 / 38710000.0
+    )
+    return np.radians(gmst % 360.0) + nutation_lon * np.cos(obliquity)
+
+
+def refraction(alt):
+    """atmospheric refraction in radians for a true altitude in radians
+    (Saemundsson's formula for 1010 mbar and 15 deg C, ephem's defaults). Below
+    -1 deg the refraction is kept at its value at -1 deg."""
+    alt_deg = np.maximum(np.degrees(alt), -1.0)
+    arcmin = 1.02 / np.tan(np.radians(alt_deg + 10.3 / (alt_deg + 5.11)))
+    arcmin *= 283.0 / 288.0
+    return np.radians(arcmin / 60.0)
+
+
+def _moon_ecliptic(t_cen):
+    """geocentric ecliptic longitude, latitude (radians) and distance (km)"""
+    mean_lon = _poly(t_cen, 218.3164477, 481267.88123421, -0.0015786, 1 / 538841.0, -1 / 65194000.0)
+    elong = _poly(t_cen, 297.8501921, 445267.1114034, -0.0018819, 1 / 545868.0, -1 / 113065000.0)
+    sun_anom = _poly(t_cen, 357.5291092, 35999.0502909, -0.0001536, 1 / 24490000.0)
+    moon_anom = _poly(t_cen, 134.9633964, 477198.8675055, 0.0087414, 1 / 69699.0, -1 / 14712000.0)
+    arg_lat = _poly(t_cen, 93.2720950, 483202.0175233, -0.0036539, -1 / 3526000.0, 1 / 863310000.0)
+    a_1 = np.radians(119.75 + 131.849 * t_cen)
+    a_2 = np.radians(53.09 + 479264.290 * t_cen)
+    a_3 = np.radians(313.45 + 481266.484 * t_cen)
+    ecc = 1.0 - 0.002516 * t_cen - 0.0000074 * t_cen ** 2
+
+    fundamental = np.stack([elong, sun_anom, moon_anom, arg_lat])
+
+    def series(terms, func, column):
+        args = terms[:, :4] @ fundamental
+        # terms containing the anomaly of the sun scale with the eccentricity
+        scale = ecc[np.newaxis, :] ** np.abs(terms[:, 1])[:, np.newaxis]
+        return np.sum(terms[:, column, np.newaxis] * scale * func(args), axis=0)
+
+    sum_l = series(_MOON_LR_TERMS, np.sin, 4)
+    sum_r = series(_MOON_LR_TERMS, np.cos, 5)
+    sum_b = series(_MOON_B_TERMS, np.sin, 4)
+
+    sum_l += 3958 * np.sin(a_1) + 1962 * np.sin(mean_lon - arg_lat) + 318 * np.sin(a_2)
+    sum_b += (
+        -2235 * np.sin(mean_lon)
+        + 382 * np.sin(a_3)
+        + 175 * np.sin(a_1 - arg_lat)
+        + 175 * np.sin(a_1 + arg_lat)
+        + 127 * np.sin(mean_lon - moon_anom)
+        - 115 * np.sin(mean_lon + moon_anom)
+    )
+
+    lon = mean_lon + np.radians(sum_l / 1e6)
+    lat = np.radians(sum_b / 1e6)
+    dist = 385000.56 + sum_r / 1000.0
+    return lon, lat, dist
+
+
+def _sun_ecliptic(t_cen):
+    """geometric ecliptic longitude (radians) and distance (km) of the sun"""
+    mean_lon = np.radians(280.46646 + 36000.76983 * t_cen + 0.0003032 * t_cen ** 2)
+    anom = np.radians(357.52911 + 35999.05029 * t_cen - 0.0001537 * t_cen ** 2)
+    ecc = 0.016708634 - 0.000042037 * t_cen
+    center = np.radians(
+        (1.914602 - 0.004817 * t_cen - 0.000014 * t_cen ** 2) * np.sin(anom)
+        + (0.019993 - 0.000101 * t_cen) * np.sin(2 * anom)
+        + 0.000289 * np.sin(3 * anom)
+    )
+    dist = 1.000001018 * (1 - ecc ** 2) / (1 + ecc * np.cos(anom + center))
+    return mean_lon + center, dist * _AU_KM
+
+
+def nutation_and_obliquity(t_cen):
+    """nutation in longitude and true obliquity of the ecliptic in radians"""
+    node = np.radians(125.04452 - 1934.136261 * t_cen)
+    sun_lon = np.radians(280.4665 + 36000.7698 * t_cen)
+    moon_lon = np.radians(218.3165 + 481267.8813 * t_cen)
+    nutation_lon = (
+        -17.20 * np.sin(node)
+        - 1.32 * np.sin(2 * sun_lon)
+        - 0.23 * np.sin(2 * moon_lon)
+        + 0.21 * np.sin(2 * node)
+    )
+    nutation_obl = (
+        9.20 * np.cos(node)
+        + 0.57 * np.cos(2 * sun_lon)
+        + 0.10 * np.cos(2 * moon_lon)
+        - 0.09 * np.cos(2 * node)
+    )
+    mean_obl = 23.4392911 * 3600 - 46.8150 * t_cen - 0.00059 * t_cen ** 2
+    return (
+        np.radians(nutation_lon / 3600.0),
+        np.radians((mean_obl + nutation_obl) / 3600.0),
+    )
+
+
+def _topocentric_alt_az(ra, dec, dist, sidereal, site):
+    """converts geocentric equatorial coordinates of date into topocentric
+    altitude and azimuth (radians) by subtracting the site position"""
+    hour_angle = sidereal - ra
+    # earth-fixed geocentric position of the body and the site in km
+    x_body = dist * np.cos(dec) * np.cos(hour_angle)
+    y_body = -dist * np.cos(dec) * np.sin(hour_angle)
+    z_body = dist * np.sin(dec)
+    x_site, y_site, z_site = (
+        coord.to_value(u.km) for coord in site.to_geocentric()
+    )
+    x_rel = x_body - x_site
+    y_rel = y_body - y_site
+    z_rel = z_body - z_site
+
+    lon = site.lon.to_value(u.rad)
+    lat = site.lat.to_value(u.rad)
+    east = -np.sin(lon) * x_rel + np.cos(lon) * y_rel
+    north = (
+        -np.sin(lat) * np.cos(lon) * x_rel
+        - np.sin(lat) * np.sin(lon) * y_rel
+        + np.cos(lat) * z_rel
+    )
+    up = (
+        np.cos(lat) * np.cos(lon) * x_rel
+        + np.cos(lat) * np.sin(lon) * y_rel
+        + np.sin(lat) * z_rel
+    )
+    alt = np.arctan2(up, np.hypot(east, north))
+    az = np.arctan2(east, north) % (2 * np.pi)
+    return alt, az
+
+
+def _poly(t_cen, *coeffs):
+    """evaluates a polynomial in t (in degrees) and returns radians"""
+    value = np.zeros_like(t_cen)
+    for power, coeff in enumerate(coeffs):
+        value = value + coeff * t_cen ** power
+    return np.radians(value % 360.0)
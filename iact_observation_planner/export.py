@@ -0,0 +1,244 @@
+"""export.py
+
+machine-readable export of planned schedules.
+
+A plan is exported as one record per visibility window of a target in a night
+(kind "window", with the culmination and the highest altitude) and one record
+per allocated run (kind "run"). The records are built and written night by
+night, so that long multi-night plans are never held in memory as a whole.
+
+Supported formats, chosen by the file extension:
+    .parquet  columnar, one row group per night (needs pyarrow)
+    .csv      columnar text
+    .jsonl    one JSON object per line
+    .ics      iCalendar, one event per record
+"""
+
+import hashlib
+import json
+
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from matplotlib.dates import date2num
+
+from iact_observation_planner import profiling
+from iact_observation_planner.visibility import MJD_ZERO
+
+COLUMNS = (
+    "schedule",
+    "night",
+    "kind",
+    "target",
+    "start",
+    "end",
+    "culmination",
+    "max_altitude",
+)
+FORMATS = {".parquet": "parquet", ".csv": "csv", ".jsonl": "jsonl", ".ics": "ics"}
+
+MJD_ORIGIN = pd.Timestamp("1858-11-17")
+
+
+def night_records(night, allocation=None, label=None):
+    """records of the visibility windows and allocated runs of a planned night
+
+    Args:
+        night (Night): planned night
+        allocation (Allocation): allocated runs, if any
+        label (str): name of the schedule, e.g. the site
+
+    Returns:
+        records (DataFrame): one row per window and run, see `COLUMNS`
+    """
+    windows = night.schedule.windows()
+    runs = [] if allocation is None else allocation.runs.get(night.date, [])
+    run_dates = date2num([(start, end) for _, start, end in runs]).reshape(-1, 2)
+
+    n_windows, n_runs = len(windows["names"]), len(runs)
+    return pd.DataFrame(
+        {
+            "schedule": np.full(n_windows + n_runs, label or "", dtype=object),
+            "night": np.full(n_windows + n_runs, f"{night.date:%Y-%m-%d}", dtype=object),
+            "kind": np.array(["window"] * n_windows + ["run"] * n_runs, dtype=object),
+            "target": np.concatenate(
+                [windows["names"], np.array([run[0] for run in runs], dtype=object)]
+            ).astype(object),
+            "start": _timestamps(np.concatenate([windows["starts"], run_dates[:, 0]])),
+            "end": _timestamps(np.concatenate([windows["ends"], run_dates[:, 1]])),
+            "culmination": _timestamps(
+                np.concatenate([windows["culminations"], np.full(n_runs, np.nan)])
+            ),
+            "max_altitude": np.concatenate(
+                [windows["max_altitudes"], np.full(n_runs, np.nan)]
+            ),
+        },
+        columns=list(COLUMNS),
+    )
+
+
+def schedule_records(schedules):
+    """yields the records of all schedules night by night"""
+    for schedule in schedules:
+        for night in schedule.nights:
+            yield night_records(night, schedule.allocation, schedule.site)
+
+
+@profiling.stage("export")
+def export_schedules(schedules, path, fmt=None):
+    """writes the records of planned schedules to a file, night by night
+
+    Args:
+        schedules (list): schedules to export, e.g. one per site
+        path (str): output file
+        fmt (str): "parquet", "csv", "jsonl" or "ics", by default chosen by the
+            extension of path
+
+    Returns:
+        n_records (int): number of written records
+    """
+    if fmt is None:
+        extension = path[path.rfind(".") :].lower() if "." in path else ""
+        if extension not in FORMATS:
+            raise ValueError(
+                f"Unsupported export format: {path} (parquet, csv, jsonl or ics)"
+            )
+        fmt = FORMATS[extension]
+
+    writers = {
+        "parquet": write_parquet,
+        "csv": write_csv,
+        "jsonl": write_jsonl,
+        "ics": write_ics,
+    }
+    if fmt not in writers:
+        raise ValueError(f"Unsupported export format: {fmt} (parquet, csv, jsonl or ics)")
+    return writers[fmt](schedule_records(schedules), path)
+
+
+def write_csv(frames, path):
+    n_records = 0
+    with open(path, "w", newline="") as csv_file:
+        for i, frame in enumerate(frames):
+            if i == 0 or len(frame):
+                frame.to_csv(csv_file, header=i == 0, index=False)
+            n_records += len(frame)
+    return n_records
+
+
+def write_jsonl(frames, path):
+    n_records = 0
+    with open(path, "w") as jsonl_file:
+        for frame in frames:
+            for record in json_records(frame):
+                jsonl_file.write(json.dumps(record) + "\n")
+            n_records += len(frame)
+    return n_records
+
+
+def write_parquet(frames, path):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as error:
+        raise ImportError("The parquet export needs pyarrow to be installed") from error
+
+    timestamp = pa.timestamp("us", tz="UTC")
+    schema = pa.schema(
+        [(column, pa.string()) for column in COLUMNS[:4]]
+        + [(column, timestamp) for column in COLUMNS[4:7]]
+        + [("max_altitude", pa.float64())]
+    )
+    n_records = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for frame in frames:
+            if len(frame):
+                writer.write_table(
+                    pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+                )
+            n_records += len(frame)
+    return n_records
+
+
+def write_ics(frames, path):
+    stamp = _ics_time(datetime.now(timezone.utc))
+    n_records = 0
+    with open(path, "w", newline="") as ics_file:
+        _write_ics_lines(
+            ics_file,
+            ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//iact-observation-planner//EN"],
+        )
+        for frame in frames:
+            for record in frame.itertuples(index=False):
+                _write_ics_lines(ics_file, _ics_event(record, stamp))
+            n_records += len(frame)
+        _write_ics_lines(ics_file, ["END:VCALENDAR"])
+    return n_records
+
+
+def _ics_event(record, stamp):
+    summary = f"{record.target} ({record.kind})"
+    description = f"night {record.night}"
+    if record.kind == "window":
+        description += (
+            f", culmination at {record.culmination:%H:%M:%S} UTC"
+            + f" ({record.max_altitude:.1f} deg)"
+        )
+    uid = hashlib.sha1(
+        f"{record.schedule}/{record.kind}/{record.target}/{record.start}".encode()
+    ).hexdigest()
+
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{uid}@iact-observation-planner",
+        f"DTSTAMP:{stamp}",
+        f"DTSTART:{_ics_time(record.start)}",
+        f"DTEND:{_ics_time(record.end)}",
+        f"SUMMARY:{_ics_text(summary)}",
+        f"DESCRIPTION:{_ics_text(description)}",
+    ]
+    if record.schedule:
+        lines.append(f"LOCATION:{_ics_text(record.schedule)}")
+    lines.append("END:VEVENT")
+    return lines
+
+
+def _write_ics_lines(ics_file, lines):
+    ics_file.write("".join(line + "\r\n" for line in lines))
+
+
+def _ics_time(time):
+    return f"{time:%Y%m%dT%H%M%SZ}"
+
+
+def _ics_text(text):
+    for char in ("\\", ";", ","):
+        text = text.replace(char, "\\" + char)
+    return text.replace("\n", "\\n")
+
+
+def json_records(frame):
+    """records of a frame with ISO times and None for missing values"""
+    columns = {}
+    for column in COLUMNS:
+        values = frame[column]
+        if column in ("start", "end", "culmination"):
+            columns[column] = [
+                None if pd.isna(value) else value.isoformat() for value in values
+            ]
+        elif column == "max_altitude":
+            columns[column] = [
+                None if np.isnan(value) else float(value) for value in values
+            ]
+        else:
+            columns[column] = list(values)
+    return [dict(zip(COLUMNS, values)) for values in zip(*columns.values())]
+
+
+def _timestamps(dates):
+    """UTC timestamps (to the microsecond, as num2date) of matplotlib date numbers"""
+    return pd.to_datetime(
+        np.asarray(dates, dtype=float) - MJD_ZERO, unit="D", origin=MJD_ORIGIN, utc=True
+    ).round("us")
+
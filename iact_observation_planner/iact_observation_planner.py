@@ -1,20 +1,45 @@
 """Main module."""
+import asyncio
 import os
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+import pandas as pd
 from astropy.time import Time
 
 from iact_observation_planner import observer_config
-from iact_observation_planner import targets as iop_targets
+from iact_observation_planner import allocation as iop_allocation
 from iact_observation_planner import nights as iop_nights
-from iact_observation_planner.schedule import Schedule
+from iact_observation_planner import profiling
+from iact_observation_planner import season as iop_season
+from iact_observation_planner import survey as iop_survey
+from iact_observation_planner import targets as iop_targets
+from iact_observation_planner import twilight as iop_twilight
+from iact_observation_planner.export import export_schedules
+from iact_observation_planner.result_cache import ResultCache
+from iact_observation_planner.schedule import Schedule, summarize_sites
+from iact_observation_planner.session import PlanningSession, plan_sessions
+from iact_observation_planner.visibility import VisibilityIndex
+
+TARGET_CACHE = "target_cache.json"
+RESULT_CACHE = "results"
+
+
+def get_config():
+    """the observer configuration of IOP_SITE_CONFIG (or the default one), loaded
+    on first use"""
+    return observer_config.load_observer_config(
+        os.environ.get("IOP_SITE_CONFIG") or None
+    )
 
-CFG_DATA = observer_config.default_observer_config()
-if os.environ.get("IOP_SITE_CONFIG"):
-    # Lookup the site configuration and parse it.
-    print("NOT IMPLEMENTED")
 
-CFG = observer_config.ObserverConfiguration(CFG_DATA)
+def __getattr__(name):
+    # CFG and CFG_DATA used to be created at import time
+    if name == "CFG":
+        return get_config()
+    if name == "CFG_DATA":
+        return get_config().cfg_data
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def parse_options(site, darkness, date, plan_range):
@@ -24,18 +49,41 @@ def parse_options(site, darkness, date, plan_range):
     opts = {}
     opts.update(parse_date(date))
     opts.update(parse_range(plan_range))
-    opts.update(parse_site(site))
-    opts.update(parse_darkness(darkness))
+    opts.update(parse_sites(site))
+    opts["site"] = opts["sites"][0]
+    opts.update(parse_darknesses(darkness))
+    opts["darkness"] = next(iter(opts["darknesses"].values()))
 
     return opts
 
 
 def parse_darkness(option):
-    return {"darkness": CFG.get_darkness_from_name(option)}
+    return {"darkness": get_config().get_darkness_from_name(option)}
+
+
+def parse_darknesses(option):
+    """parses one or several darkness names, "all" selects all configured
+    darkness definitions"""
+    names = [option] if isinstance(option, str) else list(option)
+    if "all" in names:
+        names = list(get_config().darkness.keys())
+    return {
+        "darknesses": {
+            name: get_config().get_darkness_from_name(name) for name in dict.fromkeys(names)
+        }
+    }
 
 
 def parse_site(option):
-    return {"site": CFG.get_site_from_name(option)}
+    return {"site": get_config().get_site_from_name(option)}
+
+
+def parse_sites(option):
+    """parses one or several site names, "all" selects all configured sites"""
+    names = [option] if isinstance(option, str) else list(option)
+    if "all" in names:
+        names = list(get_config().sites.keys())
+    return {"sites": [get_config().get_site_from_name(name) for name in dict.fromkeys(names)]}
 
 
 def parse_range(option):
@@ -56,35 +104,251 @@ def parse_date(option):
     return {"date": date}
 
 
-def plan_targets(target, site, darkness, date, plan_range):
+def setup_target_cache(offline=False):
+    """sets up the cache for resolved target names next to the site configuration.
+    Without a site configuration the cache only lives in memory."""
+    cache_dir = observer_config.config_dir()
+    path = None
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, TARGET_CACHE)
+    return iop_targets.TargetCache(path, offline=offline)
+
+
+def setup_result_cache():
+    """sets up the on-disk cache of planning results next to the site
+    configuration, returns None without a site configuration"""
+    cache_dir = observer_config.config_dir()
+    if cache_dir is None:
+        return None
+    return ResultCache(os.path.join(cache_dir, RESULT_CACHE))
+
+
+@profiling.stage("resolve_targets")
+def resolve_targets(target, target_file=None, offline=False):
+    """resolves the target names (concurrently) and adds the targets of the target
+    file"""
+    targets = asyncio.run(
+        iop_targets.resolve_target_list_async(target or [], setup_target_cache(offline))
+    )
+    if target_file is not None:
+        targets = iop_targets.TargetCatalogue.concatenate(
+            [
+                iop_targets.TargetCatalogue.from_targets(targets),
+                iop_targets.read_target_file(target_file),
+            ]
+        )
+    return targets
+
+
+def plan_targets(
+    target,
+    site,
+    darkness,
+    date,
+    plan_range,
+    workers=1,
+    engine="astropy",
+    offline=False,
+    target_file=None,
+    sampling="grid",
+    tolerance=1.0,
+    export=None,
+):
     """main function of the tool that performs the planning"""
-    targets = iop_targets.resolve_target_list(target)
     options = parse_options(site, darkness, date, plan_range)
+
+    # the target names are resolved in the background while the sun set and rise
+    # times of the nights are calculated
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        resolving = executor.submit(resolve_targets, target, target_file, offline)
+        if len(options["darknesses"]) > 1:
+            prepared = setup_darknesses(options, engine, sampling, tolerance)
+        else:
+            prepared = setup_sites(options, engine, sampling, tolerance)
+        targets = resolving.result()
     summarize_options(options, targets)
 
-    # Setup the nights to plan and calculate sun rise/set times
-    planned_nights = iop_nights.setup_nights(
-        options["date"], options["site"], options["darkness"], options["range"]
+    run_duration, _ = get_config().get_observation_pars()
+    if len(options["darknesses"]) > 1:
+        schedules = plan_darknesses(prepared, targets, run_duration, workers)
+    else:
+        schedules = plan_sites(options, prepared, targets, run_duration, workers)
+
+    if len(schedules) > 1:
+        summarize_sites(schedules)
+
+    if export is not None:
+        n_records = export_schedules(schedules, export)
+        print(f"EXPORTED {n_records} RECORDS -> {export}")
+
+
+def survey_targets(
+    target,
+    site,
+    darkness,
+    date,
+    plan_range,
+    output,
+    workers=1,
+    offline=False,
+    target_file=None,
+):
+    """survey mode of the tool: the dark hours per month of all targets for each
+    site and darkness definition, written to output, see `survey.survey_hours`"""
+    # an unsupported output would only fail after the survey
+    iop_survey.check_output(output)
+    options = parse_options(site, darkness, date, plan_range)
+    targets = resolve_targets(target, target_file, offline)
+    summarize_options(options, targets)
+
+    frames, keys = [], []
+    for site_location in options["sites"]:
+        season = iop_season.load_season(observer_config.config_dir(), site_location)
+        for name, darkness_definition in options["darknesses"].items():
+            frames.append(
+                iop_survey.survey_hours(
+                    targets,
+                    site_location,
+                    darkness_definition,
+                    options["date"],
+                    options["range"],
+                    workers=workers,
+                    season=season,
+                )
+            )
+            keys.append((site_location.info.name, name))
+
+    hours = pd.concat(frames, keys=keys, names=["site", "darkness"])
+    iop_survey.write_survey(hours, output)
+    print(f"SURVEYED {len(targets)} TARGETS IN {len(frames)} CONFIGURATIONS -> {output}")
+    return hours
+
+
+def setup_sites(options, engine, sampling, tolerance):
+    """sets up a planning session with the nights of each site for one darkness
+    definition, see `plan_sites`
+
+    Returns:
+        sessions (list): a session per site
+    """
+    sessions = []
+    for site_location in options["sites"]:
+        session = setup_session(
+            site_location, options["darkness"], engine, sampling, tolerance
+        )
+        # calculate sun rise/set times
+        session.set_range(options["date"], options["range"])
+        sessions.append(session)
+    return sessions
+
+
+def setup_session(site_location, darkness, engine, sampling, tolerance):
+    """sets up a planning session of a site and darkness definition with the
+    twilight table, season and result cache found next to the site configuration"""
+    return PlanningSession(
+        site_location,
+        darkness,
+        engine,
+        sampling,
+        tolerance,
+        iop_twilight.load_table(observer_config.config_dir(), site_location, darkness),
+        setup_result_cache(),
+        iop_season.load_season(observer_config.config_dir(), site_location),
     )
 
-    # calculate 1 night per thread TODO: Threadding
-    for night in planned_nights:
-        for target in targets:
-            night.plan_target(target)
 
-    sched = Schedule(planned_nights)
+def plan_sites(options, sessions, targets, run_duration, workers):
+    """plans the targets into the nights of all sites with one darkness definition
+
+    Returns:
+        schedules (list): a schedule per site
+    """
+    # the targets are shared by all sites
+    for session in sessions:
+        session.set_targets(targets)
+
+    # plan all targets into all nights of all sites, optionally on a pool of
+    # processes
+    sessions = plan_sessions(sessions, options["date"], options["range"], workers)
+
+    schedules = []
+    for session in sessions:
+        # allocate runs to the targets up to their requested hours
+        index = VisibilityIndex.from_nights(session.nights)
+        allocation = session.allocate(run_duration, index)
+
+        site_name = session.site.info.name if len(sessions) > 1 else None
+        schedules.append(Schedule(session.nights, allocation, index, site_name))
+    return schedules
+
+
+def setup_darknesses(options, engine, sampling, tolerance):
+    """sets up the nights of all sites for several darkness definitions, see
+    `plan_darknesses`
+
+    Returns:
+        planned_nights (list): (site, nights by darkness name) per site
+    """
+    planned_nights = []
+    for site_location in options["sites"]:
+        twilights = {
+            name: iop_twilight.load_table(
+                observer_config.config_dir(), site_location, darkness
+            )
+            for name, darkness in options["darknesses"].items()
+        }
+        darkness_nights = iop_nights.setup_darkness_nights(
+            options["date"],
+            site_location,
+            options["darknesses"],
+            options["range"],
+            engine,
+            twilights,
+            sampling,
+            tolerance,
+            iop_season.load_season(observer_config.config_dir(), site_location),
+        )
+        planned_nights.append((site_location, darkness_nights))
+    return planned_nights
+
+
+def plan_darknesses(planned_nights, targets, run_duration, workers):
+    """plans the targets into the nights of all sites for several darkness
+    definitions, sharing the target and moon positions of the darkness
+    definitions of a site. The nights are sampled on the shared time grid, so
+    the result cache (which holds the nights of a single darkness definition)
+    is not used.
+
+    Returns:
+        schedules (list): a schedule per site and darkness definition
+    """
+    schedules = []
+    for site_location, darkness_nights in planned_nights:
+        iop_nights.plan_darkness_nights(darkness_nights, targets, workers)
 
-    # allocate targets
+        for name, nights in darkness_nights.items():
+            index = VisibilityIndex.from_nights(nights)
+            allocation = iop_allocation.allocate(nights, targets, run_duration, index)
+            label = f"{site_location.info.name}/{name}"
+            schedules.append(Schedule(nights, allocation, index, label))
+    return schedules
 
 
-def summarize_options(options, targets):
+def summarize_options(options, targets, max_targets=20):
     out = "Planning the following targets:\n"
-    for target in targets:
+    for target in targets[:max_targets]:
         out += f"{target}\n"
+    if len(targets) > max_targets:
+        out += f"... and {len(targets) - max_targets} more targets\n"
 
     out += "Boundry Conditions:\n"
-    out += f" * Site:       {options['site'].info.name}\n"
-    out += f" * Darkness:   {options['darkness']}\n"
+    sites = ", ".join(site.info.name for site in options["sites"])
+    out += f" * Site:       {sites}\n"
+    if len(options["darknesses"]) > 1:
+        for name, darkness in options["darknesses"].items():
+            out += f" * Darkness:   {name}: {darkness}\n"
+    else:
+        out += f" * Darkness:   {options['darkness']}\n"
     out += f" * Start Date: {options['date']:%Y-%m-%d}\n"
     out += f" * N nights:   {options['range'].days}\n"
 
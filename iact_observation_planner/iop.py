@@ -7,9 +7,6 @@ import argparse
 
 from datetime import datetime, timedelta
 
-from iact_observation_planner import targets
-from iact_observation_planner import iact_observation_planner
-
 
 def main():
     """Console script for iact_observation_planner."""
@@ -30,6 +27,14 @@ or rd/280.0d,-45.6d You can add a tag name too: rd/14h23m,-29d/MySource
 Expected Format: e.g. <target_name>;<altitude_limit>;<hours>.\n
 Example: "Crab Nebula;30;5" to plan observations on the crab nebula with
 30 deg altitude limit for 5 hours.""",
+    )
+    parser.add_argument(
+        "--target-file",
+        dest="target_file",
+        default=None,
+        help="""Catalogue of targets to plan observations for (CSV, JSON or ECSV).
+Expected columns: name, ra and dec in degrees (ICRS), optionally alt_limit
+in degrees and hours.""",
     )
     parser.add_argument(
         "-d",
@@ -50,27 +55,159 @@ Example: "Crab Nebula;30;5" to plan observations on the crab nebula with
         "-o",
         "--darkness",
         dest="darkness",
-        help="darknes configuration to be used in the planning",
-        default="dark",
+        nargs="+",
+        help="darknes configuration to be used in the planning, several"
+        + " configurations (or 'all') are planned from the same target and moon"
+        + " positions",
+        default=["dark"],
     )
     parser.add_argument(
         "-s",
         "--site",
         dest="site",
-        help="select a site for the planned observations"
-        + "(needs to be present in the configuration)",
-        default="HESS",
+        nargs="+",
+        help="select one or several sites for the planned observations"
+        + " (need to be present in the configuration), or 'all' for all sites",
+        default=["HESS"],
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        dest="workers",
+        default=1,
+        type=int,
+        help="number of processes used to plan the nights in parallel",
+    )
+    parser.add_argument(
+        "-e",
+        "--engine",
+        dest="engine",
+        default="astropy",
+        choices=["astropy", "fast"],
+        help="coordinate engine: the full astropy transformation or a fast analytic"
+        + " approximation (accurate to ~1 arcmin)",
+    )
+    parser.add_argument(
+        "--sampling",
+        dest="sampling",
+        default="grid",
+        choices=["grid", "adaptive"],
+        help="sample the nights on a fixed grid or adaptively refine the start and"
+        + " end of the observation windows (interruptions within a window, e.g. by"
+        + " the moon, keep the coarse resolution of ~25 min)",
+    )
+    parser.add_argument(
+        "--tolerance",
+        dest="tolerance",
+        default=1.0,
+        type=float,
+        help="precision of the adaptively sampled windows in seconds",
+    )
+    parser.add_argument(
+        "--export",
+        dest="export",
+        default=None,
+        help="write the planned schedules to a file, the format is chosen by the"
+        + " extension: .parquet, .csv, .jsonl or .ics",
+    )
+    parser.add_argument(
+        "--survey",
+        dest="survey",
+        default=None,
+        metavar="FILE",
+        help="instead of planning, write the dark hours per month of each target in"
+        + " the range of nights to FILE (.parquet or .csv)",
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        nargs="?",
+        const="iop_profile.json",
+        default=None,
+        metavar="TRACE",
+        help="time the stages of the planning, print a summary and write a Chrome"
+        + " trace (default: iop_profile.json)",
+    )
+    parser.add_argument(
+        "--serve",
+        dest="serve",
+        default=None,
+        type=int,
+        metavar="PORT",
+        help="run as a planner service with a local HTTP/JSON API on PORT instead"
+        + " of planning once",
+    )
+    parser.add_argument(
+        "--host",
+        dest="host",
+        default="127.0.0.1",
+        help="address the planner service listens on",
+    )
+    parser.add_argument(
+        "--offline",
+        dest="offline",
+        action="store_true",
+        help="only use the target cache to resolve target names, never query Simbad",
     )
 
     args = parser.parse_args()
 
-    if not args.target:
+    if args.serve is not None:
+        from iact_observation_planner import server
+
+        return server.serve(
+            args.serve,
+            args.host,
+            workers=args.workers,
+            engine=args.engine,
+            sampling=args.sampling,
+            tolerance=args.tolerance,
+            offline=args.offline,
+        )
+
+    if not args.target and not args.target_file:
         parser.print_help()
         return 0
 
-    return iact_observation_planner.plan_targets(
-        args.target, args.site, args.darkness, args.date, args.range
-    )
+    from iact_observation_planner import profiling
+
+    if args.profile is not None:
+        profiling.enable()
+    try:
+        # astropy, pandas and matplotlib are only loaded when planning
+        with profiling.timed("import"):
+            from iact_observation_planner import iact_observation_planner
+
+        if args.survey is not None:
+            iact_observation_planner.survey_targets(
+                args.target,
+                args.site,
+                args.darkness,
+                args.date,
+                args.range,
+                args.survey,
+                args.workers,
+                args.offline,
+                args.target_file,
+            )
+            return 0
+
+        return iact_observation_planner.plan_targets(
+            args.target,
+            args.site,
+            args.darkness,
+            args.date,
+            args.range,
+            args.workers,
+            args.engine,
+            args.offline,
+            args.target_file,
+            args.sampling,
+            args.tolerance,
+            args.export,
+        )
+    finally:
+        profiling.report(args.profile)
 
 
 if __name__ == "__main__":
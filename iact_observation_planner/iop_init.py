@@ -3,7 +3,7 @@ import argparse
 import os
 import json
 
-from iact_observation_planner.observer_config import default_observer_config
+from iact_observation_planner.observer_config import config_dir, default_observer_config
 
 
 def deploy_default_cfg(path):
@@ -24,11 +24,42 @@ def deploy_default_cfg(path):
     print(json.dumps(default_config, indent=4), "\n")
     print(
         "execute: export IOP_SITE_CONFIG={}".format(destination),
-        "to use this configuration. NOT IMPLEMENTED YET",
+        "to use this configuration.",
     )
     return 0
 
 
+def deploy_twilight_tables(path, first_year, last_year):
+    """Function that precomputes the sun set/rise times of all sites and darkness
+    definitions for a range of years and stores them next to the configuration."""
+    from iact_observation_planner import twilight
+    from iact_observation_planner.observer_config import load_observer_config
+
+    cfg = load_observer_config(os.environ.get("IOP_SITE_CONFIG") or None)
+    sites = [cfg.get_site_from_name(name) for name in cfg.sites]
+    darknesses = [cfg.get_darkness_from_name(name) for name in cfg.darkness]
+
+    paths = twilight.generate_tables(path, sites, darknesses, first_year, last_year)
+    for table_path in paths:
+        print("GENERATED TWILIGHT TABLE -> {}".format(table_path))
+    return 0
+
+
+def deploy_seasons(path, first_year, last_year):
+    """Function that precomputes the sun and moon positions of all sites for a
+    range of years and stores them next to the configuration."""
+    from iact_observation_planner import season
+    from iact_observation_planner.observer_config import load_observer_config
+
+    cfg = load_observer_config(os.environ.get("IOP_SITE_CONFIG") or None)
+    sites = [cfg.get_site_from_name(name) for name in cfg.sites]
+
+    paths = season.generate_seasons(path, sites, first_year, last_year)
+    for season_path in paths:
+        print("GENERATED SEASON EPHEMERIS -> {}".format(season_path))
+    return 0
+
+
 def main():
     """Console script for iact_observation_planner that deploys a configuration
     to user sapce and instructs the user how to enforce it being used."""
@@ -38,14 +69,41 @@ def main():
         dest="init_path",
         help="initialize a default configuration that can be tuned to your needs.",
     )
+    parser.add_argument(
+        "--twilight",
+        dest="twilight",
+        nargs=2,
+        type=int,
+        metavar=("FIRST_YEAR", "LAST_YEAR"),
+        help="precompute the sun set/rise times for these years next to the"
+        + " configuration (--init path or the one of IOP_SITE_CONFIG).",
+    )
+    parser.add_argument(
+        "--season",
+        dest="season",
+        nargs=2,
+        type=int,
+        metavar=("FIRST_YEAR", "LAST_YEAR"),
+        help="precompute the sun and moon positions in steps of one minute for"
+        + " these years next to the configuration.",
+    )
     args = parser.parse_args()
 
     target_base_path = args.init_path
+    if target_base_path is None and (args.twilight or args.season):
+        target_base_path = config_dir()
 
-    if not os.path.exists(target_base_path):
+    if target_base_path is None or not os.path.exists(target_base_path):
         print("{} is not a valid path.\n ... Aborting.".format(target_base_path))
         return -1
 
+    if args.twilight or args.season:
+        if args.twilight:
+            deploy_twilight_tables(target_base_path, *args.twilight)
+        if args.season:
+            deploy_seasons(target_base_path, *args.season)
+        return 0
+
     return deploy_default_cfg(target_base_path)
 
 
@@ -1,29 +1,94 @@
 """nights.py"""
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 
 import numpy as np
 import pandas as pd
 
-from matplotlib.dates import num2date, date2num
+from matplotlib.dates import date2num
 
 import astropy.units as u
 from astropy.time import Time
-from astropy.units import Quantity
-from astropy.coordinates import Angle, SkyCoord, AltAz
+from astropy.coordinates import (
+    Angle,
+    AltAz,
+    Latitude,
+    Longitude,
+    angular_separation,
+)
 
 from astropy.time import Time
 import ephem
 
+from iact_observation_planner import ephemeris
+from iact_observation_planner import fast_coordinates
+from iact_observation_planner import profiling
+from iact_observation_planner.observer_config import parse_darkness
+from iact_observation_planner.targets import TargetCatalogue
+from iact_observation_planner.visibility import MJD_ZERO, NightSchedule
+
+# number of samples per night for the fixed grid and the coarse adaptive grid
+GRID_SAMPLES = 200
+ADAPTIVE_SAMPLES = 25
+
 
 class Night:
-    def __init__(self, date, site, darkness):
+    def __init__(
+        self,
+        date,
+        site,
+        darkness,
+        n_samples=None,
+        engine="astropy",
+        sun_times=None,
+        sampling="grid",
+        tolerance=1.0,
+        season=None,
+    ):
         self.date = date
         self.site = site
-        self.darkness = darkness
-        self.sun_set, self.sun_rise = find_sun_rise_and_set(
-            self.date, self.site, self.darkness
-        )
-        self.schedule = {}
+        self.darkness = parse_darkness(darkness)
+        self.engine = engine
+
+        # with adaptive sampling, the visibility is evaluated on a coarse grid and
+        # the window edges are refined to the tolerance (in seconds) by bisection
+        self.sampling = sampling
+        self.tolerance = tolerance
+        if n_samples is None:
+            n_samples = ADAPTIVE_SAMPLES if sampling == "adaptive" else GRID_SAMPLES
+        self.n_samples = n_samples
+        self.n_evaluations = 0
+
+        # the sun set and rise times can be passed in, e.g. from a twilight table,
+        # or are taken from a precomputed season
+        if sun_times is None and season is not None:
+            sun_times = season.sun_times(
+                self.date, self.darkness.max_sun_altitude.to_value(u.deg)
+            )
+        if sun_times is None:
+            sun_times = find_sun_rise_and_set(self.date, self.site, self.darkness)
+        self.sun_set, self.sun_rise = sun_times
+        self.schedule = NightSchedule()
+
+        # with a season covering the night, the time grid and the moon positions
+        # are views into the season's arrays
+        self.season = None
+        self._season_samples = None
+        if season is not None:
+            self._season_samples = season.window(
+                self.sun_set, self.sun_rise, self.n_samples
+            )
+            if self._season_samples is not None:
+                self.season = season
+
+        # per-night quantities that do not depend on the targets, filled lazily
+        self._time_range = None
+        self._test_dates = None
+        self._altaz_frame = None
+        self._moon_conditions = None
+        self._moon_alt_az = None
+        # samples of a shared time grid within sun set and rise of this night
+        self._sun_window = None
 
     def __repr__(self):
         out = f"Evening Date: {self.date:%Y-%m-%d}\n"
@@ -31,106 +96,340 @@ class Night:
         out += f" * Sun Rise: {self.sun_rise}\n"
         return out
 
+    @property
+    def time_range(self):
+        """time grid sampling the night from sun set to sun rise"""
+        if self._time_range is None and self.season is not None:
+            self._time_range = Time(
+                self.season.mjd(self._season_indices), format="mjd", scale="utc"
+            )
+        if self._time_range is None:
+            test_range = [timedelta(seconds=0), self.sun_rise - self.sun_set]
+            sun_set_date = Time(self.sun_set, scale="utc")
+
+            self._time_range = (
+                np.linspace(
+                    test_range[0].seconds / 3600,
+                    test_range[1].seconds / 3600,
+                    self.n_samples,
+                )
+                * u.hour
+            ) + sun_set_date
+        return self._time_range
+
+    @property
+    def test_dates(self):
+        """matplotlib date numbers of the time grid"""
+        if self._test_dates is None and self.season is not None:
+            self._test_dates = self.season.mjd(self._season_indices) + MJD_ZERO
+        if self._test_dates is None:
+            self._test_dates = date2num(self.time_range.datetime)
+        return self._test_dates
+
+    @property
+    def _season_indices(self):
+        samples = self._season_samples
+        return np.arange(samples.start, samples.stop, samples.step)
+
+    @property
+    def grid_key(self):
+        """identifies the time grid of the night if it is taken from a season,
+        None for the default grid"""
+        if self.season is None:
+            return None
+        return f"{self.season.key}/{self._season_samples.step}"
+
+    @property
+    def altaz_frame(self):
+        """AltAz frame of the site for the time grid"""
+        if self._altaz_frame is None:
+            self._altaz_frame = AltAz(obstime=self.time_range, location=self.site)
+        return self._altaz_frame
+
+    @property
+    def moon_conditions(self):
+        """altitudes, azimuths and phases of the moon on the time grid.
+        The moon does not depend on the target and is calculated once per night."""
+        if self._moon_conditions is None and self.season is not None:
+            self._moon_conditions = self.season.moon_conditions(self._season_samples)
+        if self._moon_conditions is None:
+            self._moon_conditions = self.calculate_moon_positions(self.time_range)
+        return self._moon_conditions
+
+    @property
+    def moon_alt_az(self):
+        """AltAz coordinates of the moon on the time grid"""
+        if self._moon_alt_az is None:
+            self._moon_alt_az = AltAz(
+                alt=Angle(self.moon_conditions["altitudes"], unit=u.deg),
+                az=Angle(self.moon_conditions["azimuths"], unit=u.deg),
+                location=self.site,
+                obstime=self.time_range,
+            )
+        return self._moon_alt_az
+
     def plan_target(self, target):
         """plan a target into a single night
 
         Args:
             target (target): target to plan
         """
-        test_range = [timedelta(seconds=0), self.sun_rise - self.sun_set]
-        sun_set_date = Time(self.sun_set, scale="utc")
+        self.plan_targets([target])
 
-        time_range = (
-            np.linspace(test_range[0].seconds / 3600, test_range[1].seconds / 3600, 200)
-            * u.hour
-        ) + sun_set_date
+    def plan_targets(self, targets):
+        """plan several targets into a single night at once. All targets are
+        transformed in a single (n_targets x n_times) coordinate transform and the
+        selection masks are applied as 2-D arrays.
 
-        test_dates = np.array([date2num(time.datetime) for time in time_range])
+        Args:
+            targets (array or TargetCatalogue): targets to plan
+        """
+        if not len(targets):
+            return
+        catalogue = TargetCatalogue.from_targets(targets)
 
-        # calculate the moon and target positions during the night in alt az coordinates
-        moon_pos = self.calculate_moon_positions(time_range)
-        target_alt_az = self.calculate_target(time_range, target)
+        # calculate the target positions during the night in alt az coordinates,
+        # everything else only depends on the night and is cached.
+        target_alt, target_az = self.calculate_targets(catalogue)
+        self.add_visibility(catalogue, target_alt, target_az)
 
-        # calculate the target/moon separation
-        moon_alt_az = AltAz(
-            alt=Angle(moon_pos["altitudes"], unit=u.deg),
-            az=Angle(moon_pos["azimuths"], unit=u.deg),
-            location=self.site,
-            obstime=time_range,
+    def add_visibility(self, catalogue, target_alt, target_az):
+        """applies the altitude limits and darkness criteria to the positions of
+        the targets on the time grid of the night and adds the visible targets
+        to the schedule
+
+        Args:
+            catalogue (TargetCatalogue): planned targets
+            target_alt (Latitude): altitudes of the targets (n_targets, n_times)
+            target_az (Longitude): azimuths of the targets (n_targets, n_times)
+        """
+        filter_mask = self.visibility_mask(
+            target_alt,
+            target_az,
+            catalogue.alt_limits[:, np.newaxis],
+            self.moon_conditions,
         )
-        targt_moon_separation = target_alt_az.separation(moon_alt_az)
+        if self._sun_window is not None:
+            filter_mask &= self._sun_window
+
+        crossings = {}
+        if self.sampling == "adaptive":
+            crossings = self.refine_crossings(catalogue, filter_mask)
+            if self._sun_window is not None:
+                sun_set, sun_rise = date2num([self.sun_set, self.sun_rise])
+                crossings = {
+                    row: (max(start, sun_set), min(end, sun_rise))
+                    for row, (start, end) in crossings.items()
+                }
+
+        # store the visible samples of all targets
+        self.schedule.add(
+            catalogue.names,
+            self.test_dates,
+            filter_mask,
+            target_alt.to_value(u.deg),
+            crossings,
+        )
+
+    def share_geometry(self, night):
+        """uses the time grid and the moon positions of another night of the same
+        date and site, whose (wider) grid covers the sun set and rise of this
+        night. Only the samples between sun set and sun rise of this night are
+        used.
+
+        Args:
+            night (Night): night with a different darkness definition
+        """
+        self.n_samples = night.n_samples
+        self._time_range = night.time_range
+        self._test_dates = night.test_dates
+        self._altaz_frame = night._altaz_frame
+        self._moon_conditions = night.moon_conditions
+        self._moon_alt_az = None
+
+        sun_set, sun_rise = date2num([self.sun_set, self.sun_rise])
+        self._sun_window = (self._test_dates >= sun_set) & (self._test_dates <= sun_rise)
+
+    @profiling.stage("visibility_mask")
+    def visibility_mask(self, target_alt, target_az, alt_limits, moon_pos):
+        """applies the altitude limits and the darkness criteria of the night
+
+        Args:
+            target_alt (Latitude): altitudes of the targets
+            target_az (Longitude): azimuths of the targets
+            alt_limits (Quantity): altitude limits, broadcastable to target_alt
+            moon_pos (dict): moon conditions at the times of the target positions
+
+        Returns:
+            filter_mask (ndarray): whether the targets are observable
+        """
+        moon_alt = Angle(moon_pos["altitudes"], unit=u.deg)
+        moon_az = Angle(moon_pos["azimuths"], unit=u.deg)
 
-        # get the appropriate darkness criteria and apply to the moon
-        max_moon_alt = Quantity(self.darkness["max_moon_altitude"])
-        max_moon_phase = False
-        if self.darkness["max_moon_phase"]:
-            max_moon_phase = Quantity(self.darkness["max_moon_phase"])
-        min_moon_distance = False
-        if self.darkness["min_moon_distance"]:
-            min_moon_distance = Quantity(self.darkness["min_moon_distance"])
+        # calculate the target/moon separation
+        targt_moon_separation = angular_separation(target_az, target_alt, moon_az, moon_alt)
+
+        # the darkness criteria are parsed once per definition
+        darkness = self.darkness
 
         # prepare the selection masks
-        target_alt_ok = target_alt_az.alt > target.alt_limit
-        moon_alt_ok = moon_alt_az.alt < max_moon_alt
+        target_alt_ok = target_alt > alt_limits
+        moon_alt_ok = moon_alt < darkness.max_moon_altitude
 
-        moon_dist_ok = [True for _ in target_alt_az]
-        if min_moon_distance is not False:
-            moon_dist_ok = targt_moon_separation > min_moon_distance
+        moon_dist_ok = np.ones(target_alt_ok.shape, dtype=bool)
+        if darkness.min_moon_distance is not None:
+            moon_dist_ok = targt_moon_separation > darkness.min_moon_distance
 
-        moon_phase_ok = [True for _ in target_alt_az]
-        if max_moon_phase is not False:
-            moon_phase_ok = moon_pos["phases"] < max_moon_phase
+        moon_phase_ok = np.ones(moon_alt.shape, dtype=bool)
+        if darkness.max_moon_phase is not None:
+            moon_phase_ok = moon_pos["phases"] < darkness.max_moon_phase
 
         # apply masks
-        filter_mask = target_alt_ok & moon_alt_ok & moon_dist_ok & moon_phase_ok
-        valid_target_times = test_dates[filter_mask]
-        valid_dates = [num2date(d) for d in valid_target_times]
-        
-        if len(valid_dates):
-            target_start = min(valid_dates)
-            target_end = max(valid_dates)
-
-            self.schedule.update(
-                {target.name: {"start": target_start,
-                               "end": target_end,
-                               "altitudes": target_alt_az.alt[filter_mask],
-                               "times": valid_dates}}
-            )
+        return target_alt_ok & moon_alt_ok & moon_dist_ok & moon_phase_ok
+
+    @profiling.stage("refine_crossings")
+    def refine_crossings(self, catalogue, filter_mask):
+        """refines the start and end of each target's visibility window by bisection
+        between the coarse grid samples around the first and the last valid sample.
+        All edges of all targets are bisected together, so that each step costs a
+        single coordinate evaluation. Windows shorter than the grid spacing can be
+        missed by the coarse grid. Only the outer edges are refined: interruptions
+        within the window (e.g. the moon rising and setting, or passing closer
+        than the minimum moon distance) keep the resolution of the coarse grid, as
+        the schedules only hold one refined start and end per target and night.
+
+        Args:
+            catalogue (TargetCatalogue): planned targets
+            filter_mask (ndarray): visibility on the coarse grid (n_targets, n_times)
+
+        Returns:
+            crossings (dict): (start, end) matplotlib date numbers per row of the
+                catalogue
+        """
+        mjd = self.time_range.mjd
+
+        edges = {}
+        rows, lows, highs, rising = [], [], [], []
+        for row, row_mask in enumerate(filter_mask):
+            valid = np.flatnonzero(row_mask)
+            if not len(valid):
+                continue
+            first, last = valid[0], valid[-1]
+            edges[row] = [mjd[first], mjd[last]]
+            if first > 0:
+                rows.append(row)
+                lows.append(mjd[first - 1])
+                highs.append(mjd[first])
+                rising.append(True)
+            if last < len(mjd) - 1:
+                rows.append(row)
+                lows.append(mjd[last])
+                highs.append(mjd[last + 1])
+                rising.append(False)
+
+        rows = np.array(rows, dtype=int)
+        lows = np.array(lows)
+        highs = np.array(highs)
+        rising = np.array(rising, dtype=bool)
+
+        tolerance = self.tolerance / 86400.0
+        while len(rows) and np.max(highs - lows) > tolerance:
+            mids = 0.5 * (lows + highs)
+            valid = self.visibility_at(catalogue, rows, mids)
+            # the valid side of a rising edge is the later one, of a setting edge
+            # the earlier one
+            move_high = valid == rising
+            highs = np.where(move_high, mids, highs)
+            lows = np.where(move_high, lows, mids)
+
+        for row, low, high, is_rising in zip(rows, lows, highs, rising):
+            if is_rising:
+                edges[row][0] = high
+            else:
+                edges[row][1] = low
+
+        return {
+            row: (start + MJD_ZERO, end + MJD_ZERO) for row, (start, end) in edges.items()
+        }
 
-    def calculate_target(self, time_range, target):
-        position = SkyCoord(
-            target.coords.ra, target.coords.dec, unit=target.coords.ra.unit
+    def visibility_at(self, catalogue, rows, mjd):
+        """evaluates the visibility of single targets at single times
+
+        Args:
+            catalogue (TargetCatalogue): planned targets
+            rows (ndarray): rows of the catalogue to evaluate
+            mjd (ndarray): time for each row in MJD
+
+        Returns:
+            filter_mask (ndarray): whether the targets are observable at the times
+        """
+        times = Time(mjd, format="mjd", scale="utc")
+        positions = catalogue.coords[rows]
+
+        if self.engine == "fast":
+            alt, az = fast_coordinates.alt_az(
+                positions.ra, positions.dec, times, self.site, pairwise=True
+            )
+            target_alt, target_az = Latitude(alt, unit=u.deg), Longitude(az, unit=u.deg)
+        else:
+            target_alt_az = positions.transform_to(
+                AltAz(obstime=times, location=self.site)
+            )
+            target_alt, target_az = target_alt_az.alt, target_alt_az.az
+        self.n_evaluations += len(rows)
+        profiling.count("target_positions", len(rows))
+
+        return self.visibility_mask(
+            target_alt,
+            target_az,
+            catalogue.alt_limits[rows],
+            self.calculate_moon_positions(times),
         )
 
-        altaz_frame = AltAz(obstime=time_range, location=self.site)
-        return position.transform_to(altaz_frame)
+    @profiling.stage("calculate_targets")
+    def calculate_targets(self, catalogue):
+        """transforms the target positions into the AltAz frame of the night,
+        either with astropy or with the analytic "fast" engine
+        (see `fast_coordinates`)
 
-    def calculate_moon_positions(self, test_dates):
-        moon_altitudes = np.zeros_like(test_dates)
-        moon_azimuths = np.zeros_like(test_dates)
-        moon_phases = np.zeros_like(test_dates)
-
-        moon = ephem.Moon()
-        obs = ephem.Observer()
-        obs.lon = str(self.site.lon / u.deg)
-        obs.lat = str(self.site.lat / u.deg)
-        obs.elev = self.site.height / u.m
-        for ii, tt in enumerate(test_dates):
-            obs.date = ephem.Date(tt.datetime)
-            moon.compute(obs)
-            moon_altitudes[ii] = moon.alt * 180.0 / np.pi
-            moon_azimuths[ii] = moon.az * 180.0 / np.pi
-            moon_phases[ii] = moon.phase
-
-        moon_conditions = {
-            "altitudes": moon_altitudes,
-            "azimuths": moon_azimuths,
-            "phases": moon_phases,
-        }
-        return moon_conditions
+        Args:
+            catalogue (TargetCatalogue): targets to transform
+
+        Returns:
+            alt, az (Latitude, Longitude): positions with shape (n_targets, n_times)
+        """
+        positions = catalogue.coords
+        self.n_evaluations += len(catalogue) * len(self.time_range)
+        profiling.count("target_positions", len(catalogue) * len(self.time_range))
+
+        if self.engine == "fast":
+            alt, az = fast_coordinates.alt_az(
+                positions.ra, positions.dec, self.time_range, self.site
+            )
+            return Latitude(alt, unit=u.deg), Longitude(az, unit=u.deg)
 
+        target_alt_az = positions[:, np.newaxis].transform_to(self.altaz_frame)
+        return target_alt_az.alt, target_alt_az.az
 
-def setup_nights(date, site, darkness, plan_range):
+    @profiling.stage("calculate_moon_positions")
+    def calculate_moon_positions(self, test_dates):
+        """calculates altitudes, azimuths and phases of the moon for all test dates
+        in a single vectorized call"""
+        return ephemeris.moon_positions(test_dates, self.site)
+
+
+@profiling.stage("setup_nights")
+def setup_nights(
+    date,
+    site,
+    darkness,
+    plan_range,
+    engine="astropy",
+    twilight=None,
+    sampling="grid",
+    tolerance=1.0,
+    season=None,
+):
     """Setup an array of night objects that can be used to plan targets.
 
     Args:
@@ -138,6 +437,13 @@ def setup_nights(date, site, darkness, plan_range):
         site (EarthLocation): site definition
         darkness (dict): darkness definition
         plan_range (timedelta): number of nights
+        engine (str): coordinate engine, "astropy" or "fast"
+        twilight (TwilightTable): precomputed sun set/rise times, nights that are
+            not covered by the table are solved as usual
+        sampling (str): "grid" or "adaptive" sampling of the nights
+        tolerance (float): precision of the adaptive window edges in seconds
+        season (SeasonEphemeris): precomputed sun and moon positions, nights that
+            are not covered by the season are calculated as usual
 
     Returns:
         nights (array): array of nights
@@ -149,18 +455,192 @@ def setup_nights(date, site, darkness, plan_range):
 
     for i in range(n_nights):
         night = night_start + timedelta(days=i)
-        nights.append(Night(night, site, darkness))
+        sun_times = None
+        if twilight is not None:
+            sun_times = twilight.lookup(night)
+        nights.append(
+            Night(
+                night,
+                site,
+                darkness,
+                engine=engine,
+                sun_times=sun_times,
+                sampling=sampling,
+                tolerance=tolerance,
+                season=season,
+            )
+        )
+
+    return nights
+
+
+@profiling.stage("plan_nights")
+def plan_nights(nights, targets, workers=1, executor=None):
+    """Plan all targets into all nights.
+
+    With more than one worker, the (night, target) cells are distributed over a
+    pool of processes in batches of targets per night. The results are merged
+    back in the order of the nights and targets, so that each `Night.schedule`
+    is identical to the serial result.
+
+    Args:
+        nights (array): array of nights
+        targets (array): array of targets
+        workers (int): number of worker processes
+        executor (ProcessPoolExecutor): pool of `workers` processes to use, e.g.
+            kept by a long-running service, a new pool is started if not given
+
+    Returns:
+        nights (array): the same nights, with their schedules filled
+    """
+    if workers is None or workers <= 1:
+        for night in nights:
+            night.plan_targets(targets)
+        return nights
+
+    if not len(nights) or not len(targets):
+        return nights
+
+    # split the targets so that there are enough (night, targets) cells to keep
+    # all workers busy, each cell is planned in a single batch
+    n_chunks = min(len(targets), -(-4 * workers // len(nights)))
+    chunk_size = -(-len(targets) // n_chunks)
+    target_chunks = [
+        targets[i : i + chunk_size] for i in range(0, len(targets), chunk_size)
+    ]
+    cells = [(night, chunk) for night in nights for chunk in target_chunks]
+
+    if executor is not None:
+        results = list(executor.map(_plan_cell, cells))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_plan_cell, cells))
+
+    for (night, _), result in zip(cells, results):
+        night.schedule.merge(result)
+
+    return nights
+
+
+def _plan_cell(cell):
+    """plans a (night, targets) cell in a worker process and returns the
+    resulting schedule entries"""
+    night, targets = cell
+    night.schedule = NightSchedule()
+    night.plan_targets(targets)
+    return night.schedule
+
+
+def setup_darkness_nights(
+    date,
+    site,
+    darknesses,
+    plan_range,
+    engine="astropy",
+    twilights=None,
+    sampling="grid",
+    tolerance=1.0,
+    season=None,
+):
+    """Setup the nights to plan for several darkness definitions.
+
+    Args:
+        darknesses (dict): darkness definitions by name
+        twilights (dict): precomputed twilight tables by darkness name
+        other arguments as for `setup_nights`
+
+    Returns:
+        nights (dict): array of nights by darkness name
+    """
+    twilights = twilights or {}
+    return {
+        name: setup_nights(
+            date,
+            site,
+            darkness,
+            plan_range,
+            engine,
+            twilights.get(name),
+            sampling,
+            tolerance,
+            season,
+        )
+        for name, darkness in darknesses.items()
+    }
+
+
+@profiling.stage("plan_darkness_nights")
+def plan_darkness_nights(nights, targets, workers=1):
+    """Plan all targets into the nights of several darkness definitions.
+
+    The target positions and the moon only depend on the darkness definitions
+    through the sun set and rise. For each night-date they are calculated once
+    on the time grid of the darkness with the longest night, and the criteria of
+    each darkness definition are applied to this shared geometry.
+
+    Args:
+        nights (dict): arrays of nights with the same dates by darkness name, see
+            `setup_darkness_nights`
+        targets (array): array of targets
+        workers (int): number of worker processes
+
+    Returns:
+        nights (dict): the same nights, with their schedules filled
+    """
+    if not len(targets):
+        return nights
+    catalogue = TargetCatalogue.from_targets(targets)
+    dates = list(zip(*nights.values()))
+
+    if workers is None or workers <= 1:
+        for same_date in dates:
+            plan_geometry(same_date, catalogue)
+        return nights
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(
+            executor.map(
+                _plan_geometry_cell, [(same_date, catalogue) for same_date in dates]
+            )
+        )
+
+    for same_date, schedules in zip(dates, results):
+        for night, schedule in zip(same_date, schedules):
+            night.schedule.merge(schedule)
 
     return nights
 
 
+def plan_geometry(same_date, catalogue):
+    """plans a catalogue into nights of the same date and site with different
+    darkness definitions with a single geometry calculation"""
+    widest = max(same_date, key=lambda night: night.sun_rise - night.sun_set)
+    target_alt, target_az = widest.calculate_targets(catalogue)
+
+    for night in same_date:
+        if night is not widest:
+            night.share_geometry(widest)
+        night.add_visibility(catalogue, target_alt, target_az)
+
+
+def _plan_geometry_cell(cell):
+    """plans nights of the same date in a worker process and returns their
+    schedules"""
+    same_date, catalogue = cell
+    for night in same_date:
+        night.schedule = NightSchedule()
+    plan_geometry(same_date, catalogue)
+    return [night.schedule for night in same_date]
+
+
+@profiling.stage("find_sun_rise_and_set")
 def find_sun_rise_and_set(date, site, darkness):
     """calculates the rise and set time for the sun
 
     Args:
         date (datetime): night-date
         site (EarthLocation): site definition
-        darkness (dict): darkness definition
+        darkness (Darkness or dict): darkness definition
 
     Returns:
         sun_set, sun_rise (datetime, datetime): set and rise time of the sun
@@ -168,7 +648,7 @@ def find_sun_rise_and_set(date, site, darkness):
     sun_rise = None
     sun_set = None
 
-    sun_horizon = Angle(darkness["max_sun_altitude"]).to_string(unit=u.degree, sep=":")
+    sun_horizon = parse_darkness(darkness).sun_horizon
 
     sun = ephem.Sun()
     obs = ephem.Observer()
@@ -3,20 +3,188 @@
 contains the default observer configuration that is written to user-space for configuration.
 """
 
+import functools
 import json
+import os
 
-from astropy.coordinates import EarthLocation
+from collections.abc import Mapping
+
+SITE_KEYS = ("lon", "lat", "height")
+DARKNESS_KEYS = (
+    "max_sun_altitude",
+    "max_moon_altitude",
+    "max_moon_phase",
+    "min_moon_distance",
+)
+OBSERVATION_KEYS = ("run_duration", "wobble_offset")
+
+
+class Darkness(Mapping):
+    """darkness definition of the configuration with its parsed criteria.
+
+    Behaves like the read-only dict of the configuration, the criteria are parsed
+    once when the definition is created and are shared by all nights.
+
+    Attributes:
+        name (str): name of the definition in the configuration
+        max_sun_altitude (Angle): sun altitude at which the night starts and ends
+        sun_horizon (str): max_sun_altitude in the format expected by ephem
+        max_moon_altitude (Angle): highest allowed moon altitude
+        max_moon_phase (Quantity): highest allowed moon phase, None if not limited
+        min_moon_distance (Angle): smallest allowed target distance to the moon,
+            None if not limited
+    """
+
+    __slots__ = (
+        "name",
+        "_definition",
+        "max_sun_altitude",
+        "sun_horizon",
+        "max_moon_altitude",
+        "max_moon_phase",
+        "min_moon_distance",
+    )
+
+    def __init__(self, name, definition):
+        import astropy.units as u
+        from astropy.coordinates import Angle
+        from astropy.units import Quantity
+
+        missing = [key for key in DARKNESS_KEYS if key not in definition]
+        if missing:
+            raise ValueError(f"Darkness {name} is missing {', '.join(missing)}")
+
+        def parse(key, parser, optional=False):
+            value = definition[key]
+            if optional and value is False:
+                return None
+            try:
+                parsed = parser(value)
+            except (TypeError, ValueError) as error:
+                raise ValueError(f"Darkness {name}: invalid {key} {value!r}") from error
+            parsed.flags.writeable = False
+            return parsed
+
+        set_slot = super().__setattr__
+        set_slot("name", name)
+        set_slot("_definition", dict(definition))
+        set_slot("max_sun_altitude", parse("max_sun_altitude", Angle))
+        set_slot(
+            "sun_horizon", self.max_sun_altitude.to_string(unit=u.degree, sep=":")
+        )
+        set_slot("max_moon_altitude", parse("max_moon_altitude", Angle))
+        set_slot(
+            "max_moon_phase",
+            parse("max_moon_phase", _dimensionless, optional=True),
+        )
+        set_slot(
+            "min_moon_distance", parse("min_moon_distance", Angle, optional=True)
+        )
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Darkness {self.name} is read-only")
+
+    def __getitem__(self, key):
+        return self._definition[key]
+
+    def __iter__(self):
+        return iter(self._definition)
+
+    def __len__(self):
+        return len(self._definition)
+
+    def __repr__(self):
+        return repr(self._definition)
+
+    def __reduce__(self):
+        # unpickled definitions are parsed once per process as well
+        return (parse_darkness, (self._definition, self.name))
+
+
+def _dimensionless(value):
+    from astropy.units import Quantity, dimensionless_unscaled
+
+    quantity = Quantity(value)
+    if quantity.unit != dimensionless_unscaled:
+        raise ValueError(f"{value!r} is not dimensionless")
+    return quantity
+
+
+def parse_darkness(darkness, name=None):
+    """the parsed `Darkness` of a darkness definition, which is created once per
+    process for equal definitions
+
+    Args:
+        darkness (dict or Darkness): darkness definition, or None for nights
+            with given sun times and schedules
+        name (str): name of the definition
+
+    Returns:
+        darkness (Darkness): the parsed definition
+    """
+    if darkness is None or isinstance(darkness, Darkness):
+        return darkness
+    return _parse_darkness(name, tuple(sorted(darkness.items())))
+
+
+@functools.lru_cache(maxsize=None)
+def _parse_darkness(name, items):
+    return Darkness(name, dict(items))
+
+
+def validate_config(cfg_data):
+    """checks that a configuration has all sections and that all sites,
+    darkness definitions and observation parameters can be parsed
+
+    Raises:
+        ValueError: describing the first problem found
+    """
+    import astropy.units as u
+    from astropy.units import Quantity
+
+    for section in ("Sites", "Darkness", "ObservationParameters"):
+        if not isinstance(cfg_data.get(section), dict):
+            raise ValueError(f"Configuration is missing the section {section}")
+
+    for name, site in cfg_data["Sites"].items():
+        missing = [key for key in SITE_KEYS if key not in site]
+        if missing:
+            raise ValueError(f"Site {name} is missing {', '.join(missing)}")
+        for key in SITE_KEYS:
+            try:
+                float(site[key])
+            except (TypeError, ValueError) as error:
+                raise ValueError(f"Site {name}: invalid {key} {site[key]!r}") from error
+
+    for name, darkness in cfg_data["Darkness"].items():
+        parse_darkness(darkness, name)
+
+    obs_pars = cfg_data["ObservationParameters"]
+    for key, unit in zip(OBSERVATION_KEYS, (u.s, u.deg)):
+        try:
+            Quantity(obs_pars[key]).to(unit)
+        except KeyError as error:
+            raise ValueError(f"ObservationParameters is missing {key}") from error
+        except (TypeError, ValueError) as error:
+            raise ValueError(
+                f"ObservationParameters: invalid {key} {obs_pars[key]!r}"
+            ) from error
 
 
 class ObserverConfiguration:
     """class for the handling of the observer configuration
-    that dictates the configurations for the planning of the observations"""
+    that dictates the configurations for the planning of the observations.
+
+    Sites, darkness definitions and observation parameters are parsed on first
+    use and then shared by all nights."""
 
     def __init__(self, cfg_data):
         self.cfg_data = cfg_data
         self.sites = cfg_data["Sites"]
         self.darkness = cfg_data["Darkness"]
         self.obs_pars = cfg_data["ObservationParameters"]
+        self._locations = {}
+        self._observation_pars = None
 
     def __repr__(self):
         return json.dumps(self.cfg_data, indent=2)
@@ -27,14 +195,19 @@ class ObserverConfiguration:
             print("SITE {} is not supported in the config.".format(name))
             exit()
 
-        site = self.sites[name]
-        location = EarthLocation(
-            lon=float(site["lon"]),
-            lat=float(site["lat"]),
-            height=float(site["height"]),
-        )
-        location.info.name = name
-        return location
+        if name not in self._locations:
+            from astropy.coordinates import EarthLocation
+
+            site = self.sites[name]
+            location = EarthLocation(
+                lon=float(site["lon"]),
+                lat=float(site["lat"]),
+                height=float(site["height"]),
+            )
+            location.info.name = name
+            location.flags.writeable = False
+            self._locations[name] = location
+        return self._locations[name]
 
     def get_darkness_from_name(self, name):
         """ Getter for specific darkness criteria from the config """
@@ -42,11 +215,48 @@ class ObserverConfiguration:
             print("DARKNESS option {} is not supported in the config!".format(name))
             exit()
 
-        return self.darkness[name]
+        return parse_darkness(self.darkness[name], name)
 
     def get_observation_pars(self):
-        """ Getter for observation parameters """
-        return (self.obs_pars["run_duration"], self.obs_pars["wobble_offset"])
+        """ Getter for observation parameters (run duration, wobble offset) """
+        if self._observation_pars is None:
+            from astropy.units import Quantity
+
+            self._observation_pars = tuple(
+                Quantity(self.obs_pars[key]) for key in OBSERVATION_KEYS
+            )
+        return self._observation_pars
+
+
+@functools.lru_cache(maxsize=None)
+def load_observer_config(path=None):
+    """loads and validates the site configuration deployed with iop-init, once
+    per process and path
+
+    Args:
+        path (str): path of the configuration JSON, the default configuration is
+            used if None
+
+    Returns:
+        cfg (ObserverConfiguration): the configuration
+    """
+    if path is None:
+        cfg_data = default_observer_config()
+    else:
+        with open(path) as config_file:
+            cfg_data = json.load(config_file)
+        validate_config(cfg_data)
+    return ObserverConfiguration(cfg_data)
+
+
+def config_dir():
+    """returns the directory of the site configuration deployed with iop-init
+    (pointed to by IOP_SITE_CONFIG), where caches are kept as well.
+    Returns None if no site configuration is used."""
+    site_config = os.environ.get("IOP_SITE_CONFIG")
+    if not site_config:
+        return None
+    return os.path.dirname(os.path.abspath(site_config))
 
 
 def default_observer_config():
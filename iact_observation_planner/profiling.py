@@ -0,0 +1,185 @@
+"""profiling.py
+
+timers and counters of the stages of the planning pipeline.
+
+The stages are functions decorated with `stage` or blocks wrapped in `timed`.
+Profiling is disabled by default, then a stage only looks up the (missing)
+profiler and calls the function. After `enable`, every call of a stage is
+recorded with its start, duration and thread, and `count` adds to named
+counters. Stages can be nested (e.g. `find_sun_rise_and_set` within
+`setup_nights`), the total time of a stage includes its nested stages. Stages
+that run in worker processes (`--workers`) are not recorded, only the time the
+main process spends in `plan_nights` while waiting for them.
+
+The records are summarized in a table per stage and can be written as a
+Chrome trace (JSON), which can be viewed in chrome://tracing or Perfetto:
+
+    profiler = profiling.enable()
+    ...
+    profiling.report("profile.json")
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+
+_PROFILER = None
+
+
+class Profiler:
+    """records the calls of all stages
+
+    Attributes:
+        events (list): (stage, start, end, thread) of all calls, times from
+            time.perf_counter
+        counters (dict): values of the counters by name
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.events = []
+        self.counters = {}
+
+    def __repr__(self):
+        return f"Profiler of {len(self.events)} stage calls"
+
+    def record(self, name, start, end):
+        self.events.append((name, start, end, threading.get_ident()))
+
+    def count(self, name, value):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def stages(self):
+        """number of calls and total time in seconds per stage, in the order of
+        their first call"""
+        stages = {}
+        for name, start, end, _ in self.events:
+            calls, total = stages.get(name, (0, 0.0))
+            stages[name] = (calls + 1, total + end - start)
+        return stages
+
+    def summary(self):
+        """prints a table of the calls and times of all stages and the counters"""
+        wall_time = time.perf_counter() - self.start
+        stages = self.stages()
+        width = max([len(name) for name in list(stages) + list(self.counters)] + [5])
+
+        out = f"Profile (wall time {wall_time:.3f} s):\n"
+        out += f" {'stage':{width}} {'calls':>7} {'total s':>9} {'mean ms':>9} {'share':>6}\n"
+        for name, (calls, total) in stages.items():
+            out += (
+                f" {name:{width}} {calls:7d} {total:9.3f} {1000 * total / calls:9.2f}"
+                + f" {100 * total / wall_time:5.1f}%\n"
+            )
+        for name, value in self.counters.items():
+            out += f" {name:{width}} {value:>7}\n"
+        print(out)
+        return out
+
+    def trace(self):
+        """the records in the Chrome trace event format"""
+        pid = os.getpid()
+        events = [
+            {
+                "name": name,
+                "cat": "stage",
+                "ph": "X",
+                "ts": (start - self.start) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": pid,
+                "tid": thread,
+            }
+            for name, start, end, thread in self.events
+        ]
+        stages = {
+            name: {"calls": calls, "total": total}
+            for name, (calls, total) in self.stages().items()
+        }
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {"stages": stages, "counters": self.counters},
+        }
+
+    def write_trace(self, path):
+        with open(path, "w") as trace_file:
+            json.dump(self.trace(), trace_file)
+
+
+def enable():
+    """starts recording the stages with a new profiler and returns it"""
+    global _PROFILER
+    _PROFILER = Profiler()
+    return _PROFILER
+
+
+def disable():
+    """stops recording and returns the profiler, None if it was not enabled"""
+    global _PROFILER
+    profiler, _PROFILER = _PROFILER, None
+    return profiler
+
+
+def enabled():
+    return _PROFILER is not None
+
+
+def report(path=None):
+    """stops recording, prints the summary and writes the Chrome trace to path"""
+    profiler = disable()
+    if profiler is None:
+        return None
+    profiler.summary()
+    if path is not None:
+        profiler.write_trace(path)
+        print(f"PROFILE TRACE -> {path}")
+    return profiler
+
+
+def stage(name):
+    """decorator that records the calls of a function as a stage"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = _PROFILER
+            if profiler is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.record(name, start, time.perf_counter())
+
+        return wrapper
+
+    return decorator
+
+
+class timed:
+    """context manager that records a block as a stage"""
+
+    __slots__ = ("name", "profiler", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.profiler = _PROFILER
+        if self.profiler is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profiler is not None:
+            self.profiler.record(self.name, self.start, time.perf_counter())
+        return False
+
+
+def count(name, value=1):
+    """adds a value to a counter, e.g. the number of evaluated positions"""
+    profiler = _PROFILER
+    if profiler is not None:
+        profiler.count(name, value)
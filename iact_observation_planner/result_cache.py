@@ -0,0 +1,181 @@
+"""result_cache.py
+
+content-addressed on-disk cache of planned (night, target) cells.
+
+The results of a night are stored in one `.npz` file named after the content
+hash of the night (see `session.night_key`), holding the arrays of a
+`NightSchedule` batch and the content hashes of the targets of its rows.
+Targets that are not visible in the night are stored as empty rows, so that
+they are not planned again either. Reading a file marks it as recently used;
+when the cache grows beyond its size limit, the least recently used files are
+removed.
+"""
+
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+
+# default size limit of the cache in bytes
+MAX_SIZE = 256 * 2 ** 20
+
+
+class ResultCache:
+    """size-bounded LRU cache of planned cells in a directory"""
+
+    def __init__(self, directory, max_size=MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f"ResultCache in {self.directory} ({self.hits} hits, {self.misses} misses)"
+
+    def path(self, night_id):
+        return os.path.join(self.directory, f"{night_id}.npz")
+
+    def _load(self, night_id):
+        """(keys, batch) stored for a night, None if there is no valid file"""
+        path = self.path(night_id)
+        try:
+            with np.load(path) as data:
+                keys = data["keys"]
+                batch = (
+                    data["grid"],
+                    data["samples"],
+                    data["altitudes"],
+                    data["offsets"],
+                    data["start_dates"],
+                    data["end_dates"],
+                )
+            os.utime(path)
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            # missing, truncated or removed by another process meanwhile
+            return None
+        return keys, batch
+
+    def get(self, night_id, target_ids):
+        """looks up cells of a night
+
+        Args:
+            night_id (str): content hash of the night
+            target_ids (list): content hashes of the targets
+
+        Returns:
+            cells (dict): (batch, row) of the visible and None of the invisible
+                cells by target hash, cells that are not cached are missing
+        """
+        stored = self._load(night_id)
+        if stored is None:
+            self.misses += len(target_ids)
+            return {}
+
+        keys, batch = stored
+        rows = {str(key): row for row, key in enumerate(keys)}
+        offsets = batch[3]
+
+        cells = {}
+        for target_id in target_ids:
+            row = rows.get(target_id)
+            if row is None:
+                continue
+            visible = offsets[row + 1] > offsets[row]
+            cells[target_id] = (batch, row) if visible else None
+
+        self.hits += len(cells)
+        self.misses += len(target_ids) - len(cells)
+        return cells
+
+    def put(self, night_id, grid, cells):
+        """stores cells of a night together with the cells stored before
+
+        Args:
+            night_id (str): content hash of the night
+            grid (ndarray): sample times of the night (matplotlib date numbers)
+            cells (dict): (batch, row) or None by target hash
+        """
+        stored = self._load(night_id)
+        if stored is not None:
+            keys, batch = stored
+            previous = {
+                str(key): (batch, row)
+                for row, key in enumerate(keys)
+                if str(key) not in cells
+            }
+            cells = {**previous, **cells}
+
+        samples, altitudes, counts, start_dates, end_dates = [], [], [], [], []
+        for cell in cells.values():
+            if cell is None:
+                counts.append(0)
+                start_dates.append(np.nan)
+                end_dates.append(np.nan)
+                continue
+
+            (_, batch_samples, batch_altitudes, offsets, starts, ends), row = cell
+            window = slice(offsets[row], offsets[row + 1])
+            samples.append(batch_samples[window])
+            altitudes.append(batch_altitudes[window])
+            counts.append(offsets[row + 1] - offsets[row])
+            start_dates.append(starts[row])
+            end_dates.append(ends[row])
+
+        os.makedirs(self.directory, exist_ok=True)
+        # each writer has its own temporary file, the last complete file wins
+        handle, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as cache_file:
+                np.savez(
+                    cache_file,
+                    keys=np.array(list(cells), dtype=str),
+                    grid=grid,
+                    samples=np.concatenate(samples or [np.zeros(0, dtype=np.uint8)]),
+                    altitudes=np.concatenate(
+                        altitudes or [np.zeros(0, dtype=np.float32)]
+                    ),
+                    offsets=np.concatenate([[0], np.cumsum(counts)]),
+                    start_dates=np.array(start_dates),
+                    end_dates=np.array(end_dates),
+                )
+            os.replace(tmp_path, self.path(night_id))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def size(self):
+        """total size of the cache files in bytes"""
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def evict(self):
+        """removes the least recently used files until the cache fits its size
+        limit
+
+        Returns:
+            removed (int): number of removed files
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+        size = sum(entry.stat().st_size for entry in entries)
+
+        removed = 0
+        for entry in entries:
+            if size <= self.max_size:
+                break
+            size -= entry.stat().st_size
+            os.remove(entry.path)
+            removed += 1
+        return removed
+
+    def clear(self):
+        for entry in self._entries():
+            os.remove(entry.path)
+
+    def _entries(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return [
+            entry
+            for entry in os.scandir(self.directory)
+            if entry.is_file() and entry.name.endswith(".npz")
+        ]
@@ -2,31 +2,100 @@
 Schedule class that provides good output and plotting.
 """
 
-import matplotlib.pyplot as plt
+from matplotlib.dates import num2date
+
+from iact_observation_planner import export as iop_export
+from iact_observation_planner import profiling
+from iact_observation_planner.visibility import VisibilityIndex
+
+# shortest period without visible targets that is reported (in days)
+MIN_GAP = 10.0 / 1440
 
 
 class Schedule:
-    def __init__(self, nights):
+    def __init__(self, nights, allocation=None, index=None, site=None):
         self.nights = nights
+        self.site = site
+        self.allocation = allocation
+        if index is None:
+            index = VisibilityIndex.from_nights(nights)
+        self.index = index
         self.dates = [night.date for night in self.nights]
         self.sched_start = min([night.sun_set] for night in self.nights)
         self.sched_end = max([night.sun_rise] for night in self.nights)
         self.n_nights = len(self.nights)
         self.layout_schedule()
 
+    @profiling.stage("layout_schedule")
     def layout_schedule(self):
+        if self.site is not None:
+            print(f"Site: {self.site}")
         for night in self.nights:
             print(f"Evening Date: {night.date:%Y-%m-%d}")
-            targets_schedule = night.schedule
-            for key in targets_schedule.keys():
-                target = targets_schedule[key]
-                start = target["start"]
-                end = target["end"]
-                time_alt = zip(target["times"], target["altitudes"])
-                culmination = max(time_alt, key=lambda item:item[1])[0]
-                print(f" * {key}: from {start:%H:%M:%S} to {end:%H:%M:%S}  culmination at {culmination:%H:%M:%S}")
+            windows = night.schedule.windows()
+            if len(windows["names"]):
+                starts, ends, culminations = (
+                    num2date(windows[key]) for key in ("starts", "ends", "culminations")
+                )
+                for key, start, end, culmination in zip(
+                    windows["names"], starts, ends, culminations
+                ):
+                    print(f" * {key}: from {start:%H:%M:%S} to {end:%H:%M:%S}  culmination at {culmination:%H:%M:%S}")
+            for start, end in self.index.gaps(night.sun_set, night.sun_rise, MIN_GAP):
+                print(f" - no target visible from {start:%H:%M:%S} to {end:%H:%M:%S}")
+            if self.allocation is not None:
+                runs = self.allocation.runs.get(night.date, [])
+                print(f" Allocated runs: {len(runs)}")
+                for name, start, end in runs:
+                    print(f"   {start:%H:%M:%S} - {end:%H:%M:%S}  {name}")
+
+        if self.allocation is not None:
+            self.summarize_allocation()
+
+    def export(self, path, fmt=None):
+        """writes the schedule to a file, see `export.export_schedules`"""
+        return iop_export.export_schedules([self], path, fmt)
+
+    def summarize_allocation(self):
+        print("Allocated observation time:")
+        for name, hours in self.allocation.requested_hours.items():
+            allocated = self.allocation.allocated_hours[name]
+            note = ""
+            if self.allocation.is_below_one_run(name):
+                note = "  (not fulfilled, below one run)"
+            elif not self.allocation.is_fulfilled(name):
+                note = "  (not fulfilled)"
+            print(f" * {name}: {allocated:.2f} h of {hours:.2f} h{note}")
+
+
 
 
+    
 
+def summarize_sites(schedules):
+    """prints the allocated hours of all targets in several schedules, e.g. of
+    different sites or darkness definitions"""
+    sites = [schedule.site for schedule in schedules]
+    names = list(
+        dict.fromkeys(
+            name
+            for schedule in schedules
+            for name in schedule.allocation.requested_hours
+        )
+    )
 
-    
\ No newline at end of file
+    width = max([len(name) for name in names] + [6])
+    columns = [max(len(site), 10) for site in sites]
+    out = "Allocated observation time per schedule:\n"
+    out += f" {'target':{width}}"
+    out += "".join(f" {site:>{column}}" for site, column in zip(sites, columns)) + "\n"
+    for name in names:
+        hours = [
+            schedule.allocation.allocated_hours.get(name, 0.0) for schedule in schedules
+        ]
+        out += f" {name:{width}}"
+        out += "".join(
+            f" {h:{column - 2}.2f} h" for h, column in zip(hours, columns)
+        ) + "\n"
+    print(out)
+    return out
@@ -0,0 +1,256 @@
+"""season.py
+
+precomputed sun and moon ephemerides of a whole season.
+
+The altitude and azimuth of the sun and of the moon and the moon phase are
+calculated for a site on one uniform time grid (by default in steps of one
+minute) with the vectorized functions of `ephemeris` and written to a `.npy`
+file, which is read back as a memory map. A `Night` covered by the season takes
+its sun set and rise from the sun altitudes and uses views into the arrays as
+its time grid and moon positions, so that planning a range of nights does not
+solve any sun or moon position per night.
+"""
+
+import json
+import os
+
+from datetime import datetime, timedelta
+
+import numpy as np
+from astropy.time import Time
+
+from iact_observation_planner import ephemeris
+from iact_observation_planner.twilight import site_key
+
+# rows of the ephemeris array
+ROWS = ("sun_altitudes", "sun_azimuths", "moon_altitudes", "moon_azimuths", "moon_phases")
+SUN_ALT, SUN_AZ, MOON_ALT, MOON_AZ, MOON_PHASE = range(len(ROWS))
+
+# default time step in seconds
+STEP = 60.0
+# number of samples calculated at once when building a season
+CHUNK_SIZE = 7 * 1440
+# the sun set and rise of a night-date are searched in the following two days
+SEARCH_DAYS = 2
+
+MJD_EPOCH = datetime(1858, 11, 17)
+
+
+class SeasonEphemeris:
+    """sun and moon positions of a site on a uniform time grid
+
+    Attributes:
+        site_key (str): site the ephemeris was calculated for
+        start_mjd (float): time of the first sample (MJD, UTC)
+        step (float): time between the samples in seconds
+        data (ndarray): positions with shape (len(ROWS), n_samples), float32
+        path (str): .npy file of the data, None if only kept in memory
+    """
+
+    def __init__(self, site_key, start_mjd, step, data, path=None):
+        self.site_key = site_key
+        self.start_mjd = float(start_mjd)
+        self.step = float(step)
+        self.data = data
+        self.path = path
+
+    def __len__(self):
+        return self.data.shape[1]
+
+    def __repr__(self):
+        start = _from_mjd(self.start_mjd)
+        end = _from_mjd(self.mjd(len(self) - 1))
+        return (
+            f"SeasonEphemeris {self.site_key}: {start:%Y-%m-%d %H:%M} to"
+            + f" {end:%Y-%m-%d %H:%M} in steps of {self.step:g} s"
+        )
+
+    def __getstate__(self):
+        # memory mapped seasons are opened again instead of being copied
+        state = dict(self.__dict__)
+        if self.path is not None:
+            state["data"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.data is None:
+            self.data = np.load(self.path, mmap_mode="r")
+
+    @property
+    def key(self):
+        """identifies the time grid of the season"""
+        return f"{self.site_key}/{self.start_mjd:.6f}/{self.step:g}"
+
+    @classmethod
+    def build(cls, site, start, end, step=STEP, path=None):
+        """calculates the ephemerides from start to end (exclusive)
+
+        Args:
+            site (EarthLocation): site definition
+            start, end (datetime): time range (UTC)
+            step (float): time between the samples in seconds
+            path (str): .npy file to write the data to, kept in memory if None
+
+        Returns:
+            season (SeasonEphemeris): the calculated season, memory mapped if
+                written to a file
+        """
+        start_mjd = _to_mjd(start)
+        n_samples = int(np.ceil((_to_mjd(end) - start_mjd) * 86400 / step))
+        shape = (len(ROWS), n_samples)
+        if path is None:
+            data = np.empty(shape, dtype=np.float32)
+        else:
+            data = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=shape)
+
+        for first in range(0, n_samples, CHUNK_SIZE):
+            samples = np.arange(first, min(first + CHUNK_SIZE, n_samples))
+            times = Time(start_mjd + samples * step / 86400, format="mjd", scale="utc")
+            sun = ephemeris.sun_positions(times, site)
+            moon = ephemeris.moon_positions(times, site)
+            data[SUN_ALT, samples] = sun["altitudes"]
+            data[SUN_AZ, samples] = sun["azimuths"]
+            data[MOON_ALT, samples] = moon["altitudes"]
+            data[MOON_AZ, samples] = moon["azimuths"]
+            data[MOON_PHASE, samples] = moon["phases"]
+
+        season = cls(site_key(site), start_mjd, step, data)
+        if path is not None:
+            data.flush()
+            del data
+            with open(metadata_path(path), "w") as metadata_file:
+                json.dump(
+                    {"site_key": season.site_key, "start_mjd": start_mjd, "step": step},
+                    metadata_file,
+                )
+            season = cls.load(path)
+        return season
+
+    @classmethod
+    def load(cls, path):
+        """opens a season written by `build` as a read-only memory map"""
+        with open(metadata_path(path)) as metadata_file:
+            metadata = json.load(metadata_file)
+        data = np.load(path, mmap_mode="r")
+        return cls(
+            metadata["site_key"], metadata["start_mjd"], metadata["step"], data, path
+        )
+
+    def mjd(self, samples):
+        """times (MJD) of samples"""
+        return self.start_mjd + np.asarray(samples) * self.step / 86400
+
+    def sample_at(self, date):
+        """(fractional) sample of a datetime"""
+        return (_to_mjd(date) - self.start_mjd) * 86400 / self.step
+
+    def sun_times(self, date, horizon):
+        """sun set and rise of a night-date, the first setting after the start of
+        the date and the next rising, like `nights.find_sun_rise_and_set`
+
+        Args:
+            date (datetime): night-date
+            horizon (float): sun altitude in degrees that starts and ends the night
+
+        Returns:
+            sun_set, sun_rise (datetime): interpolated between the samples, None if
+                the season does not cover the night
+        """
+        first = int(np.ceil(self.sample_at(date)))
+        last = first + int(SEARCH_DAYS * 86400 / self.step)
+        if first < 0 or last > len(self):
+            return None
+
+        altitudes = self.data[SUN_ALT, first:last]
+        above = altitudes >= horizon
+        sets = np.flatnonzero(above[:-1] & ~above[1:])
+        if not len(sets):
+            return None
+        rises = np.flatnonzero(~above[:-1] & above[1:])
+        rises = rises[rises > sets[0]]
+        if not len(rises):
+            return None
+
+        def crossing(sample):
+            before, after = altitudes[sample], altitudes[sample + 1]
+            fraction = (before - horizon) / (before - after)
+            return _from_mjd(self.mjd(first + sample + fraction))
+
+        return crossing(sets[0]), crossing(rises[0])
+
+    def window(self, sun_set, sun_rise, n_samples):
+        """samples of a night between sun set and rise, every stride-th sample so
+        that there are at most n_samples
+
+        Returns:
+            samples (slice): samples of the night, None if the season does not
+                cover it
+        """
+        first = int(np.ceil(self.sample_at(sun_set)))
+        last = int(np.floor(self.sample_at(sun_rise)))
+        if first < 0 or last >= len(self) or last < first:
+            return None
+        stride = max(1, int(np.ceil((last - first + 1) / n_samples)))
+        return slice(first, last + 1, stride)
+
+    def moon_conditions(self, samples):
+        """altitudes, azimuths and phases of the moon at samples, as views into
+        the season"""
+        return {
+            "altitudes": self.data[MOON_ALT, samples],
+            "azimuths": self.data[MOON_AZ, samples],
+            "phases": self.data[MOON_PHASE, samples],
+        }
+
+
+def metadata_path(path):
+    """path of the json file with the time grid of a season"""
+    return os.path.splitext(path)[0] + ".json"
+
+
+def season_path(directory, site):
+    """path of the season of a site in a directory"""
+    return os.path.join(directory, f"season_{site_key(site)}.npy")
+
+
+def load_season(directory, site):
+    """opens the season of a site in a directory, returns None if there is none"""
+    if directory is None:
+        return None
+
+    path = season_path(directory, site)
+    if not os.path.isfile(path) or not os.path.isfile(metadata_path(path)):
+        return None
+
+    season = SeasonEphemeris.load(path)
+    if season.site_key != site_key(site):
+        return None
+    return season
+
+
+def generate_seasons(directory, sites, first_year, last_year, step=STEP):
+    """calculates and stores the seasons of sites for the nights of the years
+    first_year to last_year
+
+    Returns:
+        paths (list): paths of the written seasons
+    """
+    start = datetime(first_year, 1, 1)
+    # the last nights end up to two days after their night-date
+    end = datetime(last_year + 1, 1, 1) + timedelta(days=SEARCH_DAYS)
+
+    paths = []
+    for site in sites:
+        path = season_path(directory, site)
+        SeasonEphemeris.build(site, start, end, step, path)
+        paths.append(path)
+    return paths
+
+
+def _to_mjd(date):
+    return (date - MJD_EPOCH) / timedelta(days=1)
+
+
+def _from_mjd(mjd):
+    return MJD_EPOCH + timedelta(days=float(mjd))
@@ -0,0 +1,313 @@
+"""server.py
+
+long-running planner with a local HTTP/JSON API.
+
+`iact-observation-planner --serve PORT` loads the configuration and the heavy
+modules once and keeps a `PlanningSession` per site, darkness definition and
+sampling in memory. The resolved target names, the sun and moon data of the
+nights and the planned (night, target) cells therefore stay warm between
+requests, and repeating a query only assembles the known cells. Nights and
+cells outside of the last query of a session are dropped and the number of
+nights and targets of a query is limited, so that the memory stays bounded.
+With more than one worker, the service keeps one pool of processes for all
+requests. Requests are handled in their own threads; requests for the same
+session wait for each other, requests for different sessions run concurrently.
+
+Endpoints (the query is a JSON object in the body of a POST request):
+    GET  /health      status, known sessions and number of handled requests
+    POST /visibility  visibility windows of the targets in a range of nights
+    POST /plan        visibility windows and allocated runs
+
+Query keys: "targets" (list of target strings as on the command line, e.g.
+"Crab Nebula;30;5"), "site", "darkness", "date" (first night-date, default
+today) and "range" (number of nights, default 1, at most `MAX_RANGE`), with at
+most `MAX_TARGETS` targets. The records of the response
+have the columns of `export.COLUMNS`.
+"""
+
+import asyncio
+import json
+import threading
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from astropy.coordinates.name_resolve import NameResolveError
+
+from iact_observation_planner import iact_observation_planner as iop_main
+from iact_observation_planner import export as iop_export
+from iact_observation_planner import targets as iop_targets
+
+DEFAULT_HOST = "127.0.0.1"
+# site and darkness of queries without them, as on the command line
+DEFAULT_SITE = "HESS"
+DEFAULT_DARKNESS = "dark"
+# largest accepted request body in bytes
+MAX_BODY = 2 ** 20
+# largest number of nights and targets of a query
+MAX_RANGE = 366
+MAX_TARGETS = 1000
+
+
+class QueryError(ValueError):
+    """invalid query, answered with status 400"""
+
+
+class PlannerService:
+    """planning sessions and resolved targets shared by all requests
+
+    Attributes:
+        sessions (dict): planning session by (site, darkness, engine, sampling,
+            tolerance)
+        n_requests (int): number of handled queries
+    """
+
+    def __init__(
+        self, workers=1, engine="astropy", sampling="grid", tolerance=1.0, offline=False
+    ):
+        self.workers = workers
+        self.engine = engine
+        self.sampling = sampling
+        self.tolerance = tolerance
+        self.started = time.time()
+        self.n_requests = 0
+
+        self.config = iop_main.get_config()
+        self.run_duration, _ = self.config.get_observation_pars()
+        self.target_cache = iop_main.setup_target_cache(offline)
+
+        self.sessions = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._resolve_lock = threading.Lock()
+
+        # one pool for all requests, starting processes per request is too slow
+        self.executor = None
+        if workers is not None and workers > 1:
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+
+    def __repr__(self):
+        return f"PlannerService with {len(self.sessions)} sessions"
+
+    def close(self):
+        """stops the worker processes and saves the target cache"""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        self.target_cache.save()
+
+    def warm(self, site=DEFAULT_SITE, darkness=DEFAULT_DARKNESS):
+        """sets up the session of a site for tonight, which loads the ephemerides
+        and the earth orientation tables before the first request"""
+        self.visibility({"targets": [], "site": site, "darkness": darkness})
+
+    def health(self):
+        return {
+            "status": "ok",
+            "uptime": time.time() - self.started,
+            "requests": self.n_requests,
+            "sessions": [
+                "/".join(str(part) for part in key) for key in list(self.sessions)
+            ],
+        }
+
+    def visibility(self, query):
+        """visibility windows of the targets of a query"""
+        return self.plan(query, allocate=False)
+
+    def plan(self, query, allocate=True):
+        """plans the targets of a query into its nights
+
+        Returns:
+            response (dict): the query options, the records of the nights and
+                (if allocated) the requested and allocated hours per target
+        """
+        start = time.perf_counter()
+        options = self._parse_query(query)
+        targets = self.resolve(options["targets"])
+
+        key = (
+            options["site"],
+            options["darkness"],
+            self.engine,
+            self.sampling,
+            self.tolerance,
+        )
+        session, lock = self._session(key)
+        with lock:
+            n_planned = session.n_planned
+            session.set_range(options["date"], options["range"])
+            session.set_targets(targets)
+            nights = session.plan(self.workers, self.executor)
+            allocation = session.allocate(self.run_duration) if allocate else None
+
+            records = []
+            for night in nights:
+                frame = iop_export.night_records(night, allocation, options["site"])
+                records.extend(iop_export.json_records(frame))
+            planned_cells = session.n_planned - n_planned
+
+            # only the nights and cells of the last query are kept in memory,
+            # repeating it stays warm
+            session.forget()
+
+        response = {
+            "site": options["site"],
+            "darkness": options["darkness"],
+            "date": f"{options['date']:%Y-%m-%d}",
+            "range": options["range"].days,
+            "records": records,
+            "planned_cells": planned_cells,
+        }
+        if allocation is not None:
+            response["requested_hours"] = dict(allocation.requested_hours)
+            response["allocated_hours"] = dict(allocation.allocated_hours)
+        response["elapsed"] = time.perf_counter() - start
+
+        with self._lock:
+            self.n_requests += 1
+        return response
+
+    def resolve(self, target_strings):
+        """targets of a query, the names are resolved through the shared cache"""
+        if not target_strings:
+            return []
+        with self._resolve_lock:
+            try:
+                targets = asyncio.run(
+                    iop_targets.resolve_target_list_async(target_strings, self.target_cache)
+                )
+                return iop_targets.TargetCatalogue.from_targets(targets)
+            except (NameResolveError, ValueError, TypeError) as error:
+                # unknown names and malformed target strings or coordinates
+                raise QueryError(str(error) or type(error).__name__) from error
+            except (TimeoutError, asyncio.TimeoutError) as error:
+                raise QueryError(
+                    f"Resolving the target names timed out: {', '.join(target_strings)}"
+                ) from error
+
+    def _session(self, key):
+        with self._lock:
+            if key not in self.sessions:
+                site, darkness = key[:2]
+                self.sessions[key] = iop_main.setup_session(
+                    self.config.get_site_from_name(site),
+                    self.config.get_darkness_from_name(darkness),
+                    self.engine,
+                    self.sampling,
+                    self.tolerance,
+                )
+                self._locks[key] = threading.Lock()
+            return self.sessions[key], self._locks[key]
+
+    def _parse_query(self, query):
+        if not isinstance(query, dict):
+            raise QueryError("The query has to be a JSON object")
+
+        targets = query.get("targets", [])
+        if isinstance(targets, str):
+            targets = [targets]
+        if not isinstance(targets, list) or not all(
+            isinstance(target, str) for target in targets
+        ):
+            raise QueryError("targets has to be a list of target strings")
+        if len(targets) > MAX_TARGETS:
+            raise QueryError(f"At most {MAX_TARGETS} targets can be planned at once")
+
+        # unknown names would end the process in the configuration getters
+        site = query.get("site", DEFAULT_SITE)
+        if not isinstance(site, str) or site not in self.config.sites:
+            raise QueryError(f"SITE {site} is not supported in the config")
+        darkness = query.get("darkness", DEFAULT_DARKNESS)
+        if not isinstance(darkness, str) or darkness not in self.config.darkness:
+            raise QueryError(f"DARKNESS option {darkness} is not supported in the config")
+
+        plan_range = query.get("range", 1)
+        if not isinstance(plan_range, int) or not 1 <= plan_range <= MAX_RANGE:
+            raise QueryError(f"range has to be from 1 to {MAX_RANGE} nights")
+        try:
+            date = iop_main.parse_date(query.get("date"))["date"]
+        except ValueError as error:
+            raise QueryError(f"Invalid date: {query.get('date')}") from error
+
+        return {
+            "targets": targets,
+            "site": site,
+            "darkness": darkness,
+            "date": date,
+            "range": iop_main.parse_range(plan_range)["range"],
+        }
+
+
+class PlannerRequestHandler(BaseHTTPRequestHandler):
+    """answers the requests of the API with the `PlannerService` of the server"""
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._respond(200, self.server.service.health())
+        else:
+            self._respond(404, {"error": f"Unknown endpoint: {self.path}"})
+
+    def do_POST(self):
+        handlers = {
+            "/plan": self.server.service.plan,
+            "/visibility": self.server.service.visibility,
+        }
+        if self.path not in handlers:
+            self._respond(404, {"error": f"Unknown endpoint: {self.path}"})
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY:
+            self._respond(413, {"error": "Request body too large"})
+            return
+        try:
+            query = json.loads(self.rfile.read(length) or b"{}")
+            response = handlers[self.path](query)
+        except (QueryError, json.JSONDecodeError) as error:
+            self._respond(400, {"error": str(error)})
+        except Exception as error:
+            self._respond(500, {"error": f"{type(error).__name__}: {error}"})
+        else:
+            self._respond(200, response)
+
+    def _respond(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class PlannerServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        super().__init__(address, PlannerRequestHandler)
+        self.service = service
+
+
+def serve(port, host=DEFAULT_HOST, warm=True, **kwargs):
+    """runs the planner service until it is interrupted
+
+    Args:
+        port (int): port to listen on, 0 selects a free port
+        host (str): address to listen on, only the local host by default
+        warm (bool): set up a session before the first request
+        kwargs: options of the `PlannerService`
+    """
+    service = PlannerService(**kwargs)
+    if warm:
+        service.warm()
+
+    server = PlannerServer((host, port), service)
+    print(f"SERVING ON http://{server.server_address[0]}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
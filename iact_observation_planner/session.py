@@ -0,0 +1,319 @@
+"""session.py
+
+incremental planning.
+
+A `PlanningSession` keeps the planned nights (with their cached time grids and
+moon positions) and the visibility of every planned (night, target) cell.
+Cells are keyed by content hashes of the night (date, site, darkness and
+sampling) and of the target (name, coordinates and altitude limit). Adding or
+removing targets or moving the range of nights therefore only plans the cells
+that are not known yet, and a target that changed its coordinates or altitude
+limit is planned again instead of reusing its stale results. With a
+`ResultCache` the cells are also kept on disk for later sessions.
+"""
+
+import hashlib
+import json
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+import numpy as np
+import astropy.units as u
+
+from iact_observation_planner import allocation as iop_allocation
+from iact_observation_planner import nights as iop_nights
+from iact_observation_planner import profiling
+from iact_observation_planner.targets import TargetCatalogue
+from iact_observation_planner.twilight import site_key
+from iact_observation_planner.visibility import NightSchedule
+
+# part of the night keys, to be increased when the planning results change
+RESULT_VERSION = 1
+
+
+def content_hash(payload):
+    """hex digest identifying a json serializable payload"""
+    text = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def night_key(night):
+    """content hash of everything that determines the planning of a night"""
+    payload = {
+        "version": RESULT_VERSION,
+        "date": f"{night.date:%Y-%m-%d}",
+        "site": site_key(night.site),
+        "darkness": dict(night.darkness),
+        "engine": night.engine,
+        "sampling": night.sampling,
+        "tolerance": night.tolerance,
+        "n_samples": night.n_samples,
+    }
+    if night.grid_key is not None:
+        payload["grid"] = night.grid_key
+    return content_hash(payload)
+
+
+def target_keys(catalogue):
+    """content hashes of the targets of a catalogue that determine their visibility"""
+    ra = catalogue.coords.ra.to_value(u.deg)
+    dec = catalogue.coords.dec.to_value(u.deg)
+    alt = catalogue.alt_limits.to_value(u.deg)
+    return [
+        content_hash([str(name), repr(float(r)), repr(float(d)), repr(float(a))])
+        for name, r, d, a in zip(catalogue.names, ra, dec, alt)
+    ]
+
+
+class PlanningSession:
+    """planning of a set of targets into a range of nights that can be changed
+    incrementally.
+
+    Usage:
+        session = PlanningSession(site, darkness)
+        session.set_range(date, timedelta(days=30))
+        session.set_targets(targets)
+        session.plan()
+        session.add_targets([too_target])
+        session.plan()  # only plans the new target
+
+    Attributes:
+        nights (list): nights of the current range, with filled schedules after
+            `plan`
+        catalogue (TargetCatalogue): current targets
+        n_planned (int): number of (night, target) cells planned so far
+    """
+
+    def __init__(
+        self,
+        site,
+        darkness,
+        engine="astropy",
+        sampling="grid",
+        tolerance=1.0,
+        twilight=None,
+        result_cache=None,
+        season=None,
+    ):
+        self.site = site
+        self.darkness = darkness
+        self.engine = engine
+        self.sampling = sampling
+        self.tolerance = tolerance
+        self.twilight = twilight
+        self.result_cache = result_cache
+        self.season = season
+
+        self.nights = []
+        self.catalogue = None
+        self.keys = []
+        self.n_planned = 0
+
+        # nights and their keys by night-date, also outside of the current range
+        self._nights = {}
+        self._night_keys = {}
+        # (batch, row) of the visible cells, None for invisible cells
+        self._cells = {}
+
+    def __repr__(self):
+        return (
+            f"PlanningSession of {len(self.keys)} targets in {len(self.nights)} nights"
+            + f" ({len(self._cells)} cells known)"
+        )
+
+    @profiling.stage("setup_nights")
+    def set_range(self, date, plan_range):
+        """sets the nights to plan, nights that were set up before are reused
+
+        Args:
+            date (datetime): first night-date
+            plan_range (timedelta): number of nights
+        """
+        self.nights = [
+            self._night(date + timedelta(days=i)) for i in range(plan_range.days)
+        ]
+
+    def _night(self, date):
+        if date not in self._nights:
+            sun_times = None
+            if self.twilight is not None:
+                sun_times = self.twilight.lookup(date)
+            night = iop_nights.Night(
+                date,
+                self.site,
+                self.darkness,
+                engine=self.engine,
+                sun_times=sun_times,
+                sampling=self.sampling,
+                tolerance=self.tolerance,
+                season=self.season,
+            )
+            self._nights[date] = night
+            self._night_keys[date] = night_key(night)
+        return self._nights[date]
+
+    def set_targets(self, targets):
+        """replaces all targets, targets with the same name as an earlier target
+        are skipped"""
+        catalogue = TargetCatalogue.from_targets(targets) if len(targets) else None
+        if catalogue is None:
+            self.catalogue, self.keys = None, []
+            return
+
+        _, first = np.unique(catalogue.names, return_index=True)
+        catalogue = catalogue[np.sort(first)]
+        self.catalogue = catalogue
+        self.keys = target_keys(catalogue)
+
+    def add_targets(self, targets):
+        """adds targets, an existing target with the same name is replaced"""
+        added = TargetCatalogue.from_targets(targets) if len(targets) else None
+        if added is None:
+            return
+        if self.catalogue is None:
+            self.set_targets(added)
+            return
+
+        keep = ~np.isin(self.catalogue.names, added.names)
+        self.set_targets(
+            TargetCatalogue.concatenate([self.catalogue[np.flatnonzero(keep)], added])
+        )
+
+    def remove_targets(self, names):
+        """removes the targets with the given names"""
+        if self.catalogue is None:
+            return
+        keep = np.flatnonzero(~np.isin(self.catalogue.names, list(names)))
+        self.set_targets(self.catalogue[keep] if len(keep) else [])
+
+    @profiling.stage("plan_session")
+    def plan(self, workers=1, executor=None):
+        """plans all (night, target) cells that are not known yet and fills the
+        schedules of the nights of the current range
+
+        Args:
+            workers (int): number of worker processes, see `nights.plan_nights`
+            executor (ProcessPoolExecutor): pool of the workers, started for each
+                call if not given
+
+        Returns:
+            nights (list): the nights of the current range
+        """
+        # nights missing the same targets are planned together
+        groups = {}
+        for night in self.nights:
+            night_id = self._night_keys[night.date]
+            unknown = [key for key in self.keys if (night_id, key) not in self._cells]
+            if unknown and self.result_cache is not None:
+                for key, cell in self.result_cache.get(night_id, unknown).items():
+                    self._cells[(night_id, key)] = cell
+            missing = tuple(
+                row
+                for row, key in enumerate(self.keys)
+                if (night_id, key) not in self._cells
+            )
+            if missing:
+                groups.setdefault(missing, []).append(night)
+
+        for rows, group in groups.items():
+            catalogue = self.catalogue[np.array(rows)]
+            for night in group:
+                night.schedule = NightSchedule()
+            iop_nights.plan_nights(group, catalogue, workers, executor)
+
+            for night in group:
+                night_id = self._night_keys[night.date]
+                for row, name in zip(rows, catalogue.names):
+                    located = None
+                    if name in night.schedule:
+                        located = night.schedule.locate(name)
+                    self._cells[(night_id, self.keys[row])] = located
+                if self.result_cache is not None:
+                    planned = [self.keys[row] for row in rows]
+                    self.result_cache.put(
+                        night_id,
+                        night.test_dates,
+                        {key: self._cells[(night_id, key)] for key in planned},
+                    )
+            self.n_planned += len(rows) * len(group)
+        if groups and self.result_cache is not None:
+            self.result_cache.evict()
+
+        names = [] if self.catalogue is None else self.catalogue.names
+        for night in self.nights:
+            night_id = self._night_keys[night.date]
+            cells = [
+                (str(name), self._cells[(night_id, key)])
+                for name, key in zip(names, self.keys)
+            ]
+            night.schedule = NightSchedule.assemble(
+                (name, *cell) for name, cell in cells if cell is not None
+            )
+
+        return self.nights
+
+    def allocate(self, run_duration, index=None):
+        """allocates runs to the current targets in the planned nights, see
+        `allocation.allocate`"""
+        targets = self.catalogue if self.catalogue is not None else []
+        return iop_allocation.allocate(self.nights, targets, run_duration, index)
+
+    def forget(self):
+        """drops the nights outside of the current range and the cells of targets
+        that are no longer planned"""
+        current = {night.date for night in self.nights}
+        for date in [date for date in self._nights if date not in current]:
+            del self._nights[date]
+            del self._night_keys[date]
+
+        night_ids = set(self._night_keys.values())
+        keys = set(self.keys)
+        self._cells = {
+            cell: located
+            for cell, located in self._cells.items()
+            if cell[0] in night_ids and cell[1] in keys
+        }
+
+
+def plan_sessions(sessions, date, plan_range, workers=1):
+    """sets the range of several sessions (e.g. one per site) and plans them.
+
+    With more than one worker and several sessions, the sessions are planned in
+    parallel, each in its own process, which plans its nights with an equal share
+    of the workers. Nights that are not set up yet (e.g. by an earlier
+    `set_range`) get their sun set and rise in these processes as well, the moon
+    positions are calculated there when the nights are planned.
+
+    Args:
+        sessions (list): planning sessions with their targets set
+        date (datetime): first night-date
+        plan_range (timedelta): number of nights
+        workers (int): number of worker processes
+
+    Returns:
+        sessions (list): the planned sessions, copies of the given sessions if
+            they were planned in other processes
+    """
+    if workers is None or workers <= 1 or len(sessions) == 1:
+        for session in sessions:
+            session.set_range(date, plan_range)
+            session.plan(workers)
+        return sessions
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(sessions))) as executor:
+        session_workers = max(1, workers // len(sessions))
+        return list(
+            executor.map(
+                _plan_session,
+                [(session, date, plan_range, session_workers) for session in sessions],
+            )
+        )
+
+
+def _plan_session(args):
+    """plans a session in a worker process and returns it"""
+    session, date, plan_range, workers = args
+    session.set_range(date, plan_range)
+    session.plan(workers)
+    return session
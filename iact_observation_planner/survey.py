@@ -0,0 +1,296 @@
+"""survey.py
+
+visibility survey of large catalogues over many months.
+
+Instead of planning each night, the survey evaluates the whole catalogue on one
+uniform time grid over the surveyed nights. The sun and moon criteria of the
+darkness definition do not depend on the targets, so they are applied first and
+only the dark samples are kept, together with their local sidereal time and
+the hour angle and declination of the moon. The altitude limits and moon
+distances of the targets are then evaluated in chunks of `TARGET_CHUNK` targets
+and `TIME_CHUNK` samples, so that the memory stays bounded for any catalogue and
+period. Within a chunk the targets are precessed once (as in
+`fast_coordinates`, to the middle of the chunk), which leaves a single cosine
+per target and sample. The visible samples are summed per month of their
+night-date. With more than one worker, the chunks of targets are evaluated in
+parallel processes.
+
+The result is a (target x month) matrix of the hours each target is visible
+in dark time, which can be written as CSV or parquet.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import astropy.units as u
+from astropy.time import Time
+
+from iact_observation_planner import ephemeris
+from iact_observation_planner import fast_coordinates
+from iact_observation_planner import profiling
+from iact_observation_planner import season as iop_season
+from iact_observation_planner.observer_config import parse_darkness
+from iact_observation_planner.targets import TargetCatalogue
+
+# default time step of the survey grid in seconds
+STEP = 300.0
+# number of sun and moon positions calculated at once
+SAMPLE_CHUNK = 2 ** 16
+# number of targets per task
+TARGET_CHUNK = 256
+# number of samples evaluated at once (a few months of dark time in steps of 5
+# minutes, during which the precession changes by a few arcsec)
+TIME_CHUNK = 2 ** 14
+
+MJD_EPOCH = datetime(1858, 11, 17)
+
+# dark samples shared by the chunks of a worker process, see `_init_worker`
+_SAMPLES = None
+
+
+def dark_samples(site, darkness, date, plan_range, step=STEP, season=None):
+    """times at which the sun and moon criteria of a darkness definition are met
+
+    Args:
+        site (EarthLocation): site definition
+        darkness (Darkness or dict): darkness definition
+        date (datetime): first night-date
+        plan_range (timedelta): number of nights
+        step (float): time between the samples in seconds
+        season (SeasonEphemeris): precomputed sun and moon positions, used if they
+            cover the nights on a grid that fits the step
+
+    Returns:
+        samples (dict): of the dark samples "mjd", "months" (month of the
+            night-date, counted from the month of date), "t_cen" (julian
+            centuries since J2000), "sidereal" (local apparent sidereal time)
+            and "moon_hour_angles" and "moon_declinations" (radians)
+    """
+    darkness = parse_darkness(darkness)
+    lon = site.lon.to_value(u.deg)
+
+    # the samples of a night-date start at local noon
+    start = _to_mjd(date) + 0.5 - lon / 360.0
+    n_samples = int(np.ceil(plan_range / timedelta(seconds=step)))
+    mjd = start + np.arange(n_samples) * step / 86400
+
+    season_samples = _season_samples(season, mjd, step)
+    if season_samples is not None:
+        mjd = season.mjd(season_samples)
+        positions = season.data[:, season_samples]
+    else:
+        positions = np.empty((len(iop_season.ROWS), n_samples), dtype=np.float32)
+        for first in range(0, n_samples, SAMPLE_CHUNK):
+            chunk = slice(first, first + SAMPLE_CHUNK)
+            times = Time(mjd[chunk], format="mjd", scale="utc")
+            sun = ephemeris.sun_positions(times, site)
+            moon = ephemeris.moon_positions(times, site)
+            positions[iop_season.SUN_ALT, chunk] = sun["altitudes"]
+            positions[iop_season.MOON_ALT, chunk] = moon["altitudes"]
+            positions[iop_season.MOON_AZ, chunk] = moon["azimuths"]
+            positions[iop_season.MOON_PHASE, chunk] = moon["phases"]
+    sun_alt = positions[iop_season.SUN_ALT]
+    moon_alt = positions[iop_season.MOON_ALT]
+    moon_az = positions[iop_season.MOON_AZ]
+    moon_phase = positions[iop_season.MOON_PHASE]
+
+    # the same criteria as `nights.Night.visibility_mask`
+    dark = (sun_alt < darkness.max_sun_altitude.deg) & (
+        moon_alt < darkness.max_moon_altitude.deg
+    )
+    if darkness.max_moon_phase is not None:
+        dark &= moon_phase < darkness.max_moon_phase.value
+
+    mjd = mjd[dark]
+    night_dates = np.floor(mjd + lon / 360.0 - 0.5 + 1e-9)
+    months = (
+        (np.datetime64(MJD_EPOCH, "D") + night_dates.astype("timedelta64[D]"))
+        .astype("datetime64[M]")
+        .astype(int)
+    )
+
+    times = Time(mjd, format="mjd", scale="utc")
+    t_cen = (times.tt.jd - 2451545.0) / 36525.0
+    nutation_lon, obliquity = ephemeris.nutation_and_obliquity(t_cen)
+    sidereal = ephemeris.apparent_sidereal_time(
+        times.utc.jd, t_cen, nutation_lon, obliquity
+    ) + np.radians(lon)
+
+    # hour angle and declination of the moon from its altitude and azimuth
+    lat = site.lat.to_value(u.rad)
+    alt = np.radians(moon_alt[dark].astype(float))
+    az = np.radians(moon_az[dark].astype(float))
+    moon_dec = np.arcsin(
+        np.clip(
+            np.sin(lat) * np.sin(alt) + np.cos(lat) * np.cos(alt) * np.cos(az), -1.0, 1.0
+        )
+    )
+    moon_hour_angle = np.arctan2(
+        -np.sin(az) * np.cos(alt),
+        np.cos(lat) * np.sin(alt) - np.sin(lat) * np.cos(alt) * np.cos(az),
+    )
+    return {
+        "mjd": mjd,
+        "months": months - np.datetime64(date, "M").astype(int),
+        "t_cen": t_cen,
+        "sidereal": sidereal,
+        "moon_hour_angles": moon_hour_angle,
+        "moon_declinations": moon_dec,
+    }
+
+
+@profiling.stage("survey")
+def survey_hours(
+    catalogue, site, darkness, date, plan_range, step=STEP, workers=1, season=None
+):
+    """hours each target is visible in dark time, per month
+
+    Args:
+        catalogue (TargetCatalogue or list): targets to survey
+        site (EarthLocation): site definition
+        darkness (Darkness or dict): darkness definition
+        date (datetime): first night-date
+        plan_range (timedelta): number of nights
+        step (float): time between the samples in seconds
+        workers (int): number of worker processes
+        season (SeasonEphemeris): precomputed sun and moon positions of the site
+
+    Returns:
+        hours (DataFrame): visible hours with the target names as index and the
+            months of the night-dates ("YYYY-MM") as columns
+    """
+    if not isinstance(catalogue, TargetCatalogue):
+        catalogue = TargetCatalogue.from_targets(catalogue)
+    darkness = parse_darkness(darkness)
+    samples = dark_samples(site, darkness, date, plan_range, step, season)
+    samples["latitude"] = site.lat.to_value(u.rad)
+    samples["min_moon_distance"] = (
+        None if darkness.min_moon_distance is None else darkness.min_moon_distance.deg
+    )
+    samples["step"] = step
+
+    last = date + plan_range - timedelta(days=1)
+    months = pd.period_range(f"{date:%Y-%m}", f"{last:%Y-%m}", freq="M")
+    samples["n_months"] = len(months)
+
+    ra = catalogue.coords.ra.to_value(u.deg)
+    dec = catalogue.coords.dec.to_value(u.deg)
+    alt_limits = catalogue.alt_limits.to_value(u.deg)
+    chunks = [
+        (ra[first:last], dec[first:last], alt_limits[first:last])
+        for first, last in _chunks(len(catalogue), TARGET_CHUNK)
+    ]
+
+    if workers is None or workers <= 1 or len(chunks) == 1:
+        _init_worker(samples)
+        try:
+            results = [_survey_chunk(chunk) for chunk in chunks]
+        finally:
+            _init_worker(None)
+    else:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(samples,)
+        ) as executor:
+            results = list(executor.map(_survey_chunk, chunks))
+    profiling.count("target_positions", len(catalogue) * len(samples["mjd"]))
+
+    hours = np.concatenate(results) if results else np.zeros((0, len(months)))
+    return pd.DataFrame(
+        hours,
+        index=pd.Index(catalogue.names, name="target"),
+        columns=[str(month) for month in months],
+    )
+
+
+def check_output(path):
+    """checks that survey results can be written to path before surveying
+
+    Returns:
+        format (str): "csv" or "parquet"
+    """
+    if path.lower().endswith(".csv"):
+        return "csv"
+    if path.lower().endswith(".parquet"):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError as error:
+            raise ImportError("The parquet export needs pyarrow to be installed") from error
+        return "parquet"
+    raise ValueError(f"Unsupported survey format: {path} (parquet or csv)")
+
+
+def write_survey(hours, path):
+    """writes survey results to a .csv or .parquet file, one row per target"""
+    output_format = check_output(path)
+    frame = hours.reset_index()
+    if output_format == "csv":
+        frame.to_csv(path, index=False, float_format="%.4f")
+    else:
+        frame.to_parquet(path, index=False)
+    return len(frame)
+
+
+def _init_worker(samples):
+    global _SAMPLES
+    _SAMPLES = samples
+
+
+def _survey_chunk(chunk):
+    """visible hours per month of a chunk of targets, evaluated in chunks of
+    times"""
+    ra, dec, alt_limits = chunk
+    samples = _SAMPLES
+    step_hours = samples["step"] / 3600
+    hours = np.zeros((len(ra), samples["n_months"]))
+
+    sin_lat, cos_lat = np.sin(samples["latitude"]), np.cos(samples["latitude"])
+    min_sin_alt = np.sin(np.radians(alt_limits))[:, np.newaxis]
+    if samples["min_moon_distance"] is not None:
+        max_cos_separation = np.cos(np.radians(samples["min_moon_distance"]))
+
+    for first, last in _chunks(len(samples["mjd"]), TIME_CHUNK):
+        window = slice(first, last)
+        ra_date, dec_date = fast_coordinates.precess(
+            np.radians(ra), np.radians(dec), samples["t_cen"][window].mean()
+        )
+        sin_dec = np.sin(dec_date)[:, np.newaxis]
+        cos_dec = np.cos(dec_date)[:, np.newaxis]
+        hour_angle = samples["sidereal"][np.newaxis, window] - ra_date[:, np.newaxis]
+
+        visible = sin_lat * sin_dec + cos_lat * cos_dec * np.cos(hour_angle) > min_sin_alt
+        if samples["min_moon_distance"] is not None:
+            moon_dec = samples["moon_declinations"][window]
+            cos_separation = sin_dec * np.sin(moon_dec) + cos_dec * np.cos(
+                moon_dec
+            ) * np.cos(hour_angle - samples["moon_hour_angles"][window])
+            visible &= cos_separation < max_cos_separation
+
+        # the samples are sorted in time, so each month is a contiguous segment
+        months = samples["months"][window]
+        starts = np.flatnonzero(np.r_[True, months[1:] != months[:-1]])
+        counts = np.add.reduceat(visible, starts, axis=1, dtype=np.int64)
+        hours[:, months[starts]] += counts * step_hours
+    return hours
+
+
+def _season_samples(season, mjd, step):
+    """samples of a season on the survey grid (at most one season step after the
+    survey times), None if the season does not cover them"""
+    if season is None or not len(mjd) or step % season.step:
+        return None
+    first = (mjd[0] - season.start_mjd) * 86400 / season.step
+    stride = int(step // season.step)
+    samples = int(np.ceil(first)) + stride * np.arange(len(mjd))
+    if samples[0] < 0 or samples[-1] >= len(season):
+        return None
+    return samples
+
+
+def _chunks(n_items, size):
+    return [(first, min(first + size, n_items)) for first in range(0, n_items, size)]
+
+
+def _to_mjd(date):
+    return (date - MJD_EPOCH) / timedelta(days=1)
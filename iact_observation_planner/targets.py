@@ -1,12 +1,229 @@
 # target.py
 
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import astropy.units as u
 from astropy import coordinates as coo
+from astropy.table import Table
 from astropy.units import Quantity
 
+from iact_observation_planner import profiling
+
+DEFAULT_ALT_LIMIT = 45
+DEFAULT_HOURS = 2
+
+# concurrent name resolution: lookups at the same time, seconds per attempt,
+# retries of failed lookups and the delay before the first retry in seconds
+RESOLVE_CONCURRENCY = 8
+RESOLVE_TIMEOUT = 10.0
+RESOLVE_RETRIES = 2
+RETRY_DELAY = 0.5
+
+
+class TargetCache:
+    """persistent cache of target names resolved by Simbad/Sesame.
+
+    The cache is a JSON file that is read in bulk on construction and written
+    back with `save`. Entries older than `ttl` are resolved again, unless the
+    cache is `offline`, in which case the network is never used and stale
+    entries are still accepted.
+    """
+
+    def __init__(self, path=None, ttl=timedelta(days=30), offline=False, resolver=None):
+        self.path = path
+        self.ttl = ttl
+        self.offline = offline
+        self.resolver = resolver if resolver is not None else coo.SkyCoord.from_name
+        self.entries = {}
+        self.modified = False
+        # names resolved during this session are never resolved twice
+        self.session = set()
+
+        if self.path and os.path.isfile(self.path):
+            self.load()
+
+    def load(self):
+        """loads all entries from the cache file"""
+        with open(self.path) as cache_file:
+            self.entries = json.load(cache_file)
+
+    def save(self):
+        """writes all entries to the cache file"""
+        if not self.path or not self.modified:
+            return
+
+        # each writer has its own temporary file, the last complete file wins
+        handle, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.path)), suffix=".tmp"
+        )
+        try:
+            with os.fdopen(handle, "w") as cache_file:
+                json.dump(self.entries, cache_file, indent=1)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self.modified = False
+
+    def is_fresh(self, name):
+        """whether a cached entry exists and is younger than the ttl"""
+        entry = self.entries.get(name)
+        if entry is None:
+            return False
+        if self.ttl is None:
+            return True
+        resolved = datetime.fromisoformat(entry["resolved"])
+        return datetime.utcnow() - resolved < self.ttl
+
+    def is_known(self, name):
+        """whether a name can be taken from the cache without resolving it"""
+        return name in self.entries and (
+            self.offline or name in self.session or self.is_fresh(name)
+        )
+
+    def resolve(self, name):
+        """returns the coordinates of a target name, from the cache if possible"""
+        if self.is_known(name):
+            entry = self.entries[name]
+            return coo.SkyCoord(entry["ra"], entry["dec"], unit="deg", frame=coo.ICRS)
+
+        if self.offline:
+            raise coo.name_resolve.NameResolveError(
+                f"{name} is not in the target cache and resolving is disabled (offline)."
+            )
+
+        return self.store(name, self.resolver(name))
+
+    def store(self, name, position):
+        """adds a resolved position to the cache"""
+        position = position.icrs
+        self.entries[name] = {
+            "ra": position.ra.deg,
+            "dec": position.dec.deg,
+            "resolved": datetime.utcnow().isoformat(),
+        }
+        self.session.add(name)
+        self.modified = True
+        return position
 
-def resolve_target_coordinates(name):
+    def warm(self, names):
+        """resolves all names that are missing or stale and saves the cache once"""
+        for name in names:
+            self.resolve(name)
+        self.save()
+
+    async def warm_async(
+        self,
+        names,
+        concurrency=RESOLVE_CONCURRENCY,
+        timeout=RESOLVE_TIMEOUT,
+        retries=RESOLVE_RETRIES,
+    ):
+        """resolves all names that are missing or stale concurrently and saves the
+        cache once.
+
+        The (blocking) resolver runs in up to `concurrency` threads at the same
+        time. An attempt that takes longer than `timeout` seconds (counted from
+        its start) is abandoned and frees its slot, failed attempts are retried up
+        to `retries` times with a doubling delay. If names could not be resolved,
+        the first error is raised after the resolved names have been saved.
+        """
+        missing = [name for name in dict.fromkeys(names) if not self.is_known(name)]
+        if self.offline or not missing:
+            self.warm(missing)
+            return
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def lookup(name):
+            for attempt in range(retries + 1):
+                try:
+                    async with semaphore:
+                        return await asyncio.wait_for(
+                            _run_in_daemon_thread(self.resolver, name), timeout
+                        )
+                except asyncio.TimeoutError as error:
+                    if attempt == retries:
+                        raise TimeoutError(
+                            f"Resolving {name} timed out after {timeout} s"
+                        ) from error
+                except Exception:
+                    if attempt == retries:
+                        raise
+                await asyncio.sleep(RETRY_DELAY * 2 ** attempt)
+
+        results = await asyncio.gather(
+            *(lookup(name) for name in missing), return_exceptions=True
+        )
+
+        errors = []
+        for name, result in zip(missing, results):
+            if isinstance(result, Exception):
+                errors.append(result)
+            else:
+                self.store(name, result)
+        self.save()
+        if errors:
+            raise errors[0]
+
+    def invalidate(self, name=None):
+        """removes a single entry or, without a name, all entries"""
+        if name is None:
+            self.entries = {}
+            self.session = set()
+        else:
+            self.entries.pop(name, None)
+            self.session.discard(name)
+        self.modified = True
+
+
+def _run_in_daemon_thread(func, *args):
+    """runs a blocking function in a new daemon thread and returns a future of its
+    result. Unlike the threads of an executor, an abandoned (hung) call neither
+    blocks other calls nor the exit of the interpreter."""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def set_result(result, error):
+        if future.done():
+            # abandoned after a timeout
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def run():
+        result, error = None, None
+        try:
+            result = func(*args)
+        except Exception as exception:
+            error = exception
+        try:
+            loop.call_soon_threadsafe(set_result, result, error)
+        except RuntimeError:
+            # the event loop was closed in the meantime
+            pass
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+def resolve_target_coordinates(name, cache=None):
     """takes a list of target name strings and returns reformatted strings
-    and coordinates (names, coords)
+    and coordinates (names, coords). Names without rd/ or lb/ prefix are
+    resolved through the `TargetCache` if one is given.
     """
     position = None
     tag = name
@@ -22,6 +239,8 @@ def resolve_target_coordinates(name):
             # try to extract a name tag if it is there
             position_str, tag = position_str.split("/")
         position = coo.SkyCoord(position_str, frame=coo.Galactic)
+    elif cache is not None:
+        position = cache.resolve(name)
     else:
         position = coo.SkyCoord.from_name(name)
 
@@ -43,12 +262,12 @@ class Target:
         self.coords = coord
 
         # set altitude and hours to default values
-        if not alt:
-            alt = "45"
-        if not hours:
-            hours = 2
+        if alt is None or alt == "":
+            alt = DEFAULT_ALT_LIMIT
+        if hours is None or hours == "":
+            hours = DEFAULT_HOURS
 
-        self.alt_limit = Quantity(alt + " deg")
+        self.alt_limit = Quantity(alt, u.deg)
         self.hours = hours
 
     def __repr__(self):
@@ -62,12 +281,54 @@ class Target:
         return out
 
 
-def resolve_target_list(targets_list):
-    """resolves the target argument list given by the main tools usage into workable targets
-    with name, coordinates, ..."""
-    targets = []
+class LocalResolver:
+    """stand-in for `SkyCoord.from_name` that resolves names without network
+    access, e.g. for tests and benchmarks. Names without a given position get a
+    fixed position derived from the name. A latency and a number of failing first
+    attempts per name can be simulated.
 
-    # Fill all targets from the commandline arguments into a dict
+    Attributes:
+        calls (list): all names that were looked up, in order
+        max_in_flight (int): largest number of lookups that ran at the same time
+    """
+
+    def __init__(self, positions=None, latency=0.0, failures=0):
+        self.positions = positions or {}
+        self.latency = latency
+        self.failures = failures
+        self.calls = []
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, name):
+        with self._lock:
+            self.calls.append(name)
+            attempt = self.calls.count(name)
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+
+        try:
+            time.sleep(self.latency)
+            if attempt <= self.failures:
+                raise coo.name_resolve.NameResolveError(
+                    f"Unable to retrieve coordinates for name '{name}' (attempt {attempt})"
+                )
+            if name in self.positions:
+                ra, dec = self.positions[name]
+            else:
+                checksum = zlib.crc32(name.encode())
+                ra = checksum % 36000 / 100.0
+                dec = (checksum // 36000) % 18000 / 100.0 - 90.0
+            return coo.SkyCoord(ra, dec, unit="deg", frame=coo.ICRS)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+
+def parse_target_list(targets_list):
+    """splits the target argument strings "<name>;<alt_limit>;<hours>" into
+    dicts by name"""
     targets_dict = {}
     for target in targets_list:
         target_args = target.split(";")
@@ -85,10 +346,53 @@ def resolve_target_list(targets_list):
 
         targets_dict[name] = {"name": name, "alt_limit": alt_limit, "hours": hours}
 
+    return targets_dict
+
+
+@profiling.stage("resolve_target_list")
+def resolve_target_list(targets_list, cache=None):
+    """resolves the target argument list given by the main tools usage into workable targets
+    with name, coordinates, ... Names are looked up in the `TargetCache` if one is given."""
+    # Fill all targets from the commandline arguments into a dict
+    targets_dict = parse_target_list(targets_list)
+
+    if cache is not None:
+        cache.warm(_names_to_resolve(targets_dict))
+
+    return _build_targets(targets_dict, cache)
+
+
+async def resolve_target_list_async(
+    targets_list,
+    cache=None,
+    concurrency=RESOLVE_CONCURRENCY,
+    timeout=RESOLVE_TIMEOUT,
+    retries=RESOLVE_RETRIES,
+):
+    """like `resolve_target_list`, but all names are resolved concurrently, see
+    `TargetCache.warm_async`. Without a cache, the names are resolved through a
+    cache that only lives in memory."""
+    targets_dict = parse_target_list(targets_list)
+
+    if cache is None:
+        cache = TargetCache()
+    await cache.warm_async(
+        _names_to_resolve(targets_dict), concurrency, timeout, retries
+    )
+
+    return _build_targets(targets_dict, cache)
+
+
+def _names_to_resolve(targets_dict):
+    return [name for name in targets_dict if not name.startswith(("rd/", "lb/"))]
+
+
+def _build_targets(targets_dict, cache):
     # fill a list of Target objects from the dict and return it
+    targets = []
     for name, target_dict in targets_dict.items():
         name = target_dict["name"]
-        coords = resolve_target_coordinates(target_dict["name"])
+        coords = resolve_target_coordinates(target_dict["name"], cache)
         targets.append(
             Target(
                 target_dict["name"],
@@ -99,3 +403,137 @@ def resolve_target_list(targets_list):
         )
 
     return targets
+
+
+class TargetCatalogue:
+    """array-backed collection of targets. All positions are held in a single
+    ICRS SkyCoord and the altitude limits and hours in arrays, so that large
+    catalogues never need per-target coordinate objects. Indexing a single row
+    returns a `Target`, slicing (or indexing with an array) returns a
+    `TargetCatalogue`."""
+
+    def __init__(self, names, coords, alt_limits, hours):
+        self.names = np.asarray(names, dtype=str)
+        self.coords = coords
+        self.alt_limits = Quantity(alt_limits, u.deg)
+        self.hours = np.asarray(hours, dtype=float)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        if isinstance(index, (slice, list, np.ndarray)):
+            return TargetCatalogue(
+                self.names[index],
+                self.coords[index],
+                self.alt_limits[index],
+                self.hours[index],
+            )
+        return Target(
+            str(self.names[index]),
+            self.coords[index],
+            self.alt_limits[index],
+            self.hours[index],
+        )
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __repr__(self):
+        return f"TargetCatalogue with {len(self)} targets"
+
+    @classmethod
+    def from_targets(cls, targets):
+        """builds a catalogue from a list of `Target` objects"""
+        if isinstance(targets, cls):
+            return targets
+
+        return cls(
+            [target.name for target in targets],
+            coo.SkyCoord(
+                ra=Quantity([target.coords.icrs.ra for target in targets], u.deg),
+                dec=Quantity([target.coords.icrs.dec for target in targets], u.deg),
+                frame=coo.ICRS,
+            ),
+            Quantity([target.alt_limit for target in targets], u.deg),
+            [float(target.hours) for target in targets],
+        )
+
+    @classmethod
+    def concatenate(cls, catalogues):
+        """joins several catalogues into one. The schedules and allocations are
+        keyed by name, so the names have to be unique."""
+        catalogues = [catalogue for catalogue in catalogues if len(catalogue)]
+        names = [np.zeros(0, dtype=str)] + [catalogue.names for catalogue in catalogues]
+        names, counts = np.unique(np.concatenate(names), return_counts=True)
+        if np.any(counts > 1):
+            raise ValueError(
+                f"Targets given more than once: {', '.join(names[counts > 1])}"
+            )
+        if not catalogues:
+            return cls.from_targets([])
+        if len(catalogues) == 1:
+            return catalogues[0]
+
+        return cls(
+            np.concatenate([catalogue.names for catalogue in catalogues]),
+            coo.SkyCoord(
+                ra=np.concatenate([catalogue.coords.ra.deg for catalogue in catalogues]),
+                dec=np.concatenate([catalogue.coords.dec.deg for catalogue in catalogues]),
+                unit=u.deg,
+                frame=coo.ICRS,
+            ),
+            np.concatenate([catalogue.alt_limits for catalogue in catalogues]),
+            np.concatenate([catalogue.hours for catalogue in catalogues]),
+        )
+
+
+def read_target_file(path):
+    """reads a target catalogue from a CSV, JSON or ECSV file into a `TargetCatalogue`.
+
+    The file needs the columns name, ra and dec (ICRS, in degrees unless the ECSV
+    columns carry units) and can optionally give alt_limit (in degrees) and hours
+    per target. Missing values are set to the defaults of the `Target` class.
+
+    Args:
+        path (str): path to the catalogue file
+
+    Returns:
+        catalogue (TargetCatalogue): the targets of the file
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        columns = pd.read_csv(path)
+    elif extension == ".json":
+        columns = pd.read_json(path, orient="records")
+    elif extension == ".ecsv":
+        columns = Table.read(path, format="ascii.ecsv")
+    else:
+        raise ValueError(f"Unsupported target file format: {path} (csv, json or ecsv)")
+
+    column_names = {name.lower(): name for name in columns.keys()}
+    for required in ["name", "ra", "dec"]:
+        if required not in column_names:
+            raise ValueError(f"Target file {path} is missing the column '{required}'")
+
+    def column(name, default, unit):
+        if name not in column_names:
+            return np.full(len(columns), default, dtype=float)
+        values = columns[column_names[name]]
+        if getattr(values, "unit", None) is not None:
+            values = Quantity(values).to_value(unit)
+        values = np.ma.filled(np.ma.asarray(values).astype(float), np.nan)
+        return np.where(np.isfinite(values), values, default)
+
+    coords = coo.SkyCoord(
+        ra=column("ra", np.nan, u.deg) * u.deg,
+        dec=column("dec", np.nan, u.deg) * u.deg,
+        frame=coo.ICRS,
+    )
+    return TargetCatalogue(
+        np.asarray(columns[column_names["name"]], dtype=str),
+        coords,
+        column("alt_limit", DEFAULT_ALT_LIMIT, u.deg),
+        column("hours", DEFAULT_HOURS, u.hour),
+    )
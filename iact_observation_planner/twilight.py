@@ -0,0 +1,181 @@
+"""twilight.py
+
+precomputed tables of sun set and rise times. The twilight times only depend on
+the site, the sun horizon of the darkness definition and the date, so they can
+be solved once for a range of years and looked up afterwards.
+"""
+
+import os
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import astropy.units as u
+
+from iact_observation_planner.nights import find_sun_rise_and_set
+from iact_observation_planner.observer_config import parse_darkness
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class TwilightTable:
+    """sun set and rise times of consecutive nights for one site and sun horizon.
+    The times are stored as integer microseconds since 1970 so that the lookup
+    returns exactly the datetimes solved by `find_sun_rise_and_set`."""
+
+    def __init__(self, site_key, sun_horizon, start, sun_sets, sun_rises):
+        self.site_key = site_key
+        self.sun_horizon = sun_horizon
+        self.start = start
+        self.sun_sets = np.asarray(sun_sets, dtype=np.int64)
+        self.sun_rises = np.asarray(sun_rises, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.sun_sets)
+
+    def __repr__(self):
+        end = self.start + timedelta(days=len(self) - 1)
+        return (
+            f"TwilightTable {self.site_key} (sun < {self.sun_horizon} deg): "
+            + f"{self.start:%Y-%m-%d} to {end:%Y-%m-%d}"
+        )
+
+    @classmethod
+    def generate(cls, site, darkness, start, end):
+        """solves the twilight times for all nights from start to end (exclusive)
+
+        Args:
+            site (EarthLocation): site definition
+            darkness (dict): darkness definition
+            start (datetime): first night-date
+            end (datetime): night-date after the last night
+
+        Returns:
+            table (TwilightTable): the solved twilight table
+        """
+        start = datetime(start.year, start.month, start.day)
+        n_nights = (end - start).days
+
+        sun_sets = np.zeros(n_nights, dtype=np.int64)
+        sun_rises = np.zeros(n_nights, dtype=np.int64)
+        for i in range(n_nights):
+            sun_set, sun_rise = find_sun_rise_and_set(
+                start + timedelta(days=i), site, darkness
+            )
+            sun_sets[i] = _to_microseconds(sun_set)
+            sun_rises[i] = _to_microseconds(sun_rise)
+
+        return cls(site_key(site), sun_horizon(darkness), start, sun_sets, sun_rises)
+
+    @classmethod
+    def load(cls, path):
+        """loads a table written with `save`"""
+        with np.load(path) as data:
+            return cls(
+                str(data["site_key"]),
+                float(data["sun_horizon"]),
+                EPOCH + timedelta(days=int(data["start"])),
+                data["sun_sets"],
+                data["sun_rises"],
+            )
+
+    def save(self, path):
+        """writes the table to a compressed .npz file"""
+        np.savez_compressed(
+            path,
+            site_key=self.site_key,
+            sun_horizon=self.sun_horizon,
+            start=(self.start - EPOCH).days,
+            sun_sets=self.sun_sets,
+            sun_rises=self.sun_rises,
+        )
+
+    def matches(self, site, darkness):
+        """whether the table was generated for this site and sun horizon"""
+        return self.site_key == site_key(site) and np.isclose(
+            self.sun_horizon, sun_horizon(darkness)
+        )
+
+    def lookup(self, date):
+        """returns (sun_set, sun_rise) for a night-date or None if the date is not
+        covered by the table (or is not at midnight)"""
+        if date != datetime(date.year, date.month, date.day):
+            return None
+
+        index = (date - self.start).days
+        if index < 0 or index >= len(self):
+            return None
+
+        return (
+            _from_microseconds(self.sun_sets[index]),
+            _from_microseconds(self.sun_rises[index]),
+        )
+
+
+def site_key(site):
+    """identifies a site by its coordinates"""
+    return "{:.4f}_{:.4f}_{:.0f}".format(
+        site.lon.to_value(u.deg), site.lat.to_value(u.deg), site.height.to_value(u.m)
+    )
+
+
+def sun_horizon(darkness):
+    """sun horizon of a darkness definition in degrees"""
+    return parse_darkness(darkness).max_sun_altitude.to_value(u.deg)
+
+
+def table_path(directory, site, darkness):
+    """path of the twilight table for a site and darkness in a directory"""
+    name = "twilight_{}_{:+.2f}.npz".format(site_key(site), sun_horizon(darkness))
+    return os.path.join(directory, name)
+
+
+def load_table(directory, site, darkness):
+    """loads the twilight table for a site and darkness from a directory,
+    returns None if there is none"""
+    if directory is None:
+        return None
+
+    path = table_path(directory, site, darkness)
+    if not os.path.isfile(path):
+        return None
+
+    table = TwilightTable.load(path)
+    if not table.matches(site, darkness):
+        return None
+    return table
+
+
+def generate_tables(directory, sites, darknesses, first_year, last_year):
+    """generates and stores the twilight tables for all combinations of sites and
+    (distinct) sun horizons for the years first_year to last_year
+
+    Returns:
+        paths (list): paths of the written tables
+    """
+    start = datetime(first_year, 1, 1)
+    end = datetime(last_year + 1, 1, 1)
+
+    paths = []
+    for site in sites:
+        horizons = set()
+        for darkness in darknesses:
+            if sun_horizon(darkness) in horizons:
+                continue
+            horizons.add(sun_horizon(darkness))
+
+            table = TwilightTable.generate(site, darkness, start, end)
+            path = table_path(directory, site, darkness)
+            table.save(path)
+            paths.append(path)
+
+    return paths
+
+
+def _to_microseconds(date):
+    delta = date - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _from_microseconds(value):
+    return EPOCH + timedelta(microseconds=int(value))
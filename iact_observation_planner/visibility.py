@@ -0,0 +1,472 @@
+"""visibility.py
+
+storage of and index over the visibility windows of planned nights.
+
+The schedule of a night is a `NightSchedule`: the indices of the valid samples
+in the night's time grid and the altitudes (degrees, float32) of all targets
+planned in one batch are stored in two contiguous arrays. The `ScheduleEntry`
+of a target is a view into them, created on access, and the datetimes are
+only created when they are accessed, e.g. for display.
+
+All contiguous visibility intervals of all targets in all nights are kept in
+arrays sorted by their start, together with the running maximum of their ends.
+A query for time t only has to look at the intervals that start before t
+(binary search on the starts) and that are not already ended before the
+earliest interval that could still contain t (binary search on the running
+maximum of the ends), which makes point, overlap and containment queries
+O(log n) plus the size of the candidate range. The union of all intervals is
+precomputed for the lookup of free gaps, during which no target is visible.
+"""
+
+from collections.abc import Mapping, MutableMapping
+from datetime import datetime
+
+import numpy as np
+import astropy.units as u
+from matplotlib.dates import date2num, num2date
+
+# matplotlib date number of MJD 0
+MJD_ZERO = date2num(datetime(1858, 11, 17))
+
+
+class ScheduleEntry(Mapping):
+    """visibility of a target in a night.
+
+    Behaves like the dict with the keys "start", "end", "times", "altitudes" and
+    "dates" of earlier versions, the datetimes are converted on access.
+
+    Attributes:
+        grid (ndarray): sample times of the night (matplotlib date numbers)
+        samples (ndarray): indices of the valid samples in the grid
+        altitudes (ndarray): altitudes at the valid samples in degrees
+        start_date, end_date (float): edges of the visibility window (matplotlib
+            date numbers), refined beyond the samples with adaptive sampling
+    """
+
+    __slots__ = ("grid", "samples", "altitudes", "start_date", "end_date")
+    KEYS = ("start", "end", "altitudes", "times", "dates")
+
+    def __init__(self, grid, samples, altitudes, start_date=None, end_date=None):
+        self.grid = grid
+        self.samples = samples
+        self.altitudes = altitudes
+        self.start_date = float(
+            grid[samples[0]] if start_date is None else start_date
+        )
+        self.end_date = float(grid[samples[-1]] if end_date is None else end_date)
+
+    def __getitem__(self, key):
+        if key == "start":
+            return num2date(self.start_date)
+        if key == "end":
+            return num2date(self.end_date)
+        if key == "altitudes":
+            return u.Quantity(self.altitudes, u.deg, copy=False)
+        if key == "times":
+            return num2date(self.dates)
+        if key == "dates":
+            return self.dates
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __repr__(self):
+        return "ScheduleEntry({:%Y-%m-%d %H:%M:%S} to {:%H:%M:%S}, {} samples)".format(
+            self["start"], self["end"], len(self.samples)
+        )
+
+    @classmethod
+    def from_dict(cls, entry):
+        """entry from a dict of earlier versions, with the "times" (datetimes)
+        and "altitudes" of the valid samples and optionally the "start" and "end"
+        of the window"""
+        dates = np.atleast_1d(date2num(entry["times"])).astype(float)
+        if not len(dates):
+            raise ValueError("A schedule entry needs at least one valid sample")
+        altitudes = u.Quantity(entry["altitudes"], u.deg).to_value(u.deg)
+        start, end = entry.get("start"), entry.get("end")
+        return cls(
+            dates,
+            np.arange(len(dates)),
+            np.atleast_1d(altitudes).astype(np.float32),
+            None if start is None else date2num(start),
+            None if end is None else date2num(end),
+        )
+
+    @property
+    def dates(self):
+        """valid sample times (matplotlib date numbers)"""
+        return self.grid[self.samples]
+
+    @property
+    def mjd(self):
+        """valid sample times as MJD"""
+        return self.dates - MJD_ZERO
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+
+class NightSchedule(MutableMapping):
+    """visibility of all targets planned into a night, by target name.
+
+    The targets of each planned batch share contiguous arrays, the
+    `ScheduleEntry` of a target is only created when it is accessed. Entries can
+    also be set as dicts of earlier versions (see `ScheduleEntry.from_dict`).
+    When deleted entries leave at most half of the rows of a batch in use, the
+    batch is copied without them, so that their samples are freed.
+    """
+
+    def __init__(self):
+        # (grid, samples, altitudes, offsets, start_dates, end_dates) per batch
+        self._batches = []
+        # (batch, row) by target name
+        self._rows = {}
+
+    def __getitem__(self, name):
+        batch, row = self._rows[name]
+        grid, samples, altitudes, offsets, start_dates, end_dates = self._batches[batch]
+        window = slice(offsets[row], offsets[row + 1])
+        return ScheduleEntry(
+            grid, samples[window], altitudes[window], start_dates[row], end_dates[row]
+        )
+
+    def __setitem__(self, name, entry):
+        if not isinstance(entry, ScheduleEntry):
+            entry = ScheduleEntry.from_dict(entry)
+        replaced = self._rows.get(name)
+        self._rows[name] = (len(self._batches), 0)
+        self._batches.append(
+            (
+                entry.grid,
+                entry.samples,
+                entry.altitudes,
+                np.array([0, len(entry.samples)]),
+                np.array([entry.start_date]),
+                np.array([entry.end_date]),
+            )
+        )
+        if replaced is not None:
+            self._compact(replaced[0])
+
+    def __delitem__(self, name):
+        batch, _ = self._rows.pop(name)
+        self._compact(batch)
+
+    def _compact(self, batch):
+        """removes the rows of a batch that are not in the schedule anymore, once
+        at most half of its rows are used, and the batch without any used row"""
+        names = [name for name, (index, _) in self._rows.items() if index == batch]
+        grid, samples, altitudes, offsets, start_dates, end_dates = self._batches[batch]
+        if 2 * len(names) > len(start_dates):
+            return
+
+        if not names:
+            del self._batches[batch]
+            self._rows = {
+                name: (index - (index > batch), row)
+                for name, (index, row) in self._rows.items()
+            }
+            return
+
+        # the batch may be shared with other schedules, it is copied
+        rows = np.array([self._rows[name][1] for name in names], dtype=int)
+        counts = offsets[rows + 1] - offsets[rows]
+        new_offsets = np.concatenate([[0], np.cumsum(counts)])
+        taken = np.arange(new_offsets[-1]) + np.repeat(
+            offsets[rows] - new_offsets[:-1], counts
+        )
+        self._batches[batch] = (
+            grid,
+            samples[taken],
+            altitudes[taken],
+            new_offsets,
+            start_dates[rows],
+            end_dates[rows],
+        )
+        for row, name in enumerate(names):
+            self._rows[name] = (batch, row)
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __repr__(self):
+        return f"NightSchedule of {len(self)} targets"
+
+    def add(self, names, dates, mask, altitudes, edges=None):
+        """adds the visibility of a batch of targets
+
+        Args:
+            names (array): names of the targets, shape (n,)
+            dates (ndarray): sample times (matplotlib date numbers), shape (m,)
+            mask (ndarray): whether the targets are visible, shape (n, m)
+            altitudes (ndarray): altitudes in degrees, shape (n, m)
+            edges (dict): refined (start, end) date numbers by row
+        """
+        counts = np.count_nonzero(mask, axis=1)
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        samples = np.nonzero(mask)[1].astype(np.min_scalar_type(len(dates)))
+        valid_altitudes = np.asarray(altitudes, dtype=np.float32)[mask]
+
+        visible = counts > 0
+        start_dates = np.full(len(counts), np.nan)
+        end_dates = np.full(len(counts), np.nan)
+        start_dates[visible] = dates[samples[offsets[:-1][visible]]]
+        end_dates[visible] = dates[samples[offsets[1:][visible] - 1]]
+        for row, (start, end) in (edges or {}).items():
+            start_dates[row], end_dates[row] = start, end
+
+        batch = len(self._batches)
+        self._batches.append(
+            (dates, samples, valid_altitudes, offsets, start_dates, end_dates)
+        )
+        for row in np.flatnonzero(visible):
+            self._rows[str(names[row])] = (batch, row)
+
+    def locate(self, name):
+        """the (batch, row) of a target, which can be passed to `assemble`"""
+        batch, row = self._rows[name]
+        return self._batches[batch], row
+
+    @classmethod
+    def assemble(cls, located):
+        """builds a schedule from (name, batch, row) of other schedules, sharing
+        their arrays"""
+        schedule = cls()
+        batches = {}
+        for name, batch, row in located:
+            if id(batch) not in batches:
+                batches[id(batch)] = len(schedule._batches)
+                schedule._batches.append(batch)
+            schedule._rows[name] = (batches[id(batch)], row)
+        return schedule
+
+    def merge(self, other):
+        """adds all entries of another schedule, e.g. planned in another process"""
+        first_batch = len(self._batches)
+        self._batches.extend(other._batches)
+        for name, (batch, row) in other._rows.items():
+            self._rows[name] = (first_batch + batch, row)
+
+    def windows(self):
+        """visibility windows and culminations of all entries, in the order of the
+        schedule. The culminations are found with one argmax per batch.
+
+        Returns:
+            windows (dict): arrays of the "names", "starts", "ends",
+                "culminations" (matplotlib date numbers) and "max_altitudes"
+                (degrees)
+        """
+        batch_ids = np.array([batch for batch, _ in self._rows.values()], dtype=int)
+        rows = np.array([row for _, row in self._rows.values()], dtype=int)
+        windows = {
+            "names": np.array(list(self._rows), dtype=object),
+            "starts": np.full(len(rows), np.nan),
+            "ends": np.full(len(rows), np.nan),
+            "culminations": np.full(len(rows), np.nan),
+            "max_altitudes": np.full(len(rows), np.nan),
+        }
+        for i, batch in enumerate(self._batches):
+            selected = batch_ids == i
+            if not selected.any():
+                continue
+            culminations, max_altitudes = _culminations(batch)
+            batch_rows = rows[selected]
+            windows["starts"][selected] = batch[4][batch_rows]
+            windows["ends"][selected] = batch[5][batch_rows]
+            windows["culminations"][selected] = culminations[batch_rows]
+            windows["max_altitudes"][selected] = max_altitudes[batch_rows]
+        return windows
+
+
+def _culminations(batch):
+    """time (matplotlib date number) and altitude of the highest valid sample of
+    each row of a batch, NaN for rows without valid samples"""
+    grid, samples, altitudes, offsets = batch[:4]
+    counts = np.diff(offsets)
+    visible = counts > 0
+    culminations = np.full(len(counts), np.nan)
+    max_altitudes = np.full(len(counts), np.nan)
+    if not visible.any():
+        return culminations, max_altitudes
+
+    # first sample of each row that reaches the row's maximum, as argmax would
+    row_of_sample = np.repeat(np.arange(len(counts)), counts)
+    row_max = np.full(len(counts), -np.inf, dtype=altitudes.dtype)
+    row_max[visible] = np.maximum.reduceat(altitudes, offsets[:-1][visible])
+    at_max = np.flatnonzero(altitudes == row_max[row_of_sample])
+    _, first = np.unique(row_of_sample[at_max], return_index=True)
+    peaks = at_max[first]
+
+    culminations[visible] = grid[samples[peaks]]
+    max_altitudes[visible] = altitudes[peaks]
+    return culminations, max_altitudes
+
+
+class VisibilityIndex:
+    """sorted-array index over visibility intervals.
+
+    Times are matplotlib date numbers, queries also accept datetimes.
+
+    Attributes:
+        starts, ends (ndarray): start and end of the intervals, sorted by start
+        targets (ndarray): index into `names` of the target of each interval
+        nights (ndarray): index of the night of each interval
+        names (list): names of the indexed targets
+    """
+
+    def __init__(self, starts, ends, targets, nights, names):
+        order = np.argsort(starts, kind="stable")
+        self.starts = np.asarray(starts, dtype=float)[order]
+        self.ends = np.asarray(ends, dtype=float)[order]
+        self.targets = np.asarray(targets, dtype=int)[order]
+        self.nights = np.asarray(nights, dtype=int)[order]
+        self.names = list(names)
+
+        # running maximum of the ends, non-decreasing and therefore searchable
+        self.max_ends = np.maximum.accumulate(self.ends) if len(self) else self.ends
+
+        # union of all intervals: a new block starts where an interval starts
+        # after all previous intervals ended
+        new_block = np.ones(len(self), dtype=bool)
+        new_block[1:] = self.starts[1:] > self.max_ends[:-1]
+        first = np.flatnonzero(new_block)
+        last = np.append(first[1:] - 1, len(self) - 1) if len(first) else first
+        self.covered_starts = self.starts[first]
+        self.covered_ends = self.max_ends[last]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __repr__(self):
+        return f"VisibilityIndex of {len(self)} intervals of {len(self.names)} targets"
+
+    @classmethod
+    def from_nights(cls, nights):
+        """builds the index from the schedules of planned nights"""
+        names, rows = [], {}
+        starts, ends, targets, night_ids = [], [], [], []
+        for i, night in enumerate(nights):
+            if not night.schedule:
+                continue
+            for name, entry in night.schedule.items():
+                if name not in rows:
+                    rows[name] = len(names)
+                    names.append(name)
+                intervals = visibility_intervals(
+                    entry.grid, entry.samples, entry.start_date, entry.end_date
+                )
+                starts.append(intervals[:, 0])
+                ends.append(intervals[:, 1])
+                targets.append(np.full(len(intervals), rows[name]))
+                night_ids.append(np.full(len(intervals), i))
+
+        if not starts:
+            return cls(np.zeros(0), np.zeros(0), np.zeros(0), np.zeros(0), names)
+        return cls(
+            np.concatenate(starts),
+            np.concatenate(ends),
+            np.concatenate(targets),
+            np.concatenate(night_ids),
+            names,
+        )
+
+    def _candidates(self, first_end, last_start):
+        """indices of the intervals that start before last_start and whose
+        end can be after first_end"""
+        first = np.searchsorted(self.max_ends, first_end, side="left")
+        last = np.searchsorted(self.starts, last_start, side="right")
+        return np.arange(first, max(first, last))
+
+    def at(self, time):
+        """indices of the intervals that contain a point in time"""
+        time = _date_number(time)
+        candidates = self._candidates(time, time)
+        return candidates[self.ends[candidates] >= time]
+
+    def overlapping(self, start, end):
+        """indices of the intervals that overlap with [start, end]"""
+        start, end = _date_number(start), _date_number(end)
+        candidates = self._candidates(start, end)
+        return candidates[self.ends[candidates] >= start]
+
+    def containing(self, start, end):
+        """indices of the intervals that contain all of [start, end]"""
+        start, end = _date_number(start), _date_number(end)
+        candidates = self._candidates(end, start)
+        return candidates[self.ends[candidates] >= end]
+
+    def targets_at(self, time):
+        """names of the targets that are visible at a point in time"""
+        return [self.names[target] for target in np.unique(self.targets[self.at(time)])]
+
+    def gaps(self, start, end, min_duration=0.0):
+        """periods within [start, end] during which no target is visible
+
+        Args:
+            start, end (float or datetime): period to search
+            min_duration (float): shortest gap to report in days
+
+        Returns:
+            gaps (list): (start, end) datetimes of the free gaps
+        """
+        start, end = _date_number(start), _date_number(end)
+        first = np.searchsorted(self.covered_ends, start, side="left")
+        last = np.searchsorted(self.covered_starts, end, side="right")
+
+        gaps = []
+        cursor = start
+        for block_start, block_end in zip(
+            self.covered_starts[first:last], self.covered_ends[first:last]
+        ):
+            if block_start > cursor:
+                gaps.append((cursor, block_start))
+            cursor = max(cursor, block_end)
+        if cursor < end:
+            gaps.append((cursor, end))
+
+        return [
+            tuple(num2date([gap_start, gap_end]))
+            for gap_start, gap_end in gaps
+            if gap_end - gap_start > min_duration
+        ]
+
+
+def visibility_intervals(grid, samples, start, end):
+    """splits the visibility of a target in a night into contiguous intervals.
+
+    The valid samples are split where they skip a sample of the night's grid
+    (e.g. when the moon rises in between). The outer edges are given by the
+    start and end of the schedule entry, which can be refined beyond the sampled
+    times.
+
+    Args:
+        grid (ndarray): sample times of the night (matplotlib date numbers)
+        samples (ndarray): indices of the valid samples in the grid
+        start, end (float): start and end of the visibility window
+
+    Returns:
+        intervals (ndarray): (start, end) matplotlib date numbers, shape (n, 2)
+    """
+    samples = np.asarray(samples, dtype=int)
+    gaps = np.flatnonzero(np.diff(samples) > 1)
+    starts = np.concatenate([[start], grid[samples[gaps + 1]]])
+    ends = np.concatenate([grid[samples[gaps]], [end]])
+    return np.stack([starts, ends], axis=1)
+
+
+def _date_number(time):
+    if isinstance(time, datetime):
+        return date2num(time)
+    return float(time)
@@ -32,6 +32,7 @@ setup(
         ],
     },
     install_requires=requirements,
+    extras_require={"parquet": ["pyarrow"]},
     license="MIT license",
     long_description=readme,
     include_package_data=True,
@@ -1,19 +1,49 @@
 #!/usr/bin/env python
 
 """Tests for `iact_observation_planner` package."""
+import asyncio
+import json
 import os
+import pickle
 import subprocess as sp
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
 
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
+import ephem
+import numpy as np
+import pandas as pd
 import pytest
 
-from astropy.coordinates import EarthLocation, SkyCoord
+import astropy.units as u
+from matplotlib.dates import date2num, num2date
+from astropy.table import Table
+from astropy.time import Time
+from astropy.coordinates import EarthLocation, SkyCoord, AltAz, angular_separation
+from astropy.coordinates.name_resolve import NameResolveError
 
+from benchmarks import run_benchmarks
 from iact_observation_planner import iact_observation_planner
 from iact_observation_planner import observer_config
+from iact_observation_planner import allocation
+from iact_observation_planner import export
 from iact_observation_planner import targets as iop_targets
 from iact_observation_planner import nights
+from iact_observation_planner import ephemeris
+from iact_observation_planner import profiling
+from iact_observation_planner import fast_coordinates
+from iact_observation_planner import twilight
+from iact_observation_planner import season
+from iact_observation_planner import server
+from iact_observation_planner import survey
+from iact_observation_planner.session import PlanningSession, plan_sessions
+from iact_observation_planner.result_cache import ResultCache
+from iact_observation_planner.visibility import VisibilityIndex, visibility_intervals
+from iact_observation_planner.schedule import Schedule, summarize_sites
 
 
 default_sites = ["HESS", "MAGIC"]
@@ -49,6 +79,49 @@ def test_cfg_data(site, dark):
     assert wobble
 
 
+def test_site_config(tmp_path, monkeypatch):
+    cfg_data = observer_config.default_observer_config()
+    cfg_data["Sites"]["CTA-S"] = {"lon": -70.3, "lat": -24.6, "height": 2150}
+    cfg_data["Darkness"]["dark"]["max_moon_altitude"] = "-2 deg"
+    path = tmp_path / "site_config.json"
+    path.write_text(json.dumps(cfg_data))
+
+    monkeypatch.setenv("IOP_SITE_CONFIG", str(path))
+    cfg = iact_observation_planner.get_config()
+    assert cfg is iact_observation_planner.get_config()
+    site = cfg.get_site_from_name("CTA-S")
+    assert site is cfg.get_site_from_name("CTA-S")
+    assert site.lat.to_value(u.deg) == pytest.approx(-24.6)
+
+    # the darkness criteria are parsed once and shared
+    darkness = iact_observation_planner.parse_darkness("dark")["darkness"]
+    assert darkness.max_moon_altitude == -2 * u.deg
+    assert darkness["max_moon_altitude"] == "-2 deg"
+    assert darkness.max_moon_phase is None
+    assert observer_config.parse_darkness(dict(darkness), "dark") is darkness
+    assert pickle.loads(pickle.dumps(darkness)) is darkness
+    with pytest.raises(AttributeError):
+        darkness.max_moon_altitude = 10 * u.deg
+    with pytest.raises(ValueError):
+        darkness.max_moon_altitude[...] = 10 * u.deg
+
+    for section, name, key, value in [
+        ("Sites", "HESS", "lat", "north"),
+        ("Darkness", "gray", "min_moon_distance", "far"),
+        ("Darkness", "gray", "max_moon_phase", "0.5 deg"),
+        ("ObservationParameters", None, "run_duration", "28 deg"),
+    ]:
+        invalid = observer_config.default_observer_config()
+        entry = invalid[section] if name is None else invalid[section][name]
+        entry[key] = value
+        with pytest.raises(ValueError, match=key):
+            observer_config.validate_config(invalid)
+
+    del invalid["Darkness"]
+    with pytest.raises(ValueError, match="Darkness"):
+        observer_config.validate_config(invalid)
+
+
 @pytest.mark.parametrize(
     "date,expected",
     [
@@ -177,3 +250,1216 @@ def test_example_call(test_args):
     call = sp.run(comm, stdout=sp.PIPE, shell=True, universal_newlines=True)
     print(call.stdout)
     assert "Planning the following targets:" in call.stdout
+
+
+offline_targets = [
+    "rd/83.63d,22.01d/crab;30;5",
+    "rd/329.72d,-30.23d/pks2155;30;2",
+    "rd/161.26d,-59.68d/eta_car;30;2",
+]
+
+
+@pytest.mark.parametrize("workers", [2, 3])
+def test_plan_nights_parallel(workers):
+    targets = iop_targets.resolve_target_list(offline_targets)
+    dark = iact_observation_planner.parse_darkness("dark")["darkness"]
+    site = iact_observation_planner.parse_site("HESS")["site"]
+
+    serial = nights.setup_nights(datetime(2021, 3, 9), site, dark, timedelta(days=3))
+    parallel = nights.setup_nights(datetime(2021, 3, 9), site, dark, timedelta(days=3))
+    nights.plan_nights(serial, targets)
+    nights.plan_nights(parallel, targets, workers=workers)
+
+    for s_night, p_night in zip(serial, parallel):
+        assert list(s_night.schedule) == list(p_night.schedule)
+        for name, entry in s_night.schedule.items():
+            assert entry["start"] == p_night.schedule[name]["start"]
+            assert entry["end"] == p_night.schedule[name]["end"]
+            assert entry["times"] == p_night.schedule[name]["times"]
+            assert all(entry["altitudes"] == p_night.schedule[name]["altitudes"])
+
+
+@pytest.mark.parametrize("test_site", default_sites)
+def test_moon_positions_match_ephem(test_site):
+    site = iact_observation_planner.parse_site(test_site)["site"]
+    times = Time("2021-01-01") + np.linspace(0, 60, 500) * u.day
+    moon_pos = ephemeris.moon_positions(times, site)
+
+    moon = ephem.Moon()
+    obs = ephem.Observer()
+    obs.lon = str(site.lon / u.deg)
+    obs.lat = str(site.lat / u.deg)
+    obs.elev = site.height / u.m
+    for ii, time in enumerate(times):
+        obs.date = ephem.Date(time.datetime)
+        moon.compute(obs)
+        assert moon_pos["phases"][ii] == pytest.approx(moon.phase, abs=0.1)
+        if np.degrees(moon.alt) > -0.5:
+            assert moon_pos["altitudes"][ii] == pytest.approx(np.degrees(moon.alt), abs=0.05)
+
+
+def test_moon_calculated_once_per_night(monkeypatch):
+    targets = iop_targets.resolve_target_list(offline_targets)
+    site = iact_observation_planner.parse_site("HESS")["site"]
+    dark = iact_observation_planner.parse_darkness("dark")["darkness"]
+    night = nights.Night(datetime(2021, 3, 9), site, dark)
+
+    calls = []
+    moon_positions = ephemeris.moon_positions
+    monkeypatch.setattr(
+        ephemeris, "moon_positions", lambda *args: calls.append(1) or moon_positions(*args)
+    )
+    for target in targets:
+        night.plan_target(target)
+    assert len(calls) == 1
+
+
+def test_night_caches_time_grid():
+    site = iact_observation_planner.parse_site("HESS")["site"]
+    dark = iact_observation_planner.parse_darkness("dark")["darkness"]
+    night = nights.Night(datetime(2021, 3, 9), site, dark)
+
+    assert night.time_range is night.time_range
+    assert night.altaz_frame is night.altaz_frame
+    assert night.moon_alt_az is night.moon_alt_az
+    assert len(night.test_dates) == len(night.time_range) == night.n_samples
+    assert night.test_dates[0] == pytest.approx(
+        date2num(night.time_range[0].datetime), abs=1e-9
+    )
+
+
+@pytest.mark.parametrize("test_dark", default_darkness)
+def test_plan_targets_batch(test_dark):
+    targets = iop_targets.resolve_target_list(
+        offline_targets + ["lb/184.56d,-5.78d/crab_lb;30;2"]
+    )
+    site = iact_observation_planner.parse_site("HESS")["site"]
+    dark = iact_observation_planner.parse_darkness(test_dark)["darkness"]
+
+    # near new moon, the targets are visible with all darkness definitions
+    night = nights.Night(datetime(2021, 3, 13), site, dark)
+    night.plan_targets(targets)
+
+    # each target transformed on its own and the darkness criteria applied here
+    moon = night.moon_conditions
+    moon_ok = np.asarray(moon["altitudes"]) < dark.max_moon_altitude.deg
+    if dark.max_moon_phase is not None:
+        moon_ok &= np.asarray(moon["phases"]) < dark.max_moon_phase.value
+    frame = AltAz(obstime=night.time_range, location=site)
+
+    visible = []
+    for target in targets:
+        position = target.coords.transform_to(frame)
+        mask = moon_ok & (position.alt > target.alt_limit)
+        if dark.min_moon_distance is not None:
+            separation = angular_separation(
+                position.az,
+                position.alt,
+                np.asarray(moon["azimuths"]) * u.deg,
+                np.asarray(moon["altitudes"]) * u.deg,
+            )
+            mask &= separation > dark.min_moon_distance
+        if not mask.any():
+            continue
+        visible.append(target.name)
+
+        entry = night.schedule[target.name]
+        np.testing.assert_array_equal(entry["dates"], night.test_dates[mask])
+        np.testing.assert_allclose(
+            entry["altitudes"].to_value(u.deg), position.alt.deg[mask], atol=1e-6
+        )
+    assert visible
+    assert list(night.schedule) == visible
+
+
+@pytest.mark.parametrize("test_site", default_sites)
+@pytest.mark.parametrize("date", ["2001-06-01", "2021-03-09", "2039-12-01"])
+def test_fast_alt_az_accuracy(test_site, date):
+    site = iact_observation_planner.parse_site(test_site)["site"]
+    rng = np.random.RandomState(42)
+    ra = rng.uniform(0, 360, 100) * u.deg
+    dec = np.degrees(np.arcsin(rng.uniform(-1, 1, 100))) * u.deg
+    times = Time(date) + np.linspace(0, 1, 50) * u.day
+
+    alt, az = fast_coordinates.alt_az(ra, dec, times, site)
+    ref = SkyCoord(ra, dec)[:, np.newaxis].transform_to(
+        AltAz(obstime=times, location=site)
+    )
+    separation = angular_separation(az * u.deg, alt * u.deg, ref.az, ref.alt)
+
+    # documented accuracy of the fast engine: better than 0.02 deg
+    assert alt.shape == (100, 50)
+    assert np.abs(alt - ref.alt.deg).max() < 0.02
+    assert separation.to_value(u.deg).max() < 0.02
+
+
+def test_fast_engine_schedule():
+    targets = iop_targets.resolve_target_list(offline_targets)
+    site = iact_observation_planner.parse_site("HESS")["site"]
+    dark = iact_observation_planner.parse_darkness("dark")["darkness"]
+
+    night = nights.Night(datetime(2021, 3, 9), site, dark)
+    fast_night = nights.Night(datetime(2021, 3, 9), site, dark, engine="fast")
+    night.plan_targets(targets)
+    fast_night.plan_targets(targets)
+
+    # the windows agree to within one sample of the time grid
+    step = (night.sun_rise - night.sun_set) / (night.n_samples - 1)
+    assert list(night.schedule) == list(fast_night.schedule)
+    for name, entry in night.schedule.items():
+        assert abs(entry["start"] - fast_night.schedule[name]["start"]) <= step
+        assert abs(entry["end"] - fast_night.schedule[name]["end"]) <= step
+
+
+class StubResolver:
+    """local stand-in for SkyCoord.from_name that counts the lookups"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, name):
+        self.calls.append(name)
+        return SkyCoord(len(name) * 10.0, -30.0, unit="deg")
+
+
+def test_target_cache(tmp_path):
+    cache_path = str(tmp_path / "target_cache.json")
+    resolver = StubResolver()
+    cache = iop_targets.TargetCache(cache_path, resolver=resolver)
+    targets = iop_targets.resolve_target_list(
+        ["Crab Nebula;30;2", "Vela;25;4", "rd/123.3d,-23.5d/my_target"], cache
+    )
+    assert resolver.calls == ["Crab Nebula", "Vela"]
+    assert os.path.isfile(cache_path)
+
+    # a new cache is warm-loaded from disk and does not resolve again
+    resolver = StubResolver()
+    cache = iop_targets.TargetCache(cache_path, resolver=resolver)
+    cached_targets = iop_targets.resolve_target_list(["Crab Nebula;30;2", "Vela;25;4"], cache)
+    assert resolver.calls == []
+    for target, cached in zip(targets, cached_targets):
+        assert target.coords.separation(cached.coords).deg < 1e-9
+
+    # expired entries are resolved again
+    cache = iop_targets.TargetCache(cache_path, ttl=timedelta(0), resolver=resolver)
+    iop_targets.resolve_target_list(["Vela"], cache)
+    assert resolver.calls == ["Vela"]
+
+    # concurrent writers (e.g. cron runs and the server) leave a complete file
+    caches = [
+        iop_targets.TargetCache(cache_path, resolver=StubResolver()) for _ in range(8)
+    ]
+    for i, cache in enumerate(caches):
+        cache.resolve(f"source {i}")
+    threads = [threading.Thread(target=cache.save) for cache in caches]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(iop_targets.TargetCache(cache_path).entries) == 3
+    assert os.listdir(tmp_path) == ["target_cache.json"]
+
+
+def test_resolve_target_list_async(tmp_path):
+    names = [f"source {i};30;2" for i in range(12)] + ["rd/123.3d,-23.5d/my_target"]
+    resolver = iop_targets.LocalResolver(latency=0.2)
+    cache = iop_targets.TargetCache(str(tmp_path / "target_cache.json"), resolver=resolver)
+
+    start = datetime.now()
+    targets = asyncio.run(
+        iop_targets.resolve_target_list_async(names, cache, concurrency=4)
+    )
+    # 12 lookups of 0.2 s in 3 rounds of 4 instead of 2.4 s one after another
+    assert datetime.now() - start < timedelta(seconds=1.5)
+    assert resolver.max_in_flight == 4
+    assert sorted(resolver.calls) == sorted(f"source {i}" for i in range(12))
+    assert os.path.isfile(cache.path)
+
+    serial = iop_targets.resolve_target_list(
+        names, iop_targets.TargetCache(resolver=iop_targets.LocalResolver())
+    )
+    assert [target.name for target in targets] == [target.name for target in serial]
+    for target, serial_target in zip(targets, serial):
+        assert target.coords.separation(serial_target.coords).deg < 1e-9
+
+    # failed attempts are retried
+    resolver = iop_targets.LocalResolver(failures=1)
+    cache = iop_targets.TargetCache(resolver=resolver)
+    asyncio.run(cache.warm_async(["Vela", "Crab"], retries=1))
+    assert sorted(resolver.calls) == ["Crab", "Crab", "Vela", "Vela"]
+
+    # names that still fail after the retries raise, as do lookups that time out
+    cache = iop_targets.TargetCache(resolver=iop_targets.LocalResolver(failures=3))
+    with pytest.raises(NameResolveError):
+        asyncio.run(cache.warm_async(["Vela"], retries=1))
+    slow = iop_targets.LocalResolver(latency=0.5)
+    cache = iop_targets.TargetCache(resolver=slow)
+    with pytest.raises(TimeoutError, match="Vela"):
+        asyncio.run(cache.warm_async(["Vela"], timeout=0.1, retries=0))
+    assert "Vela" not in cache.entries
+
+
+def test_resolve_hung_names():
+    release = threading.Event()
+    fast = iop_targets.LocalResolver()
+
+    def resolver(name):
+        if name.startswith("hung"):
+            release.wait(10)
+        return fast(name)
+
+    # hung lookups give up their slots after the timeout, the fast names are
+    # still resolved and cached within their own timeout
+    cache = iop_targets.TargetCache(resolver=resolver)
+    start = time.perf_counter()
+    try:
+        with pytest.raises(TimeoutError, match="hung"):
+            asyncio.run(
+                cache.warm_async(
+                    ["hung 1", "hung 2", "Crab", "Vela"],
+                    concurrency=2,
+                    timeout=0.5,
+                    retries=0,
+                )
+            )
+        assert time.perf_counter() - start < 2
+        assert sorted(cache.entries) == ["Crab", "Vela"]
+    finally:
+        release.set()
+
+    # abandoned lookups do not keep the process alive
+    script = (
+        "import asyncio, time\n"
+        "from iact_observation_planner.targets import TargetCache\n"
+        "cache = TargetCache(resolver=lambda name: time.sleep(30))\n"
+        "try:\n"
+        "    asyncio.run(cache.warm_async(['hung'], timeout=0.5, retries=0))\n"
+        "except TimeoutError as error:\n"
+        "    print(error)\n"
+    )
+    start = time.perf_counter()
+    out = sp.run([sys.executable, "-c", script], capture_output=True, text=True)
+    assert "hung timed out" in out.stdout
+    assert time.perf_counter() - start < 20
+
+
+def test_target_cache_offline(tmp_path):
+    cache_path = str(tmp_path / "target_cache.json")
+    iop_targets.TargetCache(cache_path, resolver=StubResolver()).warm(["Vela"])
+
+    resolver = StubResolver()
+    cache = iop_targets.TargetCache(
+        cache_path, ttl=timedelta(0), offline=True, resolver=resolver
+    )
+    assert cache.resolve("Vela")
+    with pytest.raises(NameResolveError):
+        cache.resolve("Crab Nebula")
+    assert resolver.calls == []
+
+
+def write_catalogue(path, n_targets):
+    rng = np.random.RandomState(1)
+    frame = pd.DataFrame(
+        {
+            "name": [f"src{i}" for i in range(n_targets)],
+            "ra": rng.uniform(0, 360, n_targets),
+            "dec": rng.uniform(-90, 30, n_targets),
+            "alt_limit": rng.choice([25.0, 30.0, np.nan], n_targets),
+            "hours": rng.choice([1.0, 4.0], n_targets),
+        }
+    )
+    if str(path).endswith(".csv"):
+        frame.to_csv(path, index=False)
+    elif str(path).endswith(".json"):
+        frame.to_json(path, orient="records")
+    else:
+        Table.from_pandas(frame).write(path, format="ascii.ecsv")
+    return frame
+
+
+@pytest.mark.parametrize("extension", ["csv", "json", "ecsv"])
+def test_read_target_file(tmp_path, extension):
+    path = str(tmp_path / f"catalogue.{extension}")
+    frame = write_catalogue(path, 1000)
+
+    catalogue = iop_targets.read_target_file(path)
+    assert len(catalogue) == 1000
+    assert catalogue.coords.shape == (1000,)
+    assert np.allclose(catalogue.coords.ra.deg, frame["ra"])
+    assert np.allclose(
+        catalogue.alt_limits.to_value(u.deg), frame["alt_limit"].fillna(45.0)
+    )
+    assert np.allclose(catalogue.hours, frame["hours"])
+    assert catalogue[3].name == "src3"
+    assert len(catalogue[10:20]) == 10
+
+
+def test_concatenate_target_file(tmp_path):
+    empty = str(tmp_path / "empty.csv")
+    with open(empty, "w") as target_file:
+        target_file.write("name,ra,dec\n")
+    catalogue = iact_observation_planner.resolve_targets([], empty, offline=True)
+    assert len(catalogue) == 0
+    catalogue = iact_observation_planner.resolve_targets(
+        offline_targets, empty, offline=True
+    )
+    assert list(catalogue.names) == [target.split(";")[0] for target in offline_targets]
+
+    # names in both the target list and the file would overwrite each other
+    duplicate = str(tmp_path / "duplicate.csv")
+    with open(duplicate, "w") as target_file:
+        target_file.write(f'name,ra,dec\n"{catalogue.names[0]}",83.63,22.01\n')
+    with pytest.raises(ValueError, match="more than once"):
+        iact_observation_planner.resolve_targets(
+            offline_targets, duplicate, offline=True
+        )
+
+
+def test_plan_target_catalogue(tmp_path):
+    path = str(tmp_path / "catalogue.csv")
+    write_catalogue(path, 30)
+    catalogue = iop_targets.read_target_file(path)
+    site = iact_observation_planner.parse_site("HESS")["site"]
+    dark = iact_observation_planner.parse_darkness("dark")["darkness"]
+
+    catalogue_night = nights.Night(datetime(2021, 3, 9), site, dark)
+    catalogue_night.plan_targets(catalogue)
+    list_night = nights.Night(datetime(2021, 3, 9), site, dark)
+    list_night.plan_targets(list(catalogue))
+
+    assert catalogue_night.schedule
+    assert list(catalogue_night.schedule) == list(list_night.schedule)
+
+
+@pytest.mark.parametrize("test_site", default_sites)
+def test_twilight_table(tmp_path, test_site):
+    site = iact_observation_planner.parse_site(test_site)["site"]
+    dark = iact_observation_planner.parse_darkness("dark")["darkness"]
+    table = twilight.TwilightTable.generate(
+        site, dark, datetime(2021, 3, 1), datetime(2021, 4, 1)
+    )
+    table.save(twilight.table_path(str(tmp_path), site, dark))
+    loaded = twilight.load_table(str(tmp_path), site, dark)
+    assert len(loaded) == 31
+
+    planned_nights = nights.setup_nights(
+        datetime(2021, 3, 28), site, dark, timedelta(days=7), twilight=loaded
+    )
+    for night in planned_nights:
+        assert (night.sun_set, night.sun_rise) == nights.find_sun_rise_and_set(
+            night.date, site, dark
+        )
+    assert loaded.lookup(datetime(2021, 4, 1)) is None
+    assert loaded.lookup(datetime(2021, 3, 2, 12)) is None
+
+    other_site = iact_observation_planner.parse_site(
+        [name for name in default_sites if name != test_site][0]
+    )["site"]
+    assert twilight.load_table(str(tmp_path), other_site, dark) is None
+
+
+@pytest.mark.parametrize("test_site", default_sites)
+def test_season_ephemeris(tmp_path, test_site):
+    site = iact_observation_planner.parse_site(test_site)["site"]
+    dark = iact_observation_planner.parse_darkness("dark")["darkness"]
+    path = season.season_path(str(tmp_path), site)
+    season.SeasonEphemeris.build(
+        site, datetime(2021, 3, 1), datetime(2021, 3, 8), path=path
+    )
+    loaded = season.load_season(str(tmp_path), site)
+    assert isinstance(loaded.data, np.memmap)
+    assert len(loaded) == 7 * 1440
+
+    planned_nights = nights.setup_nights(
+        datetime(2021, 3, 1), site, dark, timedelta(days=7), season=loaded
+    )
+    for night in planned_nights[:-1]:
+        sun_times = nights.find_sun_rise_and_set(night.date, site, dark)
+        assert abs(night.sun_set - sun_times[0]) < timedelta(seconds=5)
+        assert abs(night.sun_rise - sun_times[1]) < timedelta(seconds=5)
+
+        # the grid and the moon positions are views into the season
+        assert len(night.test_dates) <= night.n_samples
+        assert np.shares_memory(night.moon_conditions["altitudes"], loaded.data)
+        moon = ephemeris.moon_positions(night.time_range, site)
+        for key in ("altitudes", "azimuths", "phases"):
+            np.testing.assert_allclose(night.moon_conditions[key], moon[key], atol=1e-3)
+        assert night.grid_key is not None
+
+    # the last night ends after the season and is calculated as usual
+    assert planned_nights[-1].season is None
+    assert planned_nights[-1].grid_key is None
+
+    # workers open the memory map again instead of receiving a copy
+    assert len(pickle.dumps(loaded)) < 1000
+    assert isinstance(pickle.loads(pickle.dumps(loaded)).data, np.memmap)
+
+    targets = iop_targets.resolve_target_list(offline_targets)
+    nights.plan_nights(planned_nights[:2], targets)
+    reference = nights.setup_nights(datetime(2021, 3, 1), site, dark, timedelta(days=2))
+    nights.plan_nights(reference, targets)
+    for night, reference_night in zip(planned_nights, reference):
+        assert list(night.schedule) == list(reference_night.schedule)
+        for name, entry in night.schedule.items():
+            reference_entry = reference_night.schedule[name]
+            assert abs(entry["start"] - reference_entry["start"]) < timedelta(minutes=5)
+            assert abs(entry["end"] - reference_entry["end"]) < timedelta(minutes=5)
+
+    other_site = iact_observation_planner.parse_site(
+        [name for name in default_sites if name != test_site][0]
+    )["site"]
+    assert season.load_season(str(tmp_path), other_site) is None
+
+
+@pytest.mark.parametrize("engine", ["astropy", "fast"])
+@pytest.mark.parametrize("date", [datetime(2021, 3, 9), datetime(2021, 3, 24)])
+def test_adaptive_sampling(date, engine):
+    targets = iop_targets.resolve_target_list(
+        offline_targets + ["rd/250d,-40d/scorpius;40;2"]
+    )
+    site = iact_observation_planner.parse_site("HESS")["site"]
+    dark = iact_observation_planner.parse_darkness("dark")["darkness"]
+
+    dense = nights.Night(date, site, dark, n_samples=4000, engine=engine)
+    dense.plan_targets(targets)
+    grid = nights.Night(date, site, dark, engine=engine)
+    grid.plan_targets(targets)
+    adaptive = nights.Night(
+        date, site, dark, engine=engine, sampling="adaptive", tolerance=1.0
+    )
+    adaptive.plan_targets(targets)
+
+    step = (dense.sun_rise - dense.sun_set).total_seconds() / (dense.n_samples - 1)
+    assert list(adaptive.schedule) == list(dense.schedule)
+    for name, entry in dense.schedule.items():
+        for edge in ["start", "end"]:
+            error = (adaptive.schedule[name][edge] - entry[edge]).total_seconds()
+            assert abs(error) <= step + 1.0
+    assert adaptive.n_evaluations < grid.n_evaluations / 2
+
+
+def test_allocate_runs():
+    targets = iop_targets.resolve_target_list(
+        offline_targets + ["rd/250d,-40d/scorpius;40;20"]
+    )
+    site = iact_observation_planner.parse_site("HESS")["site"]
+    dark = iact_observation_planner.parse_darkness("dark")["darkness"]
+    planned_nights = nights.setup_nights(
+        datetime(2021, 3, 9), site, dark, timedelta(days=3)
+    )
+    nights.plan_nights(planned_nights, targets)
+
+    allocated = allocation.allocate(planned_nights, targets, "28 min")
+
+    for night in planned_nights:
+        runs = allocated.runs[night.date]
+        for (_, _, end), (_, start, _) in zip(runs, runs[1:]):
+            assert end <= start + timedelta(seconds=1)
+        for name, start, end in runs:
+            entry = night.schedule[name]
+            assert entry["start"] <= start + timedelta(seconds=1)
+            assert end <= entry["end"] + timedelta(seconds=1)
+
+    for name, hours in allocated.requested_hours.items():
+        assert allocated.allocated_hours[name] <= hours
+        assert len(allocated.runs_of(name)) <= int(hours * 60 / 28)
+        assert len(allocated.runs_of(name)) * 28 / 60 == pytest.approx(
+            allocated.allocated_hours[name]
+        )
+    assert "rd/250d,-40d/scorpius" in allocated.unfulfilled()
+
+
+def test_allocate_most_constrained_first(capsys):
+    sun_set = datetime(2021, 3, 9, 18, tzinfo=timezone.utc)
+    hours = [sun_set + timedelta(hours=i) for i in range(5)]
+    night = nights.Night(
+        datetime(2021, 3, 9), None, None, sun_times=(sun_set, hours[-1])
+    )
+    # "always" is visible all night, "short" only during the first hour
+    night.schedule.add(
+        ["always", "short"],
+        date2num(hours),
+        np.array([[True] * 5, [True] * 2 + [False] * 3]),
+        np.full((2, 5), 50.0),
+    )
+    targets = [
+        iop_targets.Target("always", SkyCoord(0, 0, unit="deg"), None, 3),
+        iop_targets.Target("short", SkyCoord(0, 0, unit="deg"), None, 1),
+    ]
+
+    allocated = allocation.allocate([night], targets, "1 h")
+
+    assert allocated.runs_of("short") == [(hours[0], hours[1])]
+    assert allocated.runs_of("always") == list(zip(hours[1:4], hours[2:]))
+    assert allocated.unfulfilled() == []
+
+    # both targets need the last free slot, the one with fewer options gets it
+    targets[0].hours = 4
+    allocated = allocation.allocate([night], targets, "1 h")
+    assert allocated.runs_of("short") == [(hours[0], hours[1])]
+    assert allocated.unfulfilled() == ["always"]
+
+    # only whole runs are allocated, without exceeding the request
+    targets[0].hours = 2.5
+    allocated = allocation.allocate([night], targets, "1 h")
+    assert len(allocated.runs_of("always")) == 2
+    assert allocated.allocated_hours["always"] == pytest.approx(2.0)
+    assert allocated.unfulfilled() == []
+
+    # a request below one run gets no run and is not fulfilled
+    targets[1].hours = 0.3
+    allocated = allocation.allocate([night], targets, "1 h")
+    assert allocated.runs_of("short") == []
+    assert allocated.is_below_one_run("short")
+    assert allocated.unfulfilled() == ["short"]
+    Schedule([night], allocated).summarize_allocation()
+    out = capsys.readouterr().out
+    assert "short: 0.00 h of 0.30 h  (not fulfilled, below one run)" in out
+
+
+def test_night_schedule_store():
+    targets = iop_targets.resolve_target_list(offline_targets)
+    site = iact_observation_planner.parse_site("HESS")["site"]
+    dark = iact_observation_planner.parse_darkness("dark")["darkness"]
+    night = nights.Night(datetime(2021, 3, 9), site, dark)
+    night.plan_targets(targets)
+    assert len(night.schedule) == 2
+
+    for name, entry in night.schedule.items():
+        assert entry.altitudes.dtype == np.float32
+        assert entry.samples.dtype == np.uint8
+        assert np.isin(entry["dates"], night.test_dates).all()
+        assert entry["times"] == list(num2date(entry["dates"]))
+        assert entry["start"] == entry["times"][0]
+        assert entry["end"] == entry["times"][-1]
+        assert entry["altitudes"].unit == u.deg
+
+    # the schedule survives the transfer from worker processes
+    restored = pickle.loads(pickle.dumps(night.schedule))
+    merged = nights.NightSchedule()
+    merged.merge(restored)
+    assert list(merged) == list(night.schedule)
+    for name, entry in night.schedule.items():
+        assert merged[name]["times"] == entry["times"]
+        assert np.all(merged[name]["altitudes"] == entry["altitudes"])
+
+    # entries can be set as dicts, as in earlier versions
+    first, second = list(night.schedule)
+    entry = dict(night.schedule[first])
+    merged["copy"] = entry
+    merged.update({"other": dict(night.schedule[second])})
+    for name, original in [("copy", first), ("other", second)]:
+        original = night.schedule[original]
+        assert merged[name]["times"] == original["times"]
+        assert merged[name]["start"] == original["start"]
+        assert np.all(merged[name]["altitudes"] == original["altitudes"])
+    assert list(merged) == [first, second, "copy", "other"]
+
+    # deleted entries free their samples, the other entries are unchanged
+    del merged[first]
+    assert merged.locate(second)[0][1].size == len(night.schedule[second].samples)
+    assert merged[second]["times"] == night.schedule[second]["times"]
+    for name in [second, "copy", "other"]:
+        del merged[name]
+    assert len(merged) == 0
+    assert merged._batches == []
+    assert len(night.schedule) == 2
+
+
+def test_planning_session():
+    targets = iop_targets.resolve_target_list(offline_targets)
+    site = iact_observation_planner.parse_site("HESS")["site"]
+    dark = iact_observation_planner.parse_darkness("dark")["darkness"]
+
+    session = PlanningSession(site, dark)
+    session.set_range(datetime(2021, 3, 9), timedelta(days=2))
+    session.set_targets(targets)
+    session.plan()
+    assert session.n_planned == 6
+
+    def assert_matches_full_plan():
+        planned_nights = nights.setup_nights(
+            session.nights[0].date, site, dark, timedelta(days=len(session.nights))
+        )
+        nights.plan_nights(planned_nights, list(session.catalogue))
+        for night, planned_night in zip(session.nights, planned_nights):
+            assert list(night.schedule) == list(planned_night.schedule)
+            for name, entry in planned_night.schedule.items():
+                assert night.schedule[name]["times"] == entry["times"]
+
+    # a new target is only planned into the known nights
+    too = iop_targets.resolve_target_list(["rd/250d,-40d/too;30;1"])
+    session.add_targets(too)
+    session.plan()
+    assert session.n_planned == 8
+    assert_matches_full_plan()
+
+    # shifting the range only plans the new night
+    moon_calls = session.nights[1]._moon_conditions
+    session.set_range(datetime(2021, 3, 10), timedelta(days=2))
+    session.plan()
+    assert session.n_planned == 12
+    assert session.nights[0]._moon_conditions is moon_calls
+    assert_matches_full_plan()
+
+    # removing needs no planning, changing the coordinates invalidates the cells
+    session.remove_targets(["rd/250d,-40d/too;30;1".split(";")[0]])
+    session.plan()
+    assert session.n_planned == 12
+    assert all("rd/250d,-40d/too" not in night.schedule for night in session.nights)
+    session.add_targets(iop_targets.resolve_target_list(["rd/250d,-30d/too;30;1"]))
+    session.plan()
+    assert session.n_planned == 14
+    assert_matches_full_plan()
+
+    session.forget()
+    assert len(session._nights) == 2
+
+
+def test_option_parsing_sites():
+    sites = iact_observation_planner.parse_sites(["HESS", "MAGIC", "HESS"])["sites"]
+    assert [site.info.name for site in sites] == ["HESS", "MAGIC"]
+    all_sites = iact_observation_planner.parse_sites("all")["sites"]
+    assert [site.info.name for site in all_sites] == default_sites
+    assert iact_observation_planner.parse_options(
+        ["MAGIC", "HESS"], "dark", "2021-03-09", 1
+    )["site"].info.name == "MAGIC"
+
+
+@pytest.mark.parametrize("workers", [1, 2, 4])
+def test_plan_sessions_multi_site(workers, capsys):
+    targets = iop_targets.resolve_target_list(offline_targets)
+    dark = iact_observation_planner.parse_darkness("dark")["darkness"]
+    sites = iact_observation_planner.parse_sites("all")["sites"]
+
+    sessions = []
+    for site in sites:
+        session = PlanningSession(site, dark)
+        session.set_targets(targets)
+        sessions.append(session)
+    sessions = plan_sessions(sessions, datetime(2021, 3, 9), timedelta(days=2), workers)
+
+    schedules = []
+    for site, session in zip(sites, sessions):
+        planned_nights = nights.setup_nights(
+            datetime(2021, 3, 9), site, dark, timedelta(days=2)
+        )
+        nights.plan_nights(planned_nights, targets)
+        for night, planned_night in zip(session.nights, planned_nights):
+            assert night.sun_set == planned_night.sun_set
+            assert list(night.schedule) == list(planned_night.schedule)
+            for name, entry in planned_night.schedule.items():
+                assert night.schedule[name]["times"] == entry["times"]
+
+        schedules.append(
+            Schedule(session.nights, session.allocate("28 min"), site=site.info.name)
+        )
+
+    summary = summarize_sites(schedules)
+    assert summary.splitlines()[1].split() == ["target"] + default_sites
+    assert len(summary.splitlines()) == 2 + len(targets)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_plan_darkness_nights(workers):
+    targets = iop_targets.resolve_target_list(
+        offline_targets + ["rd/250d,-40d/scorpius;40;2"]
+    )
+    site = iact_observation_planner.parse_site("HESS")["site"]
+    darknesses = iact_observation_planner.parse_darknesses("all")["darknesses"]
+    darknesses["astro"] = dict(darknesses["dark"], max_sun_altitude="-18 deg")
+
+    planned = nights.setup_darkness_nights(
+        datetime(2021, 3, 20), site, darknesses, timedelta(days=2)
+    )
+    nights.plan_darkness_nights(planned, targets, workers)
+
+    for name, darkness in darknesses.items():
+        separate = nights.setup_nights(
+            datetime(2021, 3, 20), site, darkness, timedelta(days=2)
+        )
+        nights.plan_nights(separate, targets)
+        for night, separate_night in zip(planned[name], separate):
+            assert list(night.schedule) == list(separate_night.schedule)
+            step = (night.sun_rise - night.sun_set) / night.n_samples
+            for target, entry in separate_night.schedule.items():
+                if name != "astro":
+                    assert night.schedule[target]["times"] == entry["times"]
+                for edge in ["start", "end"]:
+                    assert abs(night.schedule[target][edge] - entry[edge]) <= 2 * step
+
+    # the geometry was only calculated once for each of the 2 dates
+    if workers == 1:
+        evaluations = [
+            night.n_evaluations
+            for darkness_nights in planned.values()
+            for night in darkness_nights
+        ]
+        assert sum(evaluations) == 2 * len(targets) * nights.GRID_SAMPLES
+
+
+def test_result_cache(tmp_path):
+    targets = iop_targets.resolve_target_list(offline_targets)
+    site = iact_observation_planner.parse_site("HESS")["site"]
+    dark = iact_observation_planner.parse_darkness("dark")["darkness"]
+    cache = ResultCache(str(tmp_path / "results"))
+
+    first = PlanningSession(site, dark, result_cache=cache)
+    first.set_range(datetime(2021, 3, 9), timedelta(days=2))
+    first.set_targets(targets)
+    first.plan()
+    assert first.n_planned == 6
+    assert len(os.listdir(tmp_path / "results")) == 2
+
+    # a later session over an overlapping range only plans the new night
+    second = PlanningSession(site, dark, result_cache=cache)
+    second.set_range(datetime(2021, 3, 10), timedelta(days=2))
+    second.set_targets(targets)
+    second.plan()
+    assert second.n_planned == 3
+    assert cache.hits == 3
+    for night, cached_night in zip(first.nights[1:], second.nights):
+        assert list(night.schedule) == list(cached_night.schedule)
+        for name, entry in night.schedule.items():
+            assert cached_night.schedule[name]["times"] == entry["times"]
+            assert cached_night.schedule[name]["start"] == entry["start"]
+            assert np.all(cached_night.schedule[name]["altitudes"] == entry["altitudes"])
+
+    # a different darkness does not reuse the results
+    gray = iact_observation_planner.parse_darkness("gray")["darkness"]
+    third = PlanningSession(site, gray, result_cache=cache)
+    third.set_range(datetime(2021, 3, 10), timedelta(days=1))
+    third.set_targets(targets)
+    third.plan()
+    assert third.n_planned == 3
+
+    # the least recently used nights are evicted first
+    newest = cache.path(third._night_keys[datetime(2021, 3, 10)])
+    cache.max_size = os.path.getsize(newest)
+    os.utime(newest, (2e9, 2e9))
+    assert cache.evict() == 3
+    assert os.listdir(tmp_path / "results") == [os.path.basename(newest)]
+
+    # a truncated file (e.g. of an interrupted writer) is a miss and replaced
+    with open(newest, "r+b") as cache_file:
+        cache_file.truncate(os.path.getsize(newest) // 2)
+    fourth = PlanningSession(site, gray, result_cache=cache)
+    fourth.set_range(datetime(2021, 3, 10), timedelta(days=1))
+    fourth.set_targets(targets)
+    fourth.plan()
+    assert fourth.n_planned == 3
+    assert os.listdir(tmp_path / "results") == [os.path.basename(newest)]
+    assert len(cache.get(third._night_keys[datetime(2021, 3, 10)], third.keys)) == 3
+
+
+def test_visibility_index():
+    rng = np.random.RandomState(1)
+    starts = rng.uniform(0, 10, 200)
+    ends = starts + rng.exponential(0.3, 200)
+    targets = rng.randint(0, 20, 200)
+    index = VisibilityIndex(
+        starts, ends, targets, np.zeros(200), [f"t{i}" for i in range(20)]
+    )
+
+    def found(indices):
+        return sorted(zip(index.starts[indices], index.ends[indices]))
+
+    for time in rng.uniform(-1, 11, 50):
+        expected = (starts <= time) & (ends >= time)
+        assert found(index.at(time)) == sorted(zip(starts[expected], ends[expected]))
+        assert index.targets_at(time) == sorted(
+            {f"t{target}" for target in targets[expected]}, key=lambda n: int(n[1:])
+        )
+
+        end = time + rng.uniform(0, 0.5)
+        expected = (starts <= end) & (ends >= time)
+        assert found(index.overlapping(time, end)) == sorted(
+            zip(starts[expected], ends[expected])
+        )
+        expected = (starts <= time) & (ends >= end)
+        assert found(index.containing(time, end)) == sorted(
+            zip(starts[expected], ends[expected])
+        )
+
+    # the gaps are exactly the uncovered periods
+    grid = np.linspace(-1, 11, 5001)
+    covered = ((starts <= grid[:, np.newaxis]) & (ends >= grid[:, np.newaxis])).any(1)
+    in_gap = np.zeros(len(grid), dtype=bool)
+    for start, end in index.gaps(-1, 11):
+        start, end = date2num([start, end])
+        in_gap |= (grid > start) & (grid < end)
+    assert not (in_gap & covered).any()
+    assert in_gap[~covered][1:-1].all()
+
+
+def test_visibility_index_from_nights():
+    targets = iop_targets.resolve_target_list(offline_targets)
+    site = iact_observation_planner.parse_site("HESS")["site"]
+    dark = iact_observation_planner.parse_darkness("gray")["darkness"]
+    planned_nights = nights.setup_nights(
+        datetime(2021, 3, 20), site, dark, timedelta(days=2)
+    )
+    nights.plan_nights(planned_nights, targets)
+
+    index = VisibilityIndex.from_nights(planned_nights)
+    for i, night in enumerate(planned_nights):
+        for time, date in zip(night.time_range.datetime, night.test_dates):
+            expected = [
+                name for name, entry in night.schedule.items()
+                if np.isclose(entry["dates"], date).any()
+            ]
+            assert sorted(index.targets_at(time)) == sorted(expected)
+
+
+def test_visibility_intervals():
+    grid = np.arange(11.0)
+    # isolated single samples are separate windows
+    np.testing.assert_array_equal(
+        visibility_intervals(grid, [0, 10], 0, 10), [[0, 0], [10, 10]]
+    )
+    np.testing.assert_array_equal(
+        visibility_intervals(grid, [0, 5, 10], 0, 10), [[0, 0], [5, 5], [10, 10]]
+    )
+    # runs of samples are split where they skip a sample, the outer edges are
+    # the (refined) start and end of the entry
+    np.testing.assert_array_equal(
+        visibility_intervals(grid, [1, 2, 3, 6, 8, 9], 0.5, 9.5),
+        [[0.5, 3], [6, 6], [8, 9.5]],
+    )
+    np.testing.assert_array_equal(
+        visibility_intervals(grid, np.array([4], dtype=np.uint8), 3.8, 4.2),
+        [[3.8, 4.2]],
+    )
+
+
+@pytest.mark.parametrize("fmt", ["csv", "jsonl", "ics", "parquet"])
+def test_schedule_export(tmp_path, fmt):
+    if fmt == "parquet":
+        pytest.importorskip("pyarrow")
+    targets = iop_targets.resolve_target_list(offline_targets)
+    site = iact_observation_planner.parse_site("HESS")["site"]
+    dark = iact_observation_planner.parse_darkness("dark")["darkness"]
+    planned_nights = nights.setup_nights(
+        datetime(2021, 3, 9), site, dark, timedelta(days=2)
+    )
+    nights.plan_nights(planned_nights, targets)
+    schedule = Schedule(planned_nights, allocation.allocate(planned_nights, targets, "28 min"))
+
+    # the vectorized culminations match the highest sample of each entry
+    for night in planned_nights:
+        windows = night.schedule.windows()
+        assert list(windows["names"]) == list(night.schedule)
+        for name, culmination, max_altitude in zip(
+            windows["names"], windows["culminations"], windows["max_altitudes"]
+        ):
+            entry = night.schedule[name]
+            peak = max(zip(entry["times"], entry["altitudes"]), key=lambda item: item[1])
+            assert num2date(culmination) == peak[0]
+            assert max_altitude == peak[1].to_value(u.deg)
+
+    path = str(tmp_path / f"plan.{fmt}")
+    n_records = schedule.export(path)
+    n_windows = sum(len(night.schedule) for night in planned_nights)
+    n_runs = sum(len(runs) for runs in schedule.allocation.runs.values())
+    assert n_records == n_windows + n_runs > 0
+
+    if fmt == "ics":
+        with open(path, newline="") as ics_file:
+            text = ics_file.read()
+        assert text.startswith("BEGIN:VCALENDAR\r\n")
+        assert text.count("BEGIN:VEVENT") == n_records
+        return
+
+    if fmt == "csv":
+        records = pd.read_csv(path, parse_dates=["start", "end", "culmination"])
+    elif fmt == "jsonl":
+        records = pd.read_json(path, lines=True, convert_dates=["start", "end", "culmination"])
+    else:
+        records = pd.read_parquet(path)
+    assert list(records.columns) == list(export.COLUMNS)
+    assert len(records) == n_records
+
+    first = planned_nights[0]
+    name = next(iter(first.schedule))
+    window = records[(records["kind"] == "window") & (records["target"] == name)].iloc[0]
+    assert window["night"] == f"{first.date:%Y-%m-%d}"
+    assert window["start"] == first.schedule[name]["start"]
+    runs = records[records["kind"] == "run"]
+    assert runs["culmination"].isna().all()
+    with pytest.raises(ValueError):
+        schedule.export(str(tmp_path / "plan.txt"))
+
+
+def test_benchmarks(tmp_path, monkeypatch):
+    # the caches next to a deployed configuration are not used
+    site_config = tmp_path / "config" / "site_config.json"
+    site_config.parent.mkdir()
+    site_config.write_text(json.dumps(observer_config.default_observer_config()))
+    monkeypatch.setenv("IOP_SITE_CONFIG", str(site_config))
+    run_benchmarks.run_benchmarks(
+        {"nights": [1], "targets": [2], "samples": [20]}, repeat=2, stages=["plan_targets"]
+    )
+    assert os.listdir(site_config.parent) == ["site_config.json"]
+    assert os.environ["IOP_SITE_CONFIG"] == str(site_config)
+    monkeypatch.delenv("IOP_SITE_CONFIG")
+
+    output = str(tmp_path / "benchmark_results.json")
+    scales = {"nights": [1], "targets": [2], "samples": [20]}
+    results = run_benchmarks.run_benchmarks(scales, repeat=1)
+    with open(output, "w") as output_file:
+        json.dump(results, output_file)
+
+    stages = {result["stage"] for result in results["results"]}
+    assert stages == {
+        "resolve_target_list",
+        "resolve_target_names",
+        "find_sun_rise_and_set",
+        "calculate_moon_positions",
+        "plan_target",
+        "plan_targets",
+    }
+    for result in results["results"]:
+        assert result["wall_time"] > 0
+        assert result["peak_memory"] > 0
+
+    assert run_benchmarks.main(
+        ["--quick", "--repeat", "1", "--stages", "find_sun_rise_and_set",
+         "--output", output, "--compare", output]
+    ) == 0
+
+
+# import time of the command line scripts in seconds
+IMPORT_BUDGET = 0.5
+
+
+@pytest.mark.parametrize("argv", [[], ["--help"]])
+def test_cli_startup(argv):
+    script = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "from iact_observation_planner import iop, iop_init\n"
+        "import_time = time.perf_counter() - start\n"
+        f"sys.argv = ['iop'] + {argv!r}\n"
+        "try:\n"
+        "    iop.main()\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        "heavy = ['astropy', 'matplotlib', 'pandas', 'ephem', 'numpy']\n"
+        "print(import_time, [name for name in heavy if name in sys.modules])\n"
+    )
+    output = sp.check_output(["python", "-c", script]).decode().splitlines()[-1]
+    import_time, loaded = output.split(" ", 1)
+    assert loaded == "[]"
+    assert float(import_time) < IMPORT_BUDGET
+
+
+def test_profiling(tmp_path):
+    targets = iop_targets.resolve_target_list(offline_targets)
+    site = iact_observation_planner.parse_site("HESS")["site"]
+    dark = iact_observation_planner.parse_darkness("dark")["darkness"]
+
+    def plan():
+        planned_nights = nights.setup_nights(
+            datetime(2021, 3, 20), site, dark, timedelta(days=2)
+        )
+        nights.plan_nights(planned_nights, targets)
+        Schedule(planned_nights, allocation.allocate(planned_nights, targets, "28 min"))
+        return planned_nights
+
+    # nothing is recorded while profiling is disabled
+    assert not profiling.enabled()
+    plan()
+    assert profiling.report() is None
+
+    profiler = profiling.enable()
+    planned_nights = plan()
+    trace_path = str(tmp_path / "trace.json")
+    assert profiling.report(trace_path) is profiler
+    assert not profiling.enabled()
+
+    stages = profiler.stages()
+    assert stages["setup_nights"][0] == 1
+    assert stages["find_sun_rise_and_set"][0] == 2
+    assert stages["calculate_moon_positions"][0] == 2
+    assert stages["calculate_targets"][0] == 2
+    assert stages["visibility_mask"][0] == 2
+    assert stages["layout_schedule"][0] == 1
+    # nested stages are included in the total of the outer stage
+    assert stages["setup_nights"][1] >= stages["find_sun_rise_and_set"][1]
+    assert profiler.counters["target_positions"] == sum(
+        night.n_evaluations for night in planned_nights
+    )
+
+    with open(trace_path) as trace_file:
+        trace = json.load(trace_file)
+    events = trace["traceEvents"]
+    assert len(events) == sum(calls for calls, _ in stages.values())
+    assert {event["ph"] for event in events} == {"X"}
+    assert all(event["dur"] >= 0 for event in events)
+    assert trace["otherData"]["stages"]["setup_nights"]["calls"] == 1
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_planner_server(monkeypatch, workers):
+    service = server.PlannerService(workers=workers, offline=True)
+    assert (service.executor is None) == (workers == 1)
+
+    # the requests are planned in the pool of the service, no new pools
+    def new_pool(*args, **kwargs):
+        raise AssertionError("started a process pool for a request")
+
+    monkeypatch.setattr(nights, "ProcessPoolExecutor", new_pool)
+    planner = server.PlannerServer(("127.0.0.1", 0), service)
+    thread = threading.Thread(target=planner.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{planner.server_address[1]}"
+
+    def request(path, query=None):
+        data = None if query is None else json.dumps(query).encode()
+        try:
+            with urllib.request.urlopen(url + path, data, timeout=60) as response:
+                return response.status, json.load(response)
+        except urllib.error.HTTPError as error:
+            return error.code, json.load(error)
+
+    query = {"targets": offline_targets, "site": "HESS", "date": "2021-03-20", "range": 2}
+    try:
+        status, first = request("/plan", query)
+        assert status == 200
+        assert first["planned_cells"] == 2 * len(offline_targets)
+        assert {record["kind"] for record in first["records"]} == {"window", "run"}
+        assert set(first["allocated_hours"]) == set(first["requested_hours"])
+
+        # repeated and concurrent queries are answered from the warm session
+        responses = [None] * 4
+
+        def repeat(i):
+            responses[i] = request("/plan", query)
+
+        threads = [threading.Thread(target=repeat, args=(i,)) for i in range(4)]
+        for repeating in threads:
+            repeating.start()
+        for repeating in threads:
+            repeating.join()
+        for status, response in responses:
+            assert status == 200
+            assert response["planned_cells"] == 0
+            assert response["records"] == first["records"]
+
+        status, visibility = request("/visibility", query)
+        assert status == 200
+        assert "allocated_hours" not in visibility
+        assert visibility["records"] == [
+            record for record in first["records"] if record["kind"] == "window"
+        ]
+
+        status, health = request("/health")
+        assert status == 200
+        assert health["requests"] == 6
+        assert health["sessions"] == ["HESS/dark/astropy/grid/1.0"]
+
+        assert request("/plan", {**query, "site": "NOWHERE"})[0] == 400
+        assert request("/plan", {**query, "range": 0})[0] == 400
+        assert request("/plan", {**query, "range": server.MAX_RANGE + 1})[0] == 400
+        too_many = ["rd/83.6d,22d/x"] * (server.MAX_TARGETS + 1)
+        assert request("/plan", {**query, "targets": too_many})[0] == 400
+        assert request("/plan", {**query, "targets": ["unknown target"]})[0] == 400
+        assert request("/plan", {**query, "targets": ["rd/83.6d,22d/x;high"]})[0] == 400
+        assert request("/plan", {**query, "targets": ["rd/83.6d,22d/x;30;y"]})[0] == 400
+        assert request("/unknown")[0] == 404
+
+        # only the nights of the last query are kept
+        status, _ = request("/visibility", {**query, "date": "2021-04-01", "range": 3})
+        assert status == 200
+        (session,) = service.sessions.values()
+        assert sorted(session._nights) == [datetime(2021, 4, d) for d in (1, 2, 3)]
+
+        def timeout(name):
+            raise TimeoutError(name)
+
+        monkeypatch.setattr(iop_targets, "RETRY_DELAY", 0.0)
+        monkeypatch.setattr(
+            service, "target_cache", iop_targets.TargetCache(resolver=timeout)
+        )
+        status, response = request("/plan", {**query, "targets": ["Slow Source"]})
+        assert status == 400
+        assert "timed out" in response["error"]
+    finally:
+        planner.shutdown()
+        planner.server_close()
+        service.close()
+
+
+@pytest.mark.parametrize("test_dark", ["dark", "bright"])
+def test_survey_hours(tmp_path, monkeypatch, test_dark):
+    targets = iop_targets.resolve_target_list(offline_targets)
+    site = iact_observation_planner.parse_site("HESS")["site"]
+    dark = iact_observation_planner.parse_darkness(test_dark)["darkness"]
+    date, plan_range = datetime(2021, 3, 1), timedelta(days=31)
+
+    hours = survey.survey_hours(targets, site, dark, date, plan_range, step=60)
+    assert list(hours.columns) == ["2021-03"]
+    assert list(hours.index) == [target.name for target in targets]
+
+    # the same hours as the windows of the planned nights
+    planned_nights = nights.setup_nights(date, site, dark, plan_range, engine="fast")
+    nights.plan_nights(planned_nights, targets)
+    planned = dict.fromkeys(hours.index, 0.0)
+    for night in planned_nights:
+        windows = night.schedule.windows()
+        for name, start, end in zip(
+            windows["names"], windows["starts"], windows["ends"]
+        ):
+            planned[name] += (end - start) * 24
+    for name, planned_hours in planned.items():
+        assert hours.loc[name, "2021-03"] == pytest.approx(
+            planned_hours, rel=0.02, abs=0.2
+        )
+
+    # chunks, workers and a precomputed season give the same months
+    date, plan_range = datetime(2021, 2, 20), timedelta(days=20)
+    hours = survey.survey_hours(targets, site, dark, date, plan_range)
+    monkeypatch.setattr(survey, "TARGET_CHUNK", 2)
+    monkeypatch.setattr(survey, "TIME_CHUNK", 1000)
+    chunked = survey.survey_hours(targets, site, dark, date, plan_range, workers=2)
+    monkeypatch.undo()
+    assert list(hours.columns) == ["2021-02", "2021-03"]
+    np.testing.assert_allclose(chunked.values, hours.values)
+
+    season_ephemeris = season.SeasonEphemeris.build(
+        site, datetime(2021, 2, 19), datetime(2021, 3, 14)
+    )
+    from_season = survey.survey_hours(
+        targets, site, dark, date, plan_range, season=season_ephemeris
+    )
+    np.testing.assert_allclose(from_season.values, hours.values, atol=0.25)
+
+    path = str(tmp_path / "survey.csv")
+    assert survey.write_survey(hours, path) == len(targets)
+    written = pd.read_csv(path, index_col="target")
+    np.testing.assert_allclose(written.values, hours.values, atol=1e-4)
+    with pytest.raises(ValueError):
+        survey.write_survey(hours, str(tmp_path / "survey.txt"))
+
+
+def test_survey_targets_output(tmp_path, monkeypatch):
+    # the output is checked before the targets are resolved and surveyed
+    def resolve_targets(*args):
+        raise AssertionError("resolved the targets of an invalid output")
+
+    monkeypatch.setattr(iact_observation_planner, "resolve_targets", resolve_targets)
+    with pytest.raises(ValueError):
+        iact_observation_planner.survey_targets(
+            offline_targets, "HESS", "dark", "2021-03-01", 31, str(tmp_path / "a.txt")
+        )
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    with pytest.raises(ImportError):
+        iact_observation_planner.survey_targets(
+            offline_targets,
+            "HESS",
+            "dark",
+            "2021-03-01",
+            31,
+            str(tmp_path / "a.parquet"),
+        )
+    assert survey.check_output("survey.CSV") == "csv"